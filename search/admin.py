@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GenerationJob, PopularQuery
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ("query", "status", "priority", "attempts", "created_at", "finished_at")
+    list_filter = ("status",)
+    search_fields = ("query",)
+
+
+@admin.register(PopularQuery)
+class PopularQueryAdmin(admin.ModelAdmin):
+    # Delete a query here to stop suggesting it
+    list_display = ("text", "count", "last_searched")
+    search_fields = ("text",)
@@ -0,0 +1,71 @@
+"""
+Python counterpart of the `content_analyzer` defined in the index mapping
+(standard tokenizer, lowercase, English stop words), for code that scores
+or normalizes text outside Elasticsearch.
+
+`query_terms` goes further for cache keys: it also drops the longer stop
+word list in data/stopwords.large and stems what is left, so that
+differently worded questions about the same thing share a key.
+"""
+import os
+import re
+
+# Elasticsearch's default `_english_` stop word list used by the `stop` filter
+STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in",
+    "into", "is", "it", "no", "not", "of", "on", "or", "such", "that", "the",
+    "their", "then", "there", "these", "they", "this", "to", "was", "will", "with",
+])
+
+# Letters and digits, keeping inner apostrophes and dots ("don't", "1.5")
+TOKEN_RE = re.compile(r"\w+(?:['.]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stopwords.large")
+
+# Words from stopwords.large that change what a medical question asks
+KEEP_WORDS = frozenset([
+    "no", "not", "non", "nor", "never", "none", "nothing", "cannot", "cant", "without", "against",
+    "unlikely", "less", "least", "more", "most", "best", "better", "new", "old", "first", "second",
+    "before", "after", "during", "above", "below", "under", "over", "cause", "causes", "changes",
+    "help", "use", "uses", "used", "using", "value", "zero", "one", "two", "three", "four",
+    "five", "six", "seven", "eight", "nine", "twice",
+])
+
+
+def load_query_stopwords(path: str = STOPWORDS_FILE) -> frozenset:
+    with open(path, encoding="utf-8") as f:
+        words = {line.strip().lower() for line in f}
+    # Drop the list's contraction fragments; TOKEN_RE never produces them
+    words = {word for word in words if word and word[0].isalnum()}
+    return frozenset((words | STOPWORDS) - KEEP_WORDS)
+
+
+QUERY_STOPWORDS = load_query_stopwords()
+
+
+def stem(token: str) -> str:
+    """
+    Plural stripping, like Elasticsearch's `minimal_english` stemmer.
+    """
+    if len(token) < 3 or token[-1] != "s":
+        return token
+    if token.endswith("ies") and not token.endswith(("eies", "aies")):
+        return token[:-3] + "y"
+    if token.endswith("es") and not token.endswith(("aes", "ees", "oes")):
+        return token[:-1]
+    if not token.endswith(("us", "ss")):
+        return token[:-1]
+    return token
+
+
+def query_terms(query: str) -> list[str]:
+    """
+    Sorted distinct stems of the query's content words.
+    """
+    words = TOKEN_RE.findall(query.lower())
+    return sorted({stem(word) for word in words if word not in QUERY_STOPWORDS})
@@ -1,6 +1,36 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+# Programs that serve requests, besides `manage.py runserver`
+SERVER_PROGRAMS = ("gunicorn", "uvicorn", "daphne", "hypercorn", "uwsgi")
+
+
+def serving() -> bool:
+    """
+    Whether this process is a server, started as `manage.py runserver` or
+    one of SERVER_PROGRAMS (also with `python -m`). Tests, shells and other
+    commands serve no requests.
+    """
+    program = os.path.basename(sys.argv[0])
+    if program == "__main__.py":
+        program = os.path.basename(os.path.dirname(sys.argv[0]))
+    if program in ("manage.py", "django-admin"):
+        return len(sys.argv) > 1 and sys.argv[1] == "runserver"
+    return program in SERVER_PROGRAMS
+
+
 class SearchConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'search'
+
+    def ready(self):
+        from . import checks  # Registers the system checks
+
+        # Connect in the background so the worker starts serving at once
+        from .clients import start_warm_up
+
+        if serving():
+            start_warm_up()
@@ -0,0 +1,344 @@
+"""
+Retrieval backends behind the search views.
+
+Every backend returns responses shaped like an Elasticsearch search
+response (`hits.total.value`, `hits.hits[]._id/_score/_source`) so the
+views don't care where the hits came from. Select one with the
+SEARCH_BACKEND setting.
+"""
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .deadline import MIN_REQUEST_TIMEOUT, ahedged, hedged, time_left
+from .clients import get_async_es, get_es
+from .metrics import add_timing, record_took, upstream_call
+from .passages import attach_passages, build_passage_search_body, group_passage_hits
+from .rag import (
+    EXPANSION_FIELDS,
+    INDEX_NAME,
+    PASSAGE_INDEX_NAME,
+    PASSAGES_PER_DOC,
+    QUERY_FIELDS,
+    RESULT_FIELDS,
+    RESULTS_MAX_WINDOW,
+    SOURCE_FIELDS,
+    build_results_body,
+    build_search_body,
+)
+
+BACKENDS = {
+    "elasticsearch": "search.backends.ElasticsearchBackend",
+    "local": "search.backends.LocalBackend",
+}
+
+
+class SearchBackend:
+    name = None
+
+    def search(self, query: str, expanded_terms: list[str], size: int) -> dict:
+        raise NotImplementedError
+
+    async def asearch(self, query: str, expanded_terms: list[str], size: int) -> dict:
+        return await sync_to_async(self.search)(query, expanded_terms, size)
+
+    def search_passages(self, query: str, expanded_terms: list[str], size: int, per_doc: int) -> dict:
+        """
+        Document hits that carry their best `passages`. Without a passages
+        index they are cut from each hit's main_text.
+        """
+        return attach_passages(self.search(query, expanded_terms, size), query, expanded_terms, per_doc)
+
+    async def asearch_passages(self, query: str, expanded_terms: list[str], size: int, per_doc: int) -> dict:
+        return await sync_to_async(self.search_passages)(query, expanded_terms, size, per_doc)
+
+    def search_page(self, query: str, expanded_terms: list[str], size: int, tags: list[str] = (),
+                    fields: list[str] = RESULT_FIELDS, search_after: list | None = None) -> dict:
+        """
+        One page of hits sorted by score then ID, each with its `sort`
+        values for the next page's `search_after`.
+
+        This version ranks the top RESULTS_MAX_WINDOW hits and pages through
+        them in Python, filtering on `topics_tags` from the stored fields.
+        """
+        res = self.search(query, expanded_terms, RESULTS_MAX_WINDOW)
+        hits = [hit for hit in res["hits"]["hits"]
+                if set(tags) <= set(hit["_source"].get("topics_tags", []))]
+        hits.sort(key=lambda hit: (-hit["_score"], hit["_id"]))
+        total = len(hits)
+        # Hits beyond the window were never ranked, so the count is a lower bound
+        relation = "gte" if res["hits"]["total"]["value"] > RESULTS_MAX_WINDOW else "eq"
+        if search_after:
+            after = (-search_after[0], search_after[1])
+            hits = [hit for hit in hits if (-hit["_score"], hit["_id"]) > after]
+
+        page = []
+        for hit in hits[:size]:
+            source = {field: hit["_source"][field] for field in fields if field in hit["_source"]}
+            page.append(dict(hit, _source=source, sort=[hit["_score"], hit["_id"]]))
+        return {
+            "took": res.get("took"),
+            "hits": {
+                "total": {"value": total, "relation": relation},
+                "hits": page,
+            },
+        }
+
+    def search_many(self, searches: list[tuple[str, list[str], int]], passages: bool = False) -> list[dict | Exception]:
+        """
+        Run several (query, expanded_terms, size) searches. A failed search
+        yields its exception in place of a response.
+        """
+        results = []
+        for query, expanded_terms, size in searches:
+            try:
+                if passages:
+                    results.append(self.search_passages(query, expanded_terms, size, PASSAGES_PER_DOC))
+                else:
+                    results.append(self.search(query, expanded_terms, size))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def get_documents(self, doc_ids: list[str]) -> dict[str, dict]:
+        """
+        Hits (`_index`, `_id` and `_source`) for the given documents, keyed
+        by ID. Unknown IDs are left out.
+        """
+        raise NotImplementedError
+
+
+def _budgeted(client):
+    """
+    `client` with its request timeout cut to what is left of the request's
+    latency budget, but no shorter than MIN_REQUEST_TIMEOUT.
+    """
+    return client.options(request_timeout=max(time_left(cap=settings.ES_REQUEST_TIMEOUT), MIN_REQUEST_TIMEOUT))
+
+
+class ElasticsearchBackend(SearchBackend):
+    name = "elasticsearch"
+
+    def __init__(self, index_name: str = INDEX_NAME, passage_index_name: str = PASSAGE_INDEX_NAME):
+        self.index_name = index_name
+        self.passage_index_name = passage_index_name
+
+    # Searches are hedged: one still running after SEARCH_HEDGE_DELAY gets a
+    # backup request and the first response wins
+
+    def _search(self, index: str, body: dict):
+        return hedged(lambda: _budgeted(get_es()).search(index=index, body=body), self.name,
+                      settings.SEARCH_HEDGE_DELAY)
+
+    async def _asearch(self, index: str, body: dict):
+        return await ahedged(lambda: _budgeted(get_async_es()).search(index=index, body=body), self.name,
+                             settings.SEARCH_HEDGE_DELAY)
+
+    def search(self, query, expanded_terms, size):
+        return self._search(self.index_name, dict(build_search_body(query, expanded_terms), size=size))
+
+    async def asearch(self, query, expanded_terms, size):
+        return await self._asearch(self.index_name, dict(build_search_body(query, expanded_terms), size=size))
+
+    def search_passages(self, query, expanded_terms, size, per_doc):
+        body = build_passage_search_body(query, expanded_terms, size, per_doc)
+        return group_passage_hits(self._search(self.passage_index_name, body))
+
+    async def asearch_passages(self, query, expanded_terms, size, per_doc):
+        body = build_passage_search_body(query, expanded_terms, size, per_doc)
+        return group_passage_hits(await self._asearch(self.passage_index_name, body))
+
+    def search_page(self, query, expanded_terms, size, tags=(), fields=RESULT_FIELDS, search_after=None):
+        return self._search(self.index_name, build_results_body(query, expanded_terms, size, tags, fields,
+                                                                search_after))
+
+    def search_many(self, searches, passages=False):
+        """
+        All searches in one `_msearch` round trip.
+        """
+        if not searches:
+            return []
+        body = []
+        for query, expanded_terms, size in searches:
+            body.append({})
+            if passages:
+                body.append(build_passage_search_body(query, expanded_terms, size, PASSAGES_PER_DOC))
+            else:
+                body.append(dict(build_search_body(query, expanded_terms), size=size))
+        res = _budgeted(get_es()).msearch(index=self.passage_index_name if passages else self.index_name, searches=body)
+
+        results = []
+        for item in res["responses"]:
+            if "error" in item:
+                error = item["error"]
+                reason = error.get("reason", error.get("type")) if isinstance(error, dict) else error
+                results.append(RuntimeError(f"Search failed: {reason}"))
+            else:
+                results.append(group_passage_hits(item) if passages else item)
+        return results
+
+    def get_documents(self, doc_ids):
+        if not doc_ids:
+            return {}
+        res = _budgeted(get_es()).mget(index=self.index_name, ids=doc_ids, source=SOURCE_FIELDS)
+        return {doc["_id"]: {"_index": doc["_index"], "_id": doc["_id"], "_source": doc["_source"]}
+                for doc in res["docs"] if doc.get("found")}
+
+
+class LocalBackend(SearchBackend):
+    """
+    BM25 over the memory-mapped index built by `manage.py build_local_index`.
+    Scoring is CPU-bound and fast enough to run inline in async views.
+    """
+    name = "local"
+
+    def __init__(self, path: str | None = None):
+        self.path = path or settings.LOCAL_INDEX_DIR
+
+    @property
+    def index(self):
+        # Looked up per search so that a rebuilt index is picked up
+        from .local_index import load_index
+
+        return load_index(self.path)
+
+    def search(self, query, expanded_terms, size):
+        start = time.perf_counter()
+        res = self.index.search(query, expanded_terms, size, QUERY_FIELDS, EXPANSION_FIELDS)
+        res["took"] = round((time.perf_counter() - start) * 1000, 3)
+        return res
+
+    async def asearch(self, query, expanded_terms, size):
+        return self.search(query, expanded_terms, size)
+
+    async def asearch_passages(self, query, expanded_terms, size, per_doc):
+        return self.search_passages(query, expanded_terms, size, per_doc)
+
+    def get_documents(self, doc_ids):
+        index = self.index
+        positions = index.position_by_id
+        return {doc_id: {"_index": index.index_name, "_id": doc_id, "_source": index.source(positions[doc_id])}
+                for doc_id in doc_ids if doc_id in positions}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str | None = None) -> SearchBackend:
+    name = name or settings.SEARCH_BACKEND
+    return import_string(BACKENDS.get(name, name))()
+
+
+def hybrid_search(backend: SearchBackend, query: str, expanded_terms: list[str], size: int) -> dict:
+    """
+    Fuse BM25 hits from `backend` with dense hits from the vector index by
+    reciprocal rank fusion. Scores in the response are RRF scores.
+    """
+    from .dense import get_encoder, load_dense_index, reciprocal_rank_fusion
+
+    candidates = max(size, settings.HYBRID_CANDIDATES)
+    start = time.perf_counter()
+
+    lexical = backend.search(query, expanded_terms, candidates)
+    lexical_hits = {hit["_id"]: hit for hit in lexical["hits"]["hits"]}
+
+    dense_index = load_dense_index(settings.DENSE_INDEX_DIR)
+    dense = dense_index.search(get_encoder().encode([query])[0], candidates)
+
+    fused = reciprocal_rank_fusion([list(lexical_hits), [doc_id for doc_id, _ in dense]],
+                                   k=settings.HYBRID_RRF_K)[:size]
+    missing = [doc_id for doc_id, _ in fused if doc_id not in lexical_hits]
+    documents = backend.get_documents(missing)
+
+    hits = []
+    for doc_id, score in fused:
+        if doc_id in lexical_hits:
+            hit = dict(lexical_hits[doc_id], _score=score)
+        elif doc_id in documents:
+            hit = dict(documents[doc_id], _score=score)
+        else:
+            continue  # Vector index is ahead of the search index
+        hits.append(hit)
+
+    return {
+        "took": round((time.perf_counter() - start) * 1000, 3),
+        "hits": {
+            "total": {"value": len(set(lexical_hits) | {doc_id for doc_id, _ in dense}), "relation": "eq"},
+            "max_score": hits[0]["_score"] if hits else None,
+            "hits": hits,
+        },
+    }
+
+
+def retrieve(query: str, expanded_terms: list[str], size: int, mode: str = "bm25") -> dict:
+    """
+    Retrieve with the configured backend, either lexical only ('bm25') or
+    fused with dense retrieval ('hybrid').
+    """
+    backend = get_backend()
+    with upstream_call(backend.name):
+        if mode == "hybrid":
+            res = hybrid_search(backend, query, expanded_terms, size)
+            if settings.SEARCH_PASSAGES:
+                res = attach_passages(res, query, expanded_terms, PASSAGES_PER_DOC)
+        elif settings.SEARCH_PASSAGES:
+            res = backend.search_passages(query, expanded_terms, size, PASSAGES_PER_DOC)
+        else:
+            res = backend.search(query, expanded_terms, size)
+    record_took(res, backend.name, mode)
+    return res
+
+
+def retrieve_page(query: str, expanded_terms: list[str], size: int, tags: list[str] = (),
+                  fields: list[str] = RESULT_FIELDS, search_after: list | None = None) -> dict:
+    """
+    One page of lexical hits for the retrieval-only endpoint.
+    """
+    backend = get_backend()
+    with upstream_call(backend.name):
+        res = backend.search_page(query, expanded_terms, size, tags, fields, search_after)
+    record_took(res, backend.name, "page")
+    return res
+
+
+def retrieve_many(searches: list[tuple[str, list[str], int]], mode: str = "bm25") -> list[dict | Exception]:
+    """
+    Batch counterpart of retrieve. Lexical searches share one backend call
+    (a single `_msearch` on Elasticsearch); hybrid searches run one by one.
+    Failed searches yield their exception.
+    """
+    backend = get_backend()
+    if mode == "hybrid":
+        results = []
+        for query, expanded_terms, size in searches:
+            try:
+                results.append(retrieve(query, expanded_terms, size, mode))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    with upstream_call(backend.name):
+        results = backend.search_many(searches, passages=settings.SEARCH_PASSAGES)
+    took = [res["took"] for res in results if not isinstance(res, Exception) and res.get("took") is not None]
+    for res in results:
+        if not isinstance(res, Exception):
+            record_took(res, backend.name, mode, timing=False)
+    if took:
+        add_timing("took", max(took))  # The batch waits for its slowest search
+    return results
+
+
+async def aretrieve(query: str, expanded_terms: list[str], size: int, mode: str = "bm25") -> dict:
+    backend = get_backend()
+    with upstream_call(backend.name):
+        if mode == "hybrid":
+            res = await sync_to_async(hybrid_search)(backend, query, expanded_terms, size)
+            if settings.SEARCH_PASSAGES:
+                res = attach_passages(res, query, expanded_terms, PASSAGES_PER_DOC)
+        elif settings.SEARCH_PASSAGES:
+            res = await backend.asearch_passages(query, expanded_terms, size, PASSAGES_PER_DOC)
+        else:
+            res = await backend.asearch(query, expanded_terms, size)
+    record_took(res, backend.name, mode)
+    return res
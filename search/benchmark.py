@@ -0,0 +1,163 @@
+"""
+Load generation and latency statistics for `manage.py benchmark`.
+
+Requests go through Django's test clients in-process, so the whole
+middleware and view stack runs while Elasticsearch and the LLM are
+replaced by the stand-ins in search.standins. Per-stage latencies come
+from each response's `Server-Timing` header.
+"""
+import asyncio
+import csv
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import AsyncClient, Client
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_queries(path: str, limit: int | None = None) -> list[str]:
+    """
+    Queries from an NFCorpus `.queries` file (`<id>\\t<text>`) or a plain
+    file with one query per line.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            text = line.rstrip("\n").split("\t")[-1].strip()
+            if text:
+                queries.append(text)
+    return queries[:limit] if limit else queries
+
+
+def queries_from_titles(path: str, limit: int) -> list[str]:
+    """
+    Fallback workload: document titles from the tab-separated dump.
+    """
+    csv.field_size_limit(10000000)
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if len(row) > 2 and row[2].strip():
+                queries.append(row[2].strip())
+            if len(queries) >= limit:
+                break
+    return queries
+
+
+def parse_server_timing(header: str) -> dict[str, float]:
+    """
+    'expansion;dur=12.5, retrieval;dur=3.1' -> {'expansion': 12.5, 'retrieval': 3.1}.
+    Repeated names are summed.
+    """
+    timings = defaultdict(float)
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                timings[name.strip()] += float(value)
+    return dict(timings)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile of an unsorted list.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: list[float]) -> dict:
+    if not values:
+        return {}
+    summary = {f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 3)
+    summary["max"] = round(max(values), 3)
+    summary["count"] = len(values)
+    return summary
+
+
+class Sample:
+    def __init__(self, status: int, total_ms: float, stages: dict[str, float]):
+        self.status = status
+        self.total_ms = total_ms
+        self.stages = stages
+
+
+def _sync_request(client: Client, endpoint: str, query: str, k: int) -> Sample:
+    start = time.perf_counter()
+    response = client.get(endpoint, {"q": query, "k": k})
+    total_ms = (time.perf_counter() - start) * 1000
+    return Sample(response.status_code, total_ms, parse_server_timing(response.get("Server-Timing", "")))
+
+
+async def _async_request(client: AsyncClient, endpoint: str, query: str, k: int, streaming: bool) -> Sample:
+    start = time.perf_counter()
+    response = await client.get(endpoint, {"q": query, "k": k})
+    stages = parse_server_timing(response.get("Server-Timing", ""))
+    if streaming:
+        # Drain the event stream, noting when the first answer token arrives
+        async for chunk in response.streaming_content:
+            if "first_token" not in stages and b"event: token" in chunk:
+                stages["first_token"] = (time.perf_counter() - start) * 1000
+    total_ms = (time.perf_counter() - start) * 1000
+    return Sample(response.status_code, total_ms, stages)
+
+
+def run_sync(endpoint: str, queries: list[str], concurrency: int, k: int) -> tuple[list[Sample], float]:
+    """
+    Send every query once from `concurrency` threads. Returns the samples
+    and the wall-clock duration in seconds.
+    """
+    clients = {}
+
+    def send(query):
+        # One test client per thread; they keep cookies and are not thread-safe
+        client = clients.setdefault(threading.get_ident(), Client())
+        return _sync_request(client, endpoint, query, k)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(send, queries))
+    return samples, time.perf_counter() - start
+
+
+async def run_async(endpoint: str, queries: list[str], concurrency: int, k: int,
+                    streaming: bool = False) -> tuple[list[Sample], float]:
+    """
+    Send every query once with at most `concurrency` requests in flight.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncClient()
+
+    async def send(query):
+        async with semaphore:
+            return await _async_request(client, endpoint, query, k, streaming)
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*(send(query) for query in queries))
+    return list(samples), time.perf_counter() - start
+
+
+def level_report(samples: list[Sample], seconds: float, concurrency: int) -> dict:
+    ok = [sample for sample in samples if sample.status < 400]
+    stages = defaultdict(list)
+    for sample in ok:
+        for name, value in sample.stages.items():
+            stages[name].append(value)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(samples) / seconds, 3) if seconds else None,
+        "latency_ms": {
+            "request": summarize([sample.total_ms for sample in ok]),
+            **{name: summarize(values) for name, values in sorted(stages.items())},
+        },
+    }
@@ -0,0 +1,247 @@
+import hashlib
+import os
+import random
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+from .analysis import query_terms
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    File-based cache that evicts the least recently used entries.
+
+    Django's FileBasedCache culls a random sample once MAX_ENTRIES is reached.
+    Here every hit bumps the file's mtime, so culling can drop the entries that
+    have not been read for the longest time instead. The cache directory is
+    shared, so all gunicorn workers see the same entries and recency.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def last_used(fname):
+            try:
+                return os.path.getmtime(fname)
+            except FileNotFoundError:
+                return 0
+
+        filelist.sort(key=last_used)
+        for fname in filelist[:max(1, num_entries // self._cull_frequency)]:
+            self._delete(fname)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so trivially different spellings share a cache key.
+    """
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def canonical_query(query: str) -> str:
+    """
+    The query's sorted content word stems, so that "what causes diabetes",
+    "causes of diabetes?" and "diabetes causes" share a cache key. Queries
+    made only of stop words fall back to normalize_query.
+    """
+    return " ".join(query_terms(query)) or normalize_query(query)
+
+
+# MinHash signatures of MINHASH_BANDS x MINHASH_ROWS values. Two queries
+# whose term sets have Jaccard similarity s share a band with probability
+# 1 - (1 - s^2)^16: over 0.9999 at s = 0.8, 0.64 at s = 0.25.
+MINHASH_BANDS = 16
+MINHASH_ROWS = 2
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+# Recent queries remembered per band bucket
+BUCKET_SIZE = 20
+
+# Near-duplicate candidates tried per lookup, most similar first
+MAX_CANDIDATES = 3
+
+
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(terms: set[str]) -> list[int]:
+    hashes = [_term_hash(term) for term in terms]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_digests(terms: set[str]) -> list[str]:
+    """
+    One digest per MinHash band; queries sharing any of them are candidates.
+    """
+    signature = minhash(terms)
+    digests = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        digests.append(hashlib.sha1(repr(rows).encode("utf-8")).hexdigest()[:16])
+    return digests
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class QueryCache:
+    """
+    Query-keyed cache on top of one of Django's configured caches.
+
+    Keys are derived from the canonical query, and hits and misses are counted
+    in the cache itself so the numbers cover every worker process.
+
+    A miss falls back to near-duplicates: every stored query is also filed
+    under the MinHash bands of its terms, and recent queries sharing a band
+    whose terms overlap by at least QUERY_SIMILARITY_THRESHOLD (Jaccard) are
+    tried with the same extra key parts. The band buckets live in the same
+    cache, so all workers find each other's queries.
+    """
+
+    def __init__(self, alias: str, namespace: str):
+        self.alias = alias
+        self.namespace = namespace
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, query: str, *parts: str) -> str:
+        """
+        Key for the canonical query plus any extra parts that must match
+        exactly (e.g. retrieved document IDs).
+        """
+        return self._key(canonical_query(query), *parts)
+
+    def _key(self, canonical: str, *parts: str) -> str:
+        raw = "\x1f".join([canonical, *parts])
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def get(self, query: str, *parts: str):
+        canonical = canonical_query(query)
+        value = self.backend.get(self._key(canonical, *parts))
+        if value is None and settings.QUERY_SIMILARITY_THRESHOLD < 1:
+            value = self._get_similar(canonical, *parts)
+            if value is not None:
+                self._count("near_hits")
+                # Repeats of this wording become exact hits; it isn't filed
+                # under the bands, so matches don't drift from the original
+                self.backend.set(self._key(canonical, *parts), value)
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def peek(self, query: str, *parts: str):
+        """
+        Like get, for offline tools: neither counted in the stats nor copied
+        to the exact key on a near-duplicate hit.
+        """
+        canonical = canonical_query(query)
+        value = self.backend.get(self._key(canonical, *parts))
+        if value is None and settings.QUERY_SIMILARITY_THRESHOLD < 1:
+            value = self._get_similar(canonical, *parts)
+        return value
+
+    def set(self, query: str, value, *parts: str, timeout=DEFAULT_TIMEOUT):
+        canonical = canonical_query(query)
+        self.backend.set(self._key(canonical, *parts), value, timeout)
+        if settings.QUERY_SIMILARITY_THRESHOLD < 1:
+            self._remember(canonical)
+
+    def similar_queries(self, canonical: str) -> list[str]:
+        """
+        Recently stored canonical queries at least QUERY_SIMILARITY_THRESHOLD
+        similar to `canonical`, most similar first.
+        """
+        terms = set(canonical.split())
+        if not terms:
+            return []
+        buckets = self.backend.get_many(self._bucket_keys(terms)).values()
+        scored = []
+        for candidate in set().union(*buckets) - {canonical}:
+            similarity = jaccard(terms, set(candidate.split()))
+            if similarity >= settings.QUERY_SIMILARITY_THRESHOLD:
+                scored.append((similarity, candidate))
+        scored.sort(reverse=True)
+        return [candidate for _, candidate in scored]
+
+    def _get_similar(self, canonical: str, *parts: str):
+        for candidate in self.similar_queries(canonical)[:MAX_CANDIDATES]:
+            value = self.backend.get(self._key(candidate, *parts))
+            if value is not None:
+                return value
+        return None
+
+    def _bucket_keys(self, terms) -> list[str]:
+        return [f"{self.namespace}:similar:{band}:{digest}" for band, digest in enumerate(band_digests(terms))]
+
+    def _remember(self, canonical: str):
+        """
+        File the query under its band buckets, keeping the newest BUCKET_SIZE
+        per bucket. Concurrent updates can drop a query, which only costs a
+        near-duplicate hit.
+        """
+        terms = set(canonical.split())
+        if not terms:
+            return
+        keys = self._bucket_keys(terms)
+        buckets = self.backend.get_many(keys)
+        updates = {}
+        for key in keys:
+            bucket = buckets.get(key, [])
+            if bucket and bucket[-1] == canonical:
+                continue
+            updates[key] = ([query for query in bucket if query != canonical] + [canonical])[-BUCKET_SIZE:]
+        if updates:
+            self.backend.set_many(updates)
+
+    def stats(self) -> dict:
+        hits = self.backend.get(self._counter_key("hits"), 0)
+        misses = self.backend.get(self._counter_key("misses"), 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "near_hits": self.backend.get(self._counter_key("near_hits"), 0),
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+    def _counter_key(self, name: str) -> str:
+        return f"{self.namespace}:stats:{name}"
+
+    def _count(self, name: str):
+        key = self._counter_key(name)
+        # Counters never expire; add() is a no-op once the key exists.
+        self.backend.add(key, 0, None)
+        try:
+            self.backend.incr(key)
+        except ValueError:
+            # Culled between add() and incr(); start counting again.
+            self.backend.set(key, 1, None)
+
+
+expansion_cache = QueryCache("expansions", "expansion")
+answer_cache = QueryCache("answers", "answer")
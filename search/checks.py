@@ -0,0 +1,45 @@
+"""
+System checks of the search settings, run at startup by runserver,
+generation_worker and `manage.py check`.
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Seconds a job may run past its LLM call's timeout before it is presumed lost
+JOB_TIMEOUT_MARGIN = 30.0
+
+
+@register()
+def check_job_timeout(app_configs, **kwargs):
+    """
+    A job is requeued after SEARCH_JOB_TIMEOUT, so a worker still waiting
+    for its LLM call must not lose it to another worker.
+    """
+    minimum = settings.LLM_REQUEST_TIMEOUT + JOB_TIMEOUT_MARGIN
+    if settings.SEARCH_JOB_TIMEOUT >= minimum:
+        return []
+    return [Error(
+        f"SEARCH_JOB_TIMEOUT ({settings.SEARCH_JOB_TIMEOUT:g}s) must be at least LLM_REQUEST_TIMEOUT "
+        f"plus {JOB_TIMEOUT_MARGIN:g}s ({minimum:g}s).",
+        hint="Raise SEARCH_JOB_TIMEOUT or lower LLM_REQUEST_TIMEOUT.",
+        id="search.E001",
+    )]
+
+
+@register()
+def check_hybrid_encoder(app_configs, **kwargs):
+    """
+    A lexical encoder only re-ranks what BM25 already finds, so hybrid
+    retrieval with it as the default mode is a misconfiguration.
+    """
+    from .dense import encoder_class
+
+    if settings.SEARCH_RETRIEVAL_MODE != "hybrid" or encoder_class().semantic:
+        return []
+    return [Error(
+        f"SEARCH_RETRIEVAL_MODE is 'hybrid' but DENSE_ENCODER ({settings.DENSE_ENCODER!r}) "
+        "only captures lexical overlap.",
+        hint="Use a semantic encoder such as 'sentence-transformers' and rebuild the dense index; "
+             "'hashing' is a placeholder for tests and benchmarks.",
+        id="search.E002",
+    )]
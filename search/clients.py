@@ -0,0 +1,433 @@
+"""
+Upstream clients of the search app: Elasticsearch and the inference API,
+sync and async.
+
+Clients are created on first use in each process, not at import time, so
+importing the app connects to nothing and gunicorn workers never share
+their parent's sockets (the cache is dropped in forked children). Pool
+sizes, timeouts and TCP keep-alive come from settings.
+
+`SearchConfig.ready()` runs `warm_up` in a background thread when a
+server starts. It opens ES_WARMUP_CONNECTIONS pooled connections to
+Elasticsearch and LLM_WARMUP_CONNECTIONS to the inference endpoint, so the
+first requests after a deploy don't pay for TLS handshakes. With
+ES_WARMUP_QUERIES it also runs a few searches to load the index's caches.
+/search/ready/ answers 503 until the warm-up is done, and reports the
+state of the pools.
+
+The async clients bind to the event loop they first run on, so they connect
+on first use rather than during the warm-up.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+from django.conf import settings
+from elastic_transport import AiohttpHttpNode, Urllib3HttpNode
+from elastic_transport._node._http_aiohttp import _NEEDS_CLEANUP_CLOSED
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from huggingface_hub import AsyncInferenceClient, InferenceClient, configure_http_backend, constants, get_session
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds a warm-up request to the inference endpoint may take
+LLM_WARMUP_TIMEOUT = 10.0
+
+_clients = {}
+_overrides = {}
+_lock = threading.Lock()
+_llm_backend_configured = False
+_llm_adapter = None
+_adapter_lock = threading.Lock()
+
+# pending -> running -> done | failed; 'disabled' without CLIENT_WARMUP
+_warmup = {"status": "pending"}
+
+
+def keepalive_socket_options() -> list[tuple]:
+    """
+    TCP keep-alive probes after CLIENT_KEEPALIVE_IDLE idle seconds, so
+    pooled connections aren't dropped silently by firewalls and load
+    balancers between requests.
+    """
+    if settings.CLIENT_KEEPALIVE_IDLE <= 0:
+        return []
+    idle = int(settings.CLIENT_KEEPALIVE_IDLE)
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, "TCP_KEEPIDLE"):  # Not on macOS
+        options += [(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle),
+                    (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4))]
+    return options
+
+
+class KeepAliveNode(Urllib3HttpNode):
+    def __init__(self, config):
+        super().__init__(config)
+        self.pool.conn_kw["socket_options"] = [*self.pool.ConnectionCls.default_socket_options,
+                                               *keepalive_socket_options()]
+
+
+def _keepalive_socket(addr_info) -> socket.socket:
+    family, type_, proto, _, _ = addr_info
+    sock = socket.socket(family=family, type=type_, proto=proto)
+    for level, name, value in keepalive_socket_options():
+        sock.setsockopt(level, name, value)
+    return sock
+
+
+class KeepAliveAsyncNode(AiohttpHttpNode):
+    """
+    Async counterpart of KeepAliveNode. aiohttp also closes connections
+    that idled for 15 seconds; with keep-alive probes they stay pooled.
+    """
+
+    def _create_aiohttp_session(self):
+        # As AiohttpHttpNode's, which is created on the first request
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        keepalive = bool(keepalive_socket_options())
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            skip_auto_headers=("accept", "accept-encoding", "user-agent"),
+            auto_decompress=True,
+            loop=self._loop,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            connector=aiohttp.TCPConnector(
+                limit_per_host=self._connections_per_node,
+                use_dns_cache=True,
+                enable_cleanup_closed=_NEEDS_CLEANUP_CLOSED,
+                ssl=self._ssl_context or False,
+                keepalive_timeout=None if keepalive else 15.0,
+                socket_factory=_keepalive_socket if keepalive else None,
+            ),
+        )
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    Transport adapter of the inference client's sessions, with a pool of
+    LLM_MAX_CONNECTIONS connections and TCP keep-alive. The sessions of all
+    threads share one adapter, so a connection opened by one (or by the
+    warm-up) serves the others.
+    """
+
+    def __init__(self):
+        super().__init__(pool_maxsize=settings.LLM_MAX_CONNECTIONS)
+
+    def init_poolmanager(self, *args, **kwargs):
+        from urllib3.connection import HTTPConnection
+
+        kwargs["socket_options"] = [*HTTPConnection.default_socket_options, *keepalive_socket_options()]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _llm_session():
+    global _llm_adapter
+    with _adapter_lock:
+        if _llm_adapter is None:
+            _llm_adapter = KeepAliveAdapter()
+    session = requests.Session()
+    session.mount("http://", _llm_adapter)
+    session.mount("https://", _llm_adapter)
+    return session
+
+
+def llm_endpoint() -> str:
+    """
+    URL of the model the views call on the inference API.
+    """
+    from .mistral_client import MODEL
+
+    return f"{constants.INFERENCE_PROXY_TEMPLATE.format(provider='hf-inference')}/models/{MODEL}"
+
+
+def _es_options() -> dict:
+    url = os.getenv("ES_URL")
+    options = dict(
+        hosts=url,
+        basic_auth=(
+            os.getenv("ES_USERNAME"),
+            os.getenv("ES_PASSWORD"),
+        ),
+        request_timeout=settings.ES_REQUEST_TIMEOUT,
+        connections_per_node=settings.ES_MAX_CONNECTIONS,
+        max_retries=settings.ES_MAX_RETRIES,
+    )
+    if url and url.startswith("https"):
+        options.update(
+            ca_certs=os.path.join(BASE_DIR, "certs", "http_ca.crt"),
+            verify_certs=True,
+            ssl_show_warn=False,
+            ssl_assert_hostname=False,
+        )
+    return options
+
+
+def _create_es():
+    return Elasticsearch(**_es_options(), node_class=KeepAliveNode)
+
+
+def _create_async_es():
+    return AsyncElasticsearch(**_es_options(), node_class=KeepAliveAsyncNode)
+
+
+def _create_llm():
+    """
+    The inference client. It takes no session, so its pool is configured
+    with huggingface_hub's configure_http_backend. That setting is
+    process-wide: every huggingface_hub request of this process (model
+    downloads by the dense encoder included) goes through _llm_session.
+    """
+    global _llm_backend_configured
+    if not _llm_backend_configured:
+        # The inference client opens a requests session per thread from this factory
+        configure_http_backend(backend_factory=_llm_session)
+        _llm_backend_configured = True
+    return InferenceClient(provider="hf-inference", api_key=os.getenv("API_KEY"),
+                           timeout=settings.LLM_REQUEST_TIMEOUT)
+
+
+def _create_async_llm():
+    return AsyncInferenceClient(provider="hf-inference", api_key=os.getenv("API_KEY"),
+                                timeout=settings.LLM_REQUEST_TIMEOUT)
+
+
+FACTORIES = {
+    "es": _create_es,
+    "async_es": _create_async_es,
+    "client": _create_llm,
+    "async_client": _create_async_llm,
+}
+
+
+def get(name: str):
+    """
+    This process's client called `name` (a key of FACTORIES), created on
+    first use.
+    """
+    if name in _overrides:
+        return _overrides[name]
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = FACTORIES[name]()
+    return client
+
+
+def get_es() -> Elasticsearch:
+    return get("es")
+
+
+def get_async_es() -> AsyncElasticsearch:
+    return get("async_es")
+
+
+def get_llm() -> InferenceClient:
+    return get("client")
+
+
+def get_async_llm() -> AsyncInferenceClient:
+    return get("async_client")
+
+
+def install(**clients):
+    """
+    Use the given objects instead of the configured clients, e.g.
+    install(es=Elasticsearch(stand_in.url)).
+    """
+    unknown = clients.keys() - FACTORIES.keys()
+    if unknown:
+        raise ValueError(f"Unknown clients: {', '.join(sorted(unknown))}")
+    _overrides.update(clients)
+
+
+def uninstall(*names):
+    """
+    Go back to the configured clients called `names`, or to all of them
+    without names.
+    """
+    for name in names or list(_overrides):
+        _overrides.pop(name, None)
+
+
+@contextmanager
+def installed(**clients):
+    """
+    install(**clients) for the duration of a `with` block. Overrides that
+    were installed before are restored afterwards.
+    """
+    previous = {name: _overrides[name] for name in clients if name in _overrides}
+    install(**clients)
+    try:
+        yield
+    finally:
+        uninstall(*clients)
+        _overrides.update(previous)
+
+
+def _after_fork():
+    # The parent's connections (and maybe its lock) aren't ours
+    global _lock, _adapter_lock, _llm_adapter
+    _lock = threading.Lock()
+    _adapter_lock = threading.Lock()
+    _llm_adapter = None
+    _clients.clear()
+    if _warmup["status"] != "disabled":
+        _warmup.clear()
+        _warmup["status"] = "pending"
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def warm_up():
+    """
+    Open pooled connections and load what the first requests would
+    otherwise wait for.
+    """
+    started = time.perf_counter()
+    _warmup.update(status="running", error=None)
+    try:
+        if "elasticsearch" in (settings.SEARCH_BACKEND, settings.SEARCH_SUGGEST_BACKEND):
+            es = get_es()
+            # Concurrent requests, so each opens its own connection
+            with ThreadPoolExecutor(max_workers=settings.ES_WARMUP_CONNECTIONS) as pool:
+                list(pool.map(lambda _: es.info(), range(settings.ES_WARMUP_CONNECTIONS)))
+            if settings.ES_WARMUP_QUERIES:
+                from .indexing import warm_up as warm_up_index
+                from .rag import INDEX_NAME
+
+                warm_up_index(es, INDEX_NAME)
+        warm_up_llm()
+        load_local_data()
+    except Exception as e:
+        _warmup.update(status="failed", error=str(e))
+        logger.warning(f"Client warm-up failed: {e}")
+    else:
+        _warmup["status"] = "done"
+        logger.info(f"Clients warmed up in {time.perf_counter() - started:.2f}s")
+    _warmup["seconds"] = round(time.perf_counter() - started, 3)
+
+
+def warm_up_llm():
+    """
+    Open LLM_WARMUP_CONNECTIONS pooled connections to the inference
+    endpoint. Its answer doesn't matter, and an unreachable endpoint only
+    logs a warning: searches don't need it.
+    """
+    if "client" in _overrides:
+        return  # Installed clients bring their own connections
+    get_llm()  # Configures the sessions
+    url = llm_endpoint()
+
+    def connect(_):
+        get_session().head(url, timeout=LLM_WARMUP_TIMEOUT)
+
+    try:
+        # Concurrent requests from separate threads, so each opens its own connection
+        with ThreadPoolExecutor(max_workers=settings.LLM_WARMUP_CONNECTIONS) as pool:
+            list(pool.map(connect, range(settings.LLM_WARMUP_CONNECTIONS)))
+    except requests.RequestException as e:
+        logger.warning(f"Could not connect to the inference endpoint: {e}")
+
+
+def load_local_data():
+    """
+    Load the in-process indexes and dictionaries the settings use.
+    """
+    from .backends import get_backend
+    from .expansion import load_expander
+    from .suggest import load_suggester
+
+    if settings.SEARCH_BACKEND != "elasticsearch":
+        # LocalBackend maps its index on first access
+        getattr(get_backend(), "index", None)
+    if settings.QUERY_EXPANSION != "llm":
+        load_expander(settings.EXPANSIONS_FILE)
+    if settings.SEARCH_SUGGEST_BACKEND == "local":
+        load_suggester(settings.SUGGESTIONS_FILE)
+
+
+def start_warm_up():
+    """
+    Run warm_up in a background thread unless one is running.
+    """
+    if not settings.CLIENT_WARMUP:
+        _warmup["status"] = "disabled"
+        return
+    with _lock:
+        if _warmup["status"] == "running":
+            return
+        _warmup["status"] = "running"
+    threading.Thread(target=warm_up, name="search-client-warmup", daemon=True).start()
+
+
+def _node_pools(client) -> list[dict]:
+    transport = getattr(client, "transport", None)
+    if transport is None:
+        return []
+    pools = []
+    for node in transport.node_pool.all():
+        pool = getattr(node, "pool", None)
+        if pool is None:
+            # Async node: its session opens on the first request
+            connector = getattr(getattr(node, "session", None), "connector", None)
+            pools.append({"node": node.base_url, "max_connections": node.config.connections_per_node,
+                          "open": connector is not None and not connector.closed})
+            continue
+        pools.append(_pool_state(node.base_url, pool))
+    return pools
+
+
+def _adapter_pools(adapter) -> list[dict]:
+    if adapter is None:
+        return []
+    pools = adapter.poolmanager.pools
+    return [_pool_state(f"{key.key_scheme}://{key.key_host}:{key.key_port}", pools[key]) for key in pools.keys()]
+
+
+def _pool_state(node: str, pool) -> dict:
+    idle = [conn for conn in list(pool.pool.queue) if conn is not None]
+    return {
+        "node": node,
+        "max_connections": pool.pool.maxsize,
+        "opened": pool.num_connections,
+        "idle": len(idle),
+        "requests": pool.num_requests,
+    }
+
+
+def readiness() -> dict:
+    """
+    Warm-up status and pool state of this process. A pending or failed
+    warm-up is started (again).
+    """
+    warmup = dict(_warmup)
+    if warmup["status"] in ("pending", "failed"):
+        start_warm_up()
+    statuses = {"done": "ready", "disabled": "ready", "failed": "unavailable"}
+    state = {
+        "status": statuses.get(warmup["status"], "warming"),
+        "pid": os.getpid(),
+        "warmup": warmup,
+        "clients": {},
+    }
+    for name in FACTORIES:
+        client = _overrides.get(name, _clients.get(name))
+        state["clients"][name] = {"created": client is not None, "pools": _node_pools(client)}
+    state["clients"]["client"]["max_connections"] = settings.LLM_MAX_CONNECTIONS
+    if "client" not in _overrides:
+        state["clients"]["client"]["pools"] = _adapter_pools(_llm_adapter)
+    return state
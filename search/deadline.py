@@ -0,0 +1,271 @@
+"""
+Per-request latency budgets.
+
+A search view runs its pipeline inside `deadline_scope(budget)`. Every stage
+below it, down to the Elasticsearch client, reads the time left from a
+context variable, like the Server-Timing entries in search.metrics:
+
+- expansion may use SEARCH_EXPANSION_BUDGET_SHARE of the budget and is
+  skipped or abandoned past that;
+- Elasticsearch requests time out when the budget does (but get at least
+  MIN_REQUEST_TIMEOUT), and slow searches are hedged with a backup request,
+  for at most SEARCH_HEDGE_MAX_RATIO of searches;
+- generation is skipped when less than SEARCH_MIN_GENERATION_TIME is left
+  and abandoned when the budget runs out.
+
+LLM calls under a timeout run in their own pool of LLM_MAX_CONNECTIONS
+threads, apart from hedged retrieval. When every thread is busy, including
+with abandoned calls, a call fails at once with PoolFull instead of queueing
+behind them, and the stage is skipped.
+
+Stages that give way are recorded on the Deadline, and the response is
+flagged as degraded. Abandoned LLM calls keep running in the background so
+their results still land in the caches.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import DEGRADED_STAGES, HEDGED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Floor for the timeout of requests a response can't do without (retrieval)
+MIN_REQUEST_TIMEOUT = 0.5
+
+# Threads for hedged requests
+HEDGE_POOL_SIZE = 32
+
+# Backup requests a quiet period can save up for a burst of slow searches
+HEDGE_BURST = 10
+
+_current = contextvars.ContextVar("search_deadline", default=None)
+
+_hedge_pool = None
+_hedge_slots = None
+_hedge_tokens = 0.0
+# Calls abandoned at their timeout hold their thread and slot until they finish
+_llm_pool = None
+_llm_slots = None
+_pool_lock = threading.Lock()
+
+
+class PoolFull(Exception):
+    """
+    Every thread for LLM calls is busy.
+    """
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+        self.degraded = {}  # stage -> reason
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+
+@contextmanager
+def deadline_scope(budget: float, inherit: bool = False):
+    """
+    Run the block within a new deadline of `budget` seconds. With `inherit`,
+    a deadline already in effect (e.g. opened by the view around request
+    coalescing) is used instead.
+    """
+    current = _current.get()
+    if inherit and current is not None:
+        yield current
+        return
+    deadline = Deadline(budget)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Closed from another context, like a streaming generator the
+            # server stopped iterating; that context never saw the deadline
+            pass
+
+
+def current_deadline() -> Deadline | None:
+    return _current.get()
+
+
+def time_left(cap: float | None = None, share: float | None = None) -> float | None:
+    """
+    Seconds an upstream call may take: what is left of the request's budget,
+    at most `share` of the whole budget and at most `cap`. None when there
+    is neither a budget nor a cap.
+    """
+    deadline = _current.get()
+    limits = [cap] if cap is not None else []
+    if deadline is not None:
+        limits.append(deadline.remaining())
+        if share is not None:
+            limits.append(deadline.budget * share)
+    return min(limits) if limits else None
+
+
+def degrade(stage: str, reason: str):
+    """
+    Record that `stage` was skipped or cut short ('skipped' or 'timeout').
+    """
+    DEGRADED_STAGES.inc(stage=stage, reason=reason)
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.degraded[stage] = reason
+    logger.info(f"Latency budget: {stage} {reason}")
+
+
+def _get_hedge_pool() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    global _hedge_pool, _hedge_slots
+    with _pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="search-hedge")
+            _hedge_slots = threading.BoundedSemaphore(HEDGE_POOL_SIZE)
+        return _hedge_pool, _hedge_slots
+
+
+def _get_llm_pool() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    global _llm_pool, _llm_slots
+    with _pool_lock:
+        if _llm_pool is None:
+            _llm_pool = ThreadPoolExecutor(max_workers=settings.LLM_MAX_CONNECTIONS, thread_name_prefix="search-llm")
+            _llm_slots = threading.BoundedSemaphore(settings.LLM_MAX_CONNECTIONS)
+        return _llm_pool, _llm_slots
+
+
+def _submit(fn):
+    """
+    Run fn in the hedge pool, or return None when all its threads are busy.
+    """
+    pool, slots = _get_hedge_pool()
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        # Each task gets its own copy of the context, so it sees the deadline
+        future = pool.submit(contextvars.copy_context().run, fn)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def _earn_hedge() -> bool:
+    """
+    Every hedged call earns SEARCH_HEDGE_MAX_RATIO of a backup request, up
+    to HEDGE_BURST saved. Returns whether a backup is affordable now.
+    """
+    global _hedge_tokens
+    with _pool_lock:
+        _hedge_tokens = min(HEDGE_BURST, _hedge_tokens + settings.SEARCH_HEDGE_MAX_RATIO)
+        return _hedge_tokens >= 1
+
+
+def _spend_hedge() -> bool:
+    global _hedge_tokens
+    with _pool_lock:
+        if _hedge_tokens < 1:
+            return False
+        _hedge_tokens -= 1
+        return True
+
+
+def call_with_timeout(fn, timeout: float | None):
+    """
+    Return fn(), an LLM call, or raise TimeoutError after `timeout` seconds.
+    The call itself is not interrupted; it finishes in a thread of the LLM
+    pool. Raises PoolFull when that pool has no free thread.
+    """
+    if timeout is None:
+        return fn()
+    pool, slots = _get_llm_pool()
+    if not slots.acquire(blocking=False):
+        raise PoolFull()
+    try:
+        future = pool.submit(contextvars.copy_context().run, fn)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result(timeout=timeout)
+
+
+def hedged(fn, upstream: str, delay: float):
+    """
+    Return fn(); if it hasn't finished after `delay` seconds, call it again
+    and return whichever call succeeds first. Only for idempotent reads.
+
+    Backups are limited to SEARCH_HEDGE_MAX_RATIO of calls, so a slow
+    cluster doesn't get twice the load. fn() runs in the caller's thread,
+    without a hedge, when no backup is affordable or the hedge pool is busy.
+    """
+    left = time_left()
+    if delay <= 0 or (left is not None and left <= delay) or not _earn_hedge():
+        return fn()
+
+    first = _submit(fn)
+    if first is None:
+        return fn()
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    backup = _submit(fn) if _spend_hedge() else None
+    if backup is None:
+        return first.result()
+    pending = {first, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                HEDGED_REQUESTS.inc(upstream=upstream, winner="backup" if future is backup else "first")
+                return future.result()
+            error = future.exception()
+    HEDGED_REQUESTS.inc(upstream=upstream, winner="none")
+    raise error
+
+
+async def ahedged(make_call, upstream: str, delay: float):
+    """
+    Async counterpart of hedged, under the same limit; `make_call` returns a
+    new coroutine per attempt. The losing attempt is cancelled.
+    """
+    left = time_left()
+    if delay <= 0 or (left is not None and left <= delay) or not _earn_hedge():
+        return await make_call()
+
+    first = asyncio.ensure_future(make_call())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    if not _spend_hedge():
+        return await first
+
+    backup = asyncio.ensure_future(make_call())
+    pending = {first, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_REQUESTS.inc(upstream=upstream, winner="backup" if task is backup else "first")
+                    return task.result()
+                error = task.exception()
+        HEDGED_REQUESTS.inc(upstream=upstream, winner="none")
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
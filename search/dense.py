@@ -0,0 +1,193 @@
+"""
+Dense retrieval: pluggable CPU encoders and a memory-mapped vector index.
+
+The index directory holds `vectors.npy` (float32, one L2-normalized row per
+document), `doc_ids.json` and `meta.json` recording which encoder produced
+the vectors. Query vectors must come from the same encoder.
+"""
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .analysis import tokenize
+from .reloading import ReloadingCache, index_version
+
+logger = logging.getLogger(__name__)
+
+ENCODERS = {
+    "hashing": "search.dense.HashingEncoder",
+    "sentence-transformers": "search.dense.SentenceTransformerEncoder",
+}
+
+# Characters of main_text that go into a document vector
+DOCUMENT_TEXT_CHARS = 2000
+
+
+class Encoder:
+    name = None
+    dim = None
+    # Whether similar vectors mean similar meaning rather than shared words;
+    # mode=hybrid only adds recall over BM25 with a semantic encoder
+    semantic = True
+
+    def encode(self, texts: list[str]):
+        """
+        Return a float32 array of shape (len(texts), dim) with unit-length rows.
+        """
+        raise NotImplementedError
+
+
+class HashingEncoder(Encoder):
+    """
+    Dependency-free encoder: signed feature hashing of unigrams and bigrams
+    with sublinear term frequency. Captures lexical overlap only, so it is a
+    placeholder for tests and benchmarks that need no model download, not a
+    production encoder for hybrid retrieval.
+    """
+    name = "hashing"
+    semantic = False
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        return digest % self.dim, 1.0 if digest >> 63 else -1.0
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            counts = {}
+            for feature in features:
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                bucket, sign = self._bucket(feature)
+                vectors[row, bucket] += sign * (1 + np.log(count))
+        return _normalize(vectors)
+
+
+class SentenceTransformerEncoder(Encoder):
+    """
+    Wraps a sentence-transformers model (optional dependency) on CPU.
+    """
+    name = "sentence-transformers"
+
+    def __init__(self, model_name: str | None = None):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImproperlyConfigured(
+                "DENSE_ENCODER='sentence-transformers' requires the sentence-transformers package"
+            ) from exc
+
+        self.model_name = model_name or settings.DENSE_ENCODER_MODEL
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def encoder_class(name: str | None = None) -> type[Encoder]:
+    name = name or settings.DENSE_ENCODER
+    return import_string(ENCODERS.get(name, name))
+
+
+@lru_cache(maxsize=None)
+def get_encoder(name: str | None = None) -> Encoder:
+    return encoder_class(name)()
+
+
+def document_text(doc: dict) -> str:
+    return " ".join([doc.get("title", ""), doc.get("description", ""),
+                     doc.get("main_text", "")[:DOCUMENT_TEXT_CHARS]])
+
+
+def build_dense_index(docs, output_dir: str, encoder: Encoder, batch_size: int = 256) -> int:
+    """
+    Encode documents in batches and write the vector index.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    doc_ids, batches, batch = [], [], []
+
+    for doc in docs:
+        doc_ids.append(doc["id"])
+        batch.append(document_text(doc))
+        if len(batch) >= batch_size:
+            batches.append(encoder.encode(batch))
+            batch = []
+    if batch:
+        batches.append(encoder.encode(batch))
+
+    vectors = np.vstack(batches) if batches else np.zeros((0, encoder.dim), dtype=np.float32)
+    np.save(os.path.join(output_dir, "vectors.npy"), vectors.astype(np.float32))
+    with open(os.path.join(output_dir, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_ids, f)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"encoder": encoder.name, "dim": int(vectors.shape[1]), "num_docs": len(doc_ids)}, f)
+
+    logger.info(f"Built dense index with {len(doc_ids)} vectors of dim {vectors.shape[1]} in {output_dir}")
+    return len(doc_ids)
+
+
+class DenseIndex:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+    def search(self, query_vector, size: int) -> list[tuple[str, float]]:
+        """
+        Top `size` documents by cosine similarity, best first.
+        """
+        scores = self.vectors @ query_vector
+        size = min(size, len(scores))
+        if size <= 0:
+            return []
+        top = np.argpartition(-scores, size - 1)[:size]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+
+def open_dense_index(path: str) -> DenseIndex:
+    index = DenseIndex(path)
+    encoder = get_encoder()
+    if index.meta["encoder"] != encoder.name or index.meta["dim"] != encoder.dim:
+        raise ImproperlyConfigured(
+            f"Dense index at {path} was built with {index.meta['encoder']} "
+            f"(dim {index.meta['dim']}), but DENSE_ENCODER is {encoder.name} (dim {encoder.dim})"
+        )
+    return index
+
+
+# Reloaded when build_dense_index publishes a new build
+load_dense_index = ReloadingCache(open_dense_index, version=index_version)
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """
+    Fuse several ranked ID lists: score(d) = sum over lists of 1 / (k + rank).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,31 +1,12 @@
-import os
-from elasticsearch import Elasticsearch
-from dotenv import load_dotenv
-
-load_dotenv()
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-es = Elasticsearch(
-    os.getenv("ES_URL"),
-    ca_certs=os.path.join(BASE_DIR, "certs", "http_ca.crt"),
-    verify_certs=True,
-    basic_auth=(
-        os.getenv("ES_USERNAME"),
-        os.getenv("ES_PASSWORD"),
-    ),
-    ssl_show_warn=False,
-    ssl_assert_hostname=False,
-)
-
-def create_index(index_name):
-    if not es.indices.exists(index=index_name):
-        es.indices.create(index=index_name, body={
-            "mappings": {
-                "properties": {
-                    "url": {"type": "keyword"},
-                    "title": {"type": "text"},
-                    "abstract": {"type": "text"}
-                }
-            }
-        })
\ No newline at end of file
+"""
+The Elasticsearch clients, created by search.clients on first access:
+`es` and `async_es` (used by the async views). New code calls
+`clients.get_es()` / `clients.get_async_es()` where it needs them.
+"""
+from . import clients
+
+
+def __getattr__(name):
+    if name in ("es", "async_es"):
+        return clients.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
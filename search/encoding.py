@@ -0,0 +1,36 @@
+"""
+JSON serialization for search responses.
+
+Responses are encoded with orjson when it is installed, which is several
+times faster than the standard library encoder on the large nested
+documents the search views return. Without it, `json` with Django's
+encoder is used, so the output is the same either way.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+_fallback_encoder = DjangoJSONEncoder()
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        # Types orjson doesn't know (Decimal, lazy strings...) go through Django's encoder
+        return orjson.dumps(data, default=_fallback_encoder.default)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    Drop-in for JsonResponse with dict data, encoded by `dumps`.
+    """
+
+    def __init__(self, data: dict, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,170 @@
+"""
+Offline retrieval evaluation for `manage.py retrieval_sweep`.
+
+Each variant is a set of `build_search_body` options (field boosts, the
+expansion clause, highlighting, `_source`, k). All queries of a variant go
+to Elasticsearch in batched `_msearch` requests, and the variant is scored
+with nDCG@k and recall@k against NFCorpus qrels, next to what it costs:
+the `took` Elasticsearch reports and the size of the request and response
+payloads. Expansions come from the expansion cache, the local dictionary or
+a JSON file, never from the LLM.
+"""
+import json
+import math
+from collections import defaultdict
+
+from .benchmark import summarize
+from .rag import EXPANSION_FIELDS, QUERY_FIELDS, build_search_body
+
+# Serialized the way the Elasticsearch client sends bodies
+COMPACT = {"separators": (",", ":"), "ensure_ascii": False}
+
+DEFAULT_VARIANT = {
+    "query_fields": QUERY_FIELDS,
+    "expansion_fields": EXPANSION_FIELDS,
+    "expansion_type": "cross_fields",
+    "expansion": True,
+    "highlight": True,
+    "source": None,  # None keeps build_search_body's SOURCE_FIELDS
+    "k": 5,
+}
+
+# The production query first, then one change at a time
+DEFAULT_VARIANTS = [
+    {"name": "baseline"},
+    {"name": "no_expansion", "expansion": False},
+    {"name": "expansion_best_fields", "expansion_type": "best_fields"},
+    {"name": "flat_boosts", "query_fields": ["title", "description", "main_text"],
+     "expansion_fields": ["title", "description", "main_text"]},
+    {"name": "title_description_only", "query_fields": ["title^3", "description^2"],
+     "expansion_fields": ["title^2", "description"]},
+    {"name": "no_highlight", "highlight": False},
+    {"name": "source_title_only", "highlight": False, "source": ["title", "url"]},
+    {"name": "k3", "k": 3},
+    {"name": "k10", "k": 10},
+]
+
+
+def load_qrels(path: str) -> dict[str, dict[str, int]]:
+    """
+    NFCorpus `.qrel` file (`<query id>\\t0\\t<doc id>\\t<relevance>`) ->
+    {query id: {doc id: relevance}}.
+    """
+    qrels = defaultdict(dict)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 4:
+                continue
+            query_id, _, doc_id, relevance = parts
+            qrels[query_id][doc_id] = int(relevance)
+    return dict(qrels)
+
+
+def load_query_file(path: str) -> dict[str, str]:
+    """
+    NFCorpus `.queries` file (`<query id>\\t<text>`) -> {query id: text}.
+    """
+    queries = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            query_id, _, text = line.rstrip("\n").partition("\t")
+            if query_id and text.strip():
+                queries[query_id] = text.strip()
+    return queries
+
+
+def dcg(gains: list[float]) -> float:
+    return sum((2 ** gain - 1) / math.log2(rank + 2) for rank, gain in enumerate(gains))
+
+
+def ndcg_at_k(ranked_ids: list[str], relevant: dict[str, int], k: int) -> float:
+    ideal = dcg(sorted(relevant.values(), reverse=True)[:k])
+    if not ideal:
+        return 0.0
+    return dcg([relevant.get(doc_id, 0) for doc_id in ranked_ids[:k]]) / ideal
+
+
+def recall_at_k(ranked_ids: list[str], relevant: dict[str, int], k: int) -> float:
+    wanted = {doc_id for doc_id, relevance in relevant.items() if relevance > 0}
+    if not wanted:
+        return 0.0
+    return len(wanted.intersection(ranked_ids[:k])) / len(wanted)
+
+
+def resolve_variants(variants: list[dict]) -> list[dict]:
+    """
+    Fill in each variant's unspecified options from DEFAULT_VARIANT.
+    """
+    resolved = []
+    for position, variant in enumerate(variants):
+        unknown = set(variant) - set(DEFAULT_VARIANT) - {"name"}
+        if unknown:
+            raise ValueError(f"Unknown variant options: {', '.join(sorted(unknown))}")
+        resolved.append({"name": variant.get("name", f"variant_{position}"), **DEFAULT_VARIANT, **variant})
+    return resolved
+
+
+def payload_size(obj) -> int:
+    return len(json.dumps(obj, **COMPACT).encode("utf-8"))
+
+
+def variant_body(variant: dict, query: str, expanded_terms: list[str]) -> dict:
+    terms = expanded_terms if variant["expansion"] else []
+    body = build_search_body(query, terms, query_fields=variant["query_fields"],
+                             expansion_fields=variant["expansion_fields"],
+                             expansion_type=variant["expansion_type"],
+                             highlight=variant["highlight"])
+    if not terms:
+        # Drop the empty boost clause instead of sending a no-op
+        del body["query"]["bool"]["should"]
+    if variant["source"] is not None:
+        body["_source"] = variant["source"]
+    body["size"] = variant["k"]
+    return body
+
+
+def evaluate_variant(es, index: str, variant: dict, queries: list[tuple[str, str]],
+                     qrels: dict[str, dict[str, int]], expansions: dict[str, list[str]],
+                     batch_size: int = 100) -> dict:
+    """
+    Run every (query id, text) pair through one variant in `_msearch`
+    batches and score it.
+    """
+    k = variant["k"]
+    ndcg, recall, took, request_bytes, response_bytes = [], [], [], [], []
+    errors = 0
+
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        searches = []
+        for _, text in batch:
+            searches.append({})
+            searches.append(variant_body(variant, text, expansions.get(text, [])))
+        res = es.msearch(index=index, searches=searches)
+
+        for position, ((query_id, _), item) in enumerate(zip(batch, res["responses"])):
+            header, body = searches[2 * position], searches[2 * position + 1]
+            request_bytes.append(payload_size(header) + payload_size(body) + 2)  # Two newlines
+            response_bytes.append(payload_size(item))
+            if "error" in item:
+                errors += 1
+                continue
+            ranked_ids = [hit["_id"] for hit in item["hits"]["hits"]]
+            ndcg.append(ndcg_at_k(ranked_ids, qrels[query_id], k))
+            recall.append(recall_at_k(ranked_ids, qrels[query_id], k))
+            took.append(item.get("took", 0))
+
+    scored = len(ndcg)
+    return {
+        "name": variant["name"],
+        "options": {key: value for key, value in variant.items() if key != "name"},
+        "queries": len(queries),
+        "errors": errors,
+        "k": k,
+        "ndcg": round(sum(ndcg) / scored, 4) if scored else None,  # nDCG@k
+        "recall": round(sum(recall) / scored, 4) if scored else None,  # recall@k
+        "took_ms": summarize(took),
+        "request_bytes": summarize(request_bytes),
+        "response_bytes": summarize(response_bytes),
+    }
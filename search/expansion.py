@@ -0,0 +1,163 @@
+"""
+Corpus-derived query expansion.
+
+`build_expansions` mines nfdump.txt offline for related terms:
+
+- tag co-occurrence: topics_tags that appear on the same documents
+- PMI between title terms and topics_tags
+- the topic_links graph: topics linked from documents carrying a tag
+
+The result is a JSON dictionary that `LocalExpander` loads into each
+process, and reloads when the file is rebuilt, so expanding a query is a
+few dictionary lookups instead of an LLM call.
+"""
+import json
+import logging
+import math
+import os
+from collections import Counter, defaultdict
+
+from .analysis import tokenize
+from .reloading import ReloadingCache
+
+logger = logging.getLogger(__name__)
+
+# Relative weights of the three signals when merging candidates
+TAG_COOCCURRENCE_WEIGHT = 1.0
+TITLE_PMI_WEIGHT = 0.5
+TOPIC_LINK_WEIGHT = 0.75
+
+
+def topic_name(link: str) -> str:
+    """
+    '/topics/heart-disease/' -> 'heart disease'
+    """
+    slug = link.rstrip("/").rsplit("/", 1)[-1]
+    return slug.replace("-", " ").replace("_", " ").strip().lower()
+
+
+def normalize_key(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+def build_expansions(docs, min_count: int = 3, max_terms: int = 10) -> dict[str, list[tuple[str, float]]]:
+    """
+    Mine expansion candidates from parsed documents. Returns
+    {key: [(expansion, score), ...]} with at most `max_terms` per key,
+    where keys are normalized tags, topics and title terms.
+    """
+    tag_counts = Counter()
+    term_counts = Counter()
+    tag_pairs = Counter()
+    term_tag_pairs = Counter()
+    tag_topic_pairs = Counter()
+    num_docs = 0
+
+    for doc in docs:
+        num_docs += 1
+        tags = {tag.lower() for tag in doc.get("topics_tags", [])}
+        terms = set(tokenize(doc.get("title", "")))
+        topics = {topic_name(link) for link in doc.get("topic_links", [])} - {""}
+
+        tag_counts.update(tags)
+        term_counts.update(terms)
+        for tag in tags:
+            for other in tags:
+                if other != tag:
+                    tag_pairs[tag, other] += 1
+            for term in terms:
+                term_tag_pairs[term, tag] += 1
+            for topic in topics:
+                if topic != tag:
+                    tag_topic_pairs[tag, topic] += 1
+
+    candidates = defaultdict(Counter)
+
+    # Tags that co-occur, scored by conditional probability P(other | tag)
+    for (tag, other), count in tag_pairs.items():
+        if count >= min_count:
+            candidates[normalize_key(tag)][other] += TAG_COOCCURRENCE_WEIGHT * count / tag_counts[tag]
+
+    # Title terms to tags by positive PMI
+    for (term, tag), count in term_tag_pairs.items():
+        if count < min_count or term in tag:
+            continue
+        pmi = math.log(count * num_docs / (term_counts[term] * tag_counts[tag]))
+        if pmi > 0:
+            candidates[term][tag] += TITLE_PMI_WEIGHT * pmi / (1 + pmi)
+
+    # Tags to the topic pages documents tagged with them link to
+    for (tag, topic), count in tag_topic_pairs.items():
+        if count >= min_count:
+            candidates[normalize_key(tag)][topic] += TOPIC_LINK_WEIGHT * count / tag_counts[tag]
+
+    expansions = {}
+    for key, scored in candidates.items():
+        if not key:
+            continue
+        expansions[key] = [(term, round(score, 4)) for term, score in scored.most_common(max_terms)]
+
+    logger.info(f"Built {len(expansions)} expansion entries from {num_docs} documents")
+    return expansions
+
+
+def write_expansions(expansions: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Replace the file in one rename so running workers never read half of it
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "expansions": expansions}, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def synonym_rules(expansions: dict, max_terms: int = 3) -> list[str]:
+    """
+    Solr-format rules ("key => key, exp1, exp2") for an Elasticsearch
+    synonym_graph filter.
+    """
+    rules = []
+    for key, scored in sorted(expansions.items()):
+        terms = [term for term, _ in scored[:max_terms] if "," not in term and "=>" not in term]
+        if terms:
+            rules.append(f"{key} => {key}, {', '.join(terms)}")
+    return rules
+
+
+class LocalExpander:
+    """
+    In-memory lookup over the expansion dictionary.
+    """
+
+    def __init__(self, expansions: dict[str, list]):
+        self.expansions = expansions
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["expansions"])
+
+    def expand(self, query: str, limit: int = 5) -> list[str]:
+        tokens = tokenize(query)
+        keys = [" ".join(tokens)] + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] + tokens
+        present = set(tokens)
+
+        scores = Counter()
+        for key in dict.fromkeys(keys):
+            for term, score in self.expansions.get(key, ()):
+                # Skip candidates the query already contains
+                if set(tokenize(term)) <= present:
+                    continue
+                scores[term] += score
+        return [term for term, _ in scores.most_common(limit)]
+
+
+_expanders = ReloadingCache(LocalExpander.from_file)
+
+
+def load_expander(path: str) -> LocalExpander | None:
+    """
+    The expander for `path`, reloaded when the file is rebuilt. None while
+    the file is missing; that isn't cached, so a dictionary built after
+    startup is picked up.
+    """
+    return _expanders.get_optional(
+        path, f"Expansion dictionary not found at {path}; run manage.py build_expansions")
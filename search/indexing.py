@@ -0,0 +1,495 @@
+"""
+Ingest pipeline for the NFCorpus dump (nfdump.txt) into Elasticsearch.
+
+This module has no Django dependency, so the management commands and the
+benchmark harness can share it and the parse workers it starts can import
+it without configuring Django.
+"""
+import copy
+import csv
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+import multiprocessing
+
+from elasticsearch.helpers import scan, streaming_bulk
+
+logger = logging.getLogger(__name__)
+
+# Columns of nfdump.txt after the leading document ID
+FIELD_NAMES = ["url", "title", "main_text", "comments", "topics_tags",
+               "description", "doctors_note", "article_links", "question_links",
+               "topic_links", "video_links", "medarticle_links"]
+
+# Fields stored as arrays of comma-separated values
+LIST_FIELDS = {"topics_tags", "article_links", "question_links", "topic_links",
+               "video_links", "medarticle_links"}
+
+# Index settings and mappings for nfdump.txt fields. Highlighted fields
+# store term offsets so the unified highlighter doesn't re-analyze them.
+INDEX_SETTINGS = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "content_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "stop"]
+                }
+            }
+        },
+        "number_of_shards": 1,
+        "number_of_replicas": 0,
+    },
+    "mappings": {
+        "properties": {
+            "id": {"type": "keyword"},
+            "url": {"type": "keyword"},
+            "title": {"type": "text", "analyzer": "content_analyzer", "index_options": "offsets"},
+            "main_text": {"type": "text", "analyzer": "content_analyzer", "index_options": "offsets"},
+            "comments": {"type": "text", "analyzer": "content_analyzer"},
+            "topics_tags": {"type": "keyword"},
+            "description": {"type": "text", "analyzer": "content_analyzer", "index_options": "offsets"},
+            "doctors_note": {"type": "text", "analyzer": "content_analyzer"},
+            "article_links": {"type": "keyword"},
+            "question_links": {"type": "keyword"},
+            "topic_links": {"type": "keyword"},
+            "video_links": {"type": "keyword"},
+            "medarticle_links": {"type": "keyword"},
+            "content_hash": {"type": "keyword"},
+            "suggest": {"type": "completion", "analyzer": "simple"}
+        }
+    }
+}
+
+
+def build_index_settings(synonyms: list[str] | None = None, base: dict = INDEX_SETTINGS) -> dict:
+    """
+    `base` (INDEX_SETTINGS by default), optionally with search-time synonym
+    expansion.
+
+    Synonym rules (Solr format, see `manage.py build_expansions --synonyms`)
+    go into an updateable synonym_graph filter used only as the
+    search_analyzer, so documents are indexed exactly as without it.
+    """
+    index_settings = copy.deepcopy(base)
+    if not synonyms:
+        return index_settings
+
+    analysis = index_settings["settings"]["analysis"]
+    analysis["filter"] = {
+        "expansion_synonyms": {
+            "type": "synonym_graph",
+            "synonyms": synonyms,
+            "updateable": True,
+            "lenient": True,
+        }
+    }
+    analysis["analyzer"]["content_search_analyzer"] = {
+        "type": "custom",
+        "tokenizer": "standard",
+        "filter": ["lowercase", "expansion_synonyms", "stop"]
+    }
+    for field in index_settings["mappings"]["properties"].values():
+        if field.get("analyzer") == "content_analyzer":
+            field["search_analyzer"] = "content_search_analyzer"
+    return index_settings
+
+
+# Default tuning for bulk loads
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024  # 10MB per bulk request
+DEFAULT_THREADS = 4
+DEFAULT_MAX_RETRIES = 8
+DEFAULT_INITIAL_BACKOFF = 2
+
+
+def parse_row(row: list[str]) -> dict | None:
+    """
+    Turn one nfdump.txt row into a document, skipping empty fields.
+    """
+    # Ensure we have at least the ID field
+    if not row or not row[0]:
+        return None
+
+    doc = {"id": row[0]}
+    for field_name, value in zip(FIELD_NAMES, row[1:]):
+        if not value:
+            continue
+        if field_name in LIST_FIELDS:
+            items = [item.strip() for item in value.split(',') if item.strip()]
+            if items:
+                doc[field_name] = items
+        else:
+            doc[field_name] = value
+
+    doc["content_hash"] = content_hash(doc)
+    return doc
+
+
+def content_hash(doc: dict) -> str:
+    """
+    Stable fingerprint of a document's fields, used by incremental updates.
+    """
+    fields = {key: value for key, value in doc.items() if key != "content_hash"}
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def read_rows(path: str):
+    """
+    Yield raw rows of a tab-separated dump.
+    """
+    # Increase the field size limit
+    csv.field_size_limit(10000000)  # 10MB
+
+    with open(path, "r", encoding="utf-8") as f:
+        yield from csv.reader(f, delimiter='\t')
+
+
+def iter_documents(path: str, workers: int = 1):
+    """
+    Yield parsed documents from the dump, parsing in a process pool when
+    `workers` is greater than one.
+
+    The generator is usually first advanced from a bulk thread, so the pool
+    uses the spawn start method: forking a process that already runs
+    several threads can leave the children holding locks nobody releases.
+    """
+    rows = read_rows(path)
+    if workers <= 1:
+        docs = map(parse_row, rows)
+        yield from (doc for doc in docs if doc)
+        return
+
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        for doc in pool.imap(parse_row, rows, chunksize=256):
+            if doc:
+                yield doc
+
+
+def completion_inputs(doc: dict, weight=None) -> list:
+    """
+    Inputs of the `suggest` completion field: the title and the tags. With
+    `weight`, a function of the input text, each input carries its weight
+    so that the completion suggester ranks by it.
+    """
+    texts = [text for text in [doc.get("title", ""), *doc.get("topics_tags", [])] if text]
+    if weight is None:
+        return texts
+    return [{"input": text, "weight": weight(text)} for text in texts]
+
+
+def iter_actions(index_name: str, docs, suggest_weight=None):
+    for doc in docs:
+        yield {"_index": index_name, "_id": doc["id"],
+               "_source": dict(doc, suggest=completion_inputs(doc, suggest_weight))}
+
+
+class _LockedIterator:
+    """
+    Lets several bulk threads pull from one generator.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._iterator)
+
+
+class BulkStats:
+    """
+    Thread-safe counters with periodic docs/sec logging.
+    """
+
+    def __init__(self, log_every: int = 10000):
+        self.indexed = 0
+        self.failed = 0
+        self.errors = []
+        self.log_every = log_every
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.indexed / self.elapsed if self.elapsed else 0.0
+
+    def record(self, ok: bool, item: dict):
+        with self._lock:
+            if ok:
+                self.indexed += 1
+            else:
+                self.failed += 1
+                if len(self.errors) < 20:
+                    self.errors.append(item)
+            done = self.indexed + self.failed
+        if done % self.log_every == 0:
+            logger.info(f"Processed {done} documents ({self.docs_per_sec:.0f} docs/sec)")
+
+
+def parallel_streaming_bulk(es, actions, threads: int = DEFAULT_THREADS,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE,
+                            max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES,
+                            max_retries: int = DEFAULT_MAX_RETRIES,
+                            initial_backoff: float = DEFAULT_INITIAL_BACKOFF,
+                            stats: BulkStats | None = None) -> BulkStats:
+    """
+    Send actions with `threads` concurrent streaming_bulk loops.
+
+    Each chunk is capped by both `chunk_size` documents and `max_chunk_bytes`.
+    Documents rejected with 429 are retried individually with exponential
+    backoff; other failures are counted instead of aborting the load.
+    """
+    stats = stats or BulkStats()
+    shared_actions = _LockedIterator(actions)
+    failures = []
+
+    def worker():
+        try:
+            for ok, item in streaming_bulk(
+                es,
+                shared_actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                max_retries=max_retries,
+                initial_backoff=initial_backoff,
+                raise_on_error=False,
+                raise_on_exception=False,
+            ):
+                stats.record(ok, item)
+        except Exception as e:
+            failures.append(e)
+
+    workers = [threading.Thread(target=worker, name=f"bulk-{i}") for i in range(max(1, threads))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    if failures:
+        raise failures[0]
+    return stats
+
+
+@contextmanager
+def refresh_disabled(es, index_name: str):
+    """
+    Turn off periodic refreshes during a bulk load and refresh once at the end.
+    """
+    current = es.indices.get_settings(index=index_name, name="index.refresh_interval")
+    previous = current.get(index_name, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+
+    es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+    try:
+        yield
+    finally:
+        es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": previous}})
+        es.indices.refresh(index=index_name)
+
+
+def index_dump(es, index_name: str, path: str, workers: int = 1, actions=iter_actions,
+               **bulk_options) -> BulkStats:
+    """
+    Load the whole dump into `index_name` and report throughput. `actions`
+    turns (index_name, documents) into bulk actions.
+    """
+    logger.info(f"Starting indexing from {path} into {index_name}")
+
+    with refresh_disabled(es, index_name):
+        docs = iter_documents(path, workers=workers)
+        stats = parallel_streaming_bulk(es, actions(index_name, docs), **bulk_options)
+
+    logger.info(
+        f"Indexing completed. Indexed: {stats.indexed}, failed: {stats.failed}, "
+        f"time: {stats.elapsed:.2f} seconds ({stats.docs_per_sec:.0f} docs/sec)")
+    for error in stats.errors:
+        logger.error(f"Failed document: {error}")
+    return stats
+
+
+# Queries run against a new index generation before it goes live, so the
+# first production searches don't hit cold caches
+WARMUP_QUERIES = ["diabetes", "heart disease", "cancer risk", "plant based diet",
+                  "cholesterol", "vitamin d", "blood pressure", "breast cancer"]
+
+
+def list_generations(es, alias: str) -> list[str]:
+    """
+    Versioned indices behind `alias`, oldest first.
+    """
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    indices = es.indices.get(index=f"{alias}_v*", allow_no_indices=True, expand_wildcards="open")
+    versions = [(int(m.group(1)), name) for name in indices if (m := pattern.match(name))]
+    return [name for _, name in sorted(versions)]
+
+
+def next_generation(es, alias: str) -> str:
+    generations = list_generations(es, alias)
+    version = int(generations[-1].rsplit("_v", 1)[1]) + 1 if generations else 1
+    return f"{alias}_v{version}"
+
+
+def live_index(es, alias: str) -> str | None:
+    """
+    Concrete index currently served under `alias`, if any.
+    """
+    if es.indices.exists_alias(name=alias):
+        return next(iter(es.indices.get_alias(name=alias)))
+    if es.indices.exists(index=alias):
+        # Legacy layout: a concrete index named like the alias
+        return alias
+    return None
+
+
+def warm_up(es, index_name: str, queries: list[str] = WARMUP_QUERIES):
+    for query in queries:
+        es.search(index=index_name, size=10, query={
+            "multi_match": {"query": query, "fields": ["title^3", "main_text"]}
+        })
+    logger.info(f"Warmed up {index_name} with {len(queries)} queries")
+
+
+def verify_generation(es, index_name: str, expected: int, previous: str | None,
+                      min_ratio: float = 0.9):
+    """
+    Refuse to go live with an index that lost documents during the load, or
+    that is much smaller than the generation it replaces.
+    """
+    count = es.count(index=index_name)["count"]
+    if count != expected:
+        raise RuntimeError(f"{index_name} holds {count} documents, expected {expected}")
+
+    if previous:
+        previous_count = es.count(index=previous)["count"]
+        if count < previous_count * min_ratio:
+            raise RuntimeError(
+                f"{index_name} holds {count} documents, fewer than {min_ratio:.0%} "
+                f"of the {previous_count} in {previous}")
+    logger.info(f"Verified {index_name}: {count} documents")
+
+
+def swap_alias(es, alias: str, index_name: str):
+    """
+    Point `alias` at `index_name` in one atomic update.
+    """
+    actions = []
+    if es.indices.exists_alias(name=alias):
+        for current in es.indices.get_alias(name=alias):
+            actions.append({"remove": {"index": current, "alias": alias}})
+    elif es.indices.exists(index=alias):
+        # Replace a legacy concrete index in the same atomic step
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index_name, "alias": alias}})
+
+    es.indices.update_aliases(actions=actions)
+    logger.info(f"Alias {alias} now points to {index_name}")
+
+
+def prune_generations(es, alias: str, keep: int = 1):
+    """
+    Delete old generations, keeping the live one plus `keep` previous ones.
+    """
+    live = live_index(es, alias)
+    old = [name for name in list_generations(es, alias) if name != live]
+    for name in old[:max(0, len(old) - keep)]:
+        logger.info(f"Deleting old generation: {name}")
+        es.indices.delete(index=name)
+
+
+def rebuild(es, alias: str, path: str, keep: int = 1, min_ratio: float = 0.9,
+            workers: int = 1, index_settings: dict | None = None, actions=iter_actions,
+            **bulk_options) -> str:
+    """
+    Zero-downtime rebuild: load a fresh `<alias>_vN` index in the background,
+    warm it up and verify it, then swap the alias over and prune old
+    generations. Searches keep hitting the previous generation until the swap.
+    """
+    previous = live_index(es, alias)
+    index_name = next_generation(es, alias)
+
+    logger.info(f"Creating index: {index_name}")
+    es.indices.create(index=index_name, body=index_settings or INDEX_SETTINGS)
+
+    try:
+        stats = index_dump(es, index_name, path, workers=workers, actions=actions, **bulk_options)
+        verify_generation(es, index_name, stats.indexed, previous, min_ratio=min_ratio)
+        warm_up(es, index_name)
+    except Exception:
+        logger.error(f"Rebuild failed, {alias} still points to {previous}")
+        es.indices.delete(index=index_name)
+        raise
+
+    swap_alias(es, alias, index_name)
+    prune_generations(es, alias, keep=keep)
+    return index_name
+
+
+def fetch_hashes(es, index_name: str) -> dict[str, str | None]:
+    """
+    Map every document ID in the index to its stored content hash.
+    """
+    return {
+        hit["_id"]: hit.get("_source", {}).get("content_hash")
+        for hit in scan(es, index=index_name, query={"query": {"match_all": {}}},
+                        _source=["content_hash"], size=5000)
+    }
+
+
+def update_incrementally(es, alias: str, path: str, workers: int = 1, suggest_weight=None,
+                         **bulk_options) -> dict:
+    """
+    Send only the rows of the dump that are new or changed since the last
+    load, and delete documents that disappeared from it.
+
+    Changes are detected with the `content_hash` stored on each document.
+    Documents indexed before hashes existed count as changed once. Only the
+    documents sent get fresh completion weights from `suggest_weight`.
+    """
+    logger.info(f"Fetching content hashes from {alias}")
+    existing = fetch_hashes(es, alias)
+    changes = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+    seen = set()
+
+    def actions():
+        for doc in iter_documents(path, workers=workers):
+            seen.add(doc["id"])
+            if doc["id"] not in existing:
+                changes["new"] += 1
+            elif existing[doc["id"]] != doc["content_hash"]:
+                changes["changed"] += 1
+            else:
+                changes["unchanged"] += 1
+                continue
+            # Full-document index op: creates new IDs and replaces changed ones
+            yield {"_index": alias, "_id": doc["id"],
+                   "_source": dict(doc, suggest=completion_inputs(doc, suggest_weight))}
+
+        for doc_id in existing.keys() - seen:
+            changes["deleted"] += 1
+            yield {"_op_type": "delete", "_index": alias, "_id": doc_id}
+
+    stats = parallel_streaming_bulk(es, actions(), **bulk_options)
+    es.indices.refresh(index=alias)
+
+    logger.info(
+        f"Incremental update of {alias} completed. New: {changes['new']}, "
+        f"changed: {changes['changed']}, deleted: {changes['deleted']}, "
+        f"unchanged: {changes['unchanged']}, failed: {stats.failed}, "
+        f"time: {stats.elapsed:.2f} seconds")
+    for error in stats.errors:
+        logger.error(f"Failed document: {error}")
+    return dict(changes, failed=stats.failed)
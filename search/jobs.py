@@ -0,0 +1,171 @@
+"""
+Background generation jobs.
+
+A search made with `defer=1` returns its documents right away and queues
+the answer as a GenerationJob in the default database. `manage.py
+generation_worker` processes claim queued jobs, highest priority first, and
+never run more than SEARCH_JOB_CONCURRENCY at a time between them, so the
+LLM endpoint sees a bounded number of calls however many web workers queue
+jobs. Clients poll `/search/jobs/<id>/` or subscribe to its event stream.
+
+Admitting a job to the queue and claiming one are single conditional
+UPDATEs, so workers never take the same job and the queue and concurrency
+caps hold without any other coordination. A job whose
+worker died is requeued once it has been running for SEARCH_JOB_TIMEOUT,
+and a failed job is retried after SEARCH_JOB_RETRY_DELAY seconds, doubling
+with every attempt, so a rate-limited endpoint isn't hit again at once.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .metrics import GENERATION_JOBS
+from .models import GenerationJob
+from .rag import answer_confidence
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def enqueue(query: str, context_parts: list[str], cache_key_parts: list[str], document_count: int,
+            priority: int) -> GenerationJob:
+    """
+    Queue the answer for `query`. Raises QueueFull beyond SEARCH_JOB_MAX_QUEUED
+    waiting jobs.
+    """
+    # Inserted outside the queue, then admitted like claim() takes a job
+    job = GenerationJob.objects.create(query=query, context_parts=context_parts, cache_key_parts=cache_key_parts,
+                                       document_count=document_count, priority=priority, status=GenerationJob.NEW)
+    queued = (GenerationJob.objects.filter(status=GenerationJob.QUEUED).order_by()
+              .values("status").annotate(count=Count("pk")).values("count"))
+    # One statement: concurrent searches can't both take the last place
+    admitted = (GenerationJob.objects.filter(pk=job.pk)
+                .alias(queued=Coalesce(Subquery(queued), 0))
+                .filter(queued__lt=settings.SEARCH_JOB_MAX_QUEUED)
+                .update(status=GenerationJob.QUEUED))
+    if not admitted:
+        job.delete()
+        GENERATION_JOBS.inc(outcome="rejected")
+        raise QueueFull(f"{settings.SEARCH_JOB_MAX_QUEUED} generation jobs are already waiting")
+    job.status = GenerationJob.QUEUED
+    GENERATION_JOBS.inc(outcome="queued")
+    return job
+
+
+def get_job(job_id) -> GenerationJob | None:
+    return GenerationJob.objects.filter(pk=job_id).first()
+
+
+def claim() -> GenerationJob | None:
+    """
+    Mark the next queued job running and return it. None when the queue is
+    empty or SEARCH_JOB_CONCURRENCY jobs are already running.
+    """
+    while True:
+        job = (GenerationJob.objects
+               .filter(Q(not_before__isnull=True) | Q(not_before__lte=timezone.now()), status=GenerationJob.QUEUED)
+               .order_by("-priority", "created_at").first())
+        if job is None:
+            return None
+
+        running = (GenerationJob.objects.filter(status=GenerationJob.RUNNING).order_by()
+                   .values("status").annotate(count=Count("pk")).values("count"))
+        now = timezone.now()
+        # One statement: the job must still be queued and the cap not reached
+        claimed = (GenerationJob.objects.filter(pk=job.pk, status=GenerationJob.QUEUED)
+                   .alias(running=Coalesce(Subquery(running), 0))
+                   .filter(running__lt=settings.SEARCH_JOB_CONCURRENCY)
+                   .update(status=GenerationJob.RUNNING, started_at=now, attempts=F("attempts") + 1))
+        if claimed:
+            job.status, job.started_at, job.attempts = GenerationJob.RUNNING, now, job.attempts + 1
+            return job
+        if GenerationJob.objects.filter(pk=job.pk, status=GenerationJob.QUEUED).exists():
+            return None  # At the cap
+        # Another worker took this job first; try the next one
+
+
+def finish(job: GenerationJob, answer: str):
+    GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.DONE, answer=answer, error="",
+                                                   finished_at=timezone.now())
+    GENERATION_JOBS.inc(outcome="done")
+
+
+def fail(job: GenerationJob, error: str):
+    """
+    Requeue a failed job with a backoff, or give up on it after
+    SEARCH_JOB_MAX_ATTEMPTS.
+    """
+    if job.attempts < settings.SEARCH_JOB_MAX_ATTEMPTS:
+        delay = settings.SEARCH_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.QUEUED, error=error,
+                                                       not_before=timezone.now() + timedelta(seconds=delay))
+        GENERATION_JOBS.inc(outcome="retried")
+        return
+    GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.FAILED, error=error,
+                                                   finished_at=timezone.now())
+    GENERATION_JOBS.inc(outcome="failed")
+
+
+def requeue_stale() -> int:
+    """
+    Put jobs that have been running longer than SEARCH_JOB_TIMEOUT back in
+    the queue; their worker is gone or stuck. Returns how many.
+    """
+    stale = GenerationJob.objects.filter(status=GenerationJob.RUNNING,
+                                         started_at__lt=timezone.now() - timedelta(seconds=settings.SEARCH_JOB_TIMEOUT))
+    failed = stale.filter(attempts__gte=settings.SEARCH_JOB_MAX_ATTEMPTS).update(
+        status=GenerationJob.FAILED, error="Timed out", finished_at=timezone.now())
+    requeued = stale.update(status=GenerationJob.QUEUED)
+    if failed or requeued:
+        logger.warning(f"Generation jobs timed out: {requeued} requeued, {failed} failed")
+        GENERATION_JOBS.inc(failed, outcome="failed")
+        GENERATION_JOBS.inc(requeued, outcome="retried")
+    return failed + requeued
+
+
+def purge_expired() -> int:
+    """
+    Delete finished jobs older than SEARCH_JOB_TTL seconds.
+    """
+    expired = GenerationJob.objects.filter(
+        Q(status=GenerationJob.DONE) | Q(status=GenerationJob.FAILED),
+        finished_at__lt=timezone.now() - timedelta(seconds=settings.SEARCH_JOB_TTL))
+    return expired.delete()[0]
+
+
+def queue_position(job: GenerationJob) -> int:
+    """
+    Number of queued jobs that run before `job`.
+    """
+    return GenerationJob.objects.filter(
+        Q(priority__gt=job.priority) | Q(priority=job.priority, created_at__lt=job.created_at),
+        status=GenerationJob.QUEUED).count()
+
+
+def job_payload(job: GenerationJob) -> dict:
+    """
+    The job as returned by the job endpoints.
+    """
+    payload = {
+        "id": str(job.id),
+        "status": job.status,
+        "priority": job.priority,
+        "query": job.query,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == GenerationJob.QUEUED:
+        payload["queue_position"] = queue_position(job)
+    elif job.status == GenerationJob.DONE:
+        payload["rag_answer"] = {"answer": job.answer, "confidence": answer_confidence(job.document_count)}
+    elif job.status == GenerationJob.FAILED:
+        payload["detail"] = job.error
+    return payload
@@ -0,0 +1,281 @@
+"""
+In-process BM25 index over the NFCorpus dump.
+
+The index is a directory of NumPy arrays loaded with `mmap_mode="r"`, so
+every worker process on a host shares the same pages through the OS page
+cache instead of holding its own copy. Layout:
+
+    meta.json              build ID, document count, per-field average lengths, BM25 params
+    vocab.json             term -> term id, shared by all fields
+    doc_ids.json           position -> document ID
+    <field>.offsets.npy    int64[V + 1], postings of term t are [offsets[t], offsets[t + 1])
+    <field>.docs.npy       int32 document positions, grouped by term
+    <field>.tfs.npy        float32 term frequencies, aligned with docs
+    <field>.lengths.npy    float32 token count of the field per document
+    sources.jsonl          stored fields, one JSON object per line
+    sources.offsets.npy    int64 byte offset of each line in sources.jsonl
+
+Rebuilds write a new directory next to the live one and publish it by
+flipping a symlink (see publish_index); workers notice the flip on their
+next search and map the new build.
+"""
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from .analysis import tokenize
+from .reloading import ReloadingCache, index_version
+
+logger = logging.getLogger(__name__)
+
+# Text fields scored by BM25
+INDEXED_FIELDS = ["title", "description", "main_text"]
+
+# Fields kept for building responses and RAG context
+STORED_FIELDS = ["id", "url", "title", "main_text", "description", "topics_tags", "content_hash"]
+
+# Elasticsearch's BM25 defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def build_index(docs, output_dir: str) -> int:
+    """
+    Write a local index for an iterable of parsed documents. Returns the
+    number of documents indexed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    vocab = {}
+    postings = {field: defaultdict(list) for field in INDEXED_FIELDS}
+    lengths = {field: [] for field in INDEXED_FIELDS}
+    doc_ids = []
+    source_offsets = []
+
+    with open(os.path.join(output_dir, "sources.jsonl"), "wb") as sources:
+        for position, doc in enumerate(docs):
+            doc_ids.append(doc["id"])
+            for field in INDEXED_FIELDS:
+                tokens = tokenize(doc.get(field, ""))
+                lengths[field].append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    term_id = vocab.setdefault(term, len(vocab))
+                    postings[field][term_id].append((position, tf))
+
+            source_offsets.append(sources.tell())
+            stored = {field: doc[field] for field in STORED_FIELDS if field in doc}
+            sources.write(json.dumps(stored, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    # Unique per build, reported as the index generation (`_index`) of search hits
+    meta = {"num_docs": len(doc_ids), "build_id": uuid.uuid4().hex[:12], "built_at": int(time.time()),
+            "k1": BM25_K1, "b": BM25_B, "fields": {}}
+    for field in INDEXED_FIELDS:
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_parts, tf_parts = [], []
+        for term_id in range(len(vocab)):
+            entries = postings[field].get(term_id, [])
+            offsets[term_id + 1] = offsets[term_id] + len(entries)
+            doc_parts.extend(position for position, _ in entries)
+            tf_parts.extend(tf for _, tf in entries)
+
+        field_lengths = np.asarray(lengths[field], dtype=np.float32)
+        np.save(os.path.join(output_dir, f"{field}.offsets.npy"), offsets)
+        np.save(os.path.join(output_dir, f"{field}.docs.npy"), np.asarray(doc_parts, dtype=np.int32))
+        np.save(os.path.join(output_dir, f"{field}.tfs.npy"), np.asarray(tf_parts, dtype=np.float32))
+        np.save(os.path.join(output_dir, f"{field}.lengths.npy"), field_lengths)
+        meta["fields"][field] = {"avg_length": float(field_lengths.mean()) if len(field_lengths) else 0.0}
+
+    np.save(os.path.join(output_dir, "sources.offsets.npy"), np.asarray(source_offsets, dtype=np.int64))
+    with open(os.path.join(output_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(output_dir, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_ids, f)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    logger.info(f"Built local index with {len(doc_ids)} documents and {len(vocab)} terms in {output_dir}")
+    return len(doc_ids)
+
+
+def parse_fields(fields: list[str]) -> dict[str, float]:
+    """
+    Turn Elasticsearch-style field specs ("title^3") into {field: boost}.
+    """
+    boosts = {}
+    for spec in fields:
+        name, _, boost = spec.partition("^")
+        boosts[name] = float(boost) if boost else 1.0
+    return boosts
+
+
+class LocalIndex:
+    """
+    Read-only view of an index directory with vectorized BM25 scoring.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+
+        self.num_docs = self.meta["num_docs"]
+        self.index_name = f"local_{self.meta.get('build_id', 'v0')}"
+        self.k1 = self.meta["k1"]
+        self.b = self.meta["b"]
+        self.fields = {}
+        for field, info in self.meta["fields"].items():
+            self.fields[field] = {
+                "avg_length": info["avg_length"],
+                "offsets": self._load(f"{field}.offsets.npy"),
+                "docs": self._load(f"{field}.docs.npy"),
+                "tfs": self._load(f"{field}.tfs.npy"),
+                "lengths": self._load(f"{field}.lengths.npy"),
+            }
+        self.source_offsets = self._load("sources.offsets.npy")
+        self.position_by_id = {doc_id: position for position, doc_id in enumerate(self.doc_ids)}
+
+        with open(os.path.join(path, "sources.jsonl"), "rb") as f:
+            self._sources = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+
+    def _load(self, name: str):
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    def term_ids(self, text: str) -> list[int]:
+        return [self.vocab[term] for term in dict.fromkeys(tokenize(text)) if term in self.vocab]
+
+    def term_scores(self, field: str, term_id: int):
+        """
+        BM25 contributions of one term in one field: (doc positions, scores).
+        """
+        data = self.fields[field]
+        start, end = data["offsets"][term_id], data["offsets"][term_id + 1]
+        docs = data["docs"][start:end]
+        if not len(docs):
+            return docs, np.zeros(0, dtype=np.float32)
+
+        tfs = data["tfs"][start:end]
+        idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * data["lengths"][docs] / (data["avg_length"] or 1.0))
+        return docs, idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+    def best_fields(self, term_ids: list[int], boosts: dict[str, float]):
+        """
+        Score of the best matching field per document, like a `best_fields`
+        multi_match.
+        """
+        best = np.zeros(self.num_docs, dtype=np.float32)
+        for field, boost in boosts.items():
+            if field not in self.fields:
+                continue
+            field_scores = np.zeros(self.num_docs, dtype=np.float32)
+            for term_id in term_ids:
+                docs, scores = self.term_scores(field, term_id)
+                field_scores[docs] += scores
+            np.maximum(best, boost * field_scores, out=best)
+        return best
+
+    def cross_fields(self, term_ids: list[int], boosts: dict[str, float]):
+        """
+        Sum over terms of the best field score per term, like a
+        `cross_fields` multi_match.
+        """
+        total = np.zeros(self.num_docs, dtype=np.float32)
+        for term_id in term_ids:
+            best = np.zeros(self.num_docs, dtype=np.float32)
+            for field, boost in boosts.items():
+                if field not in self.fields:
+                    continue
+                docs, scores = self.term_scores(field, term_id)
+                best[docs] = np.maximum(best[docs], boost * scores)
+            total += best
+        return total
+
+    def source(self, position: int) -> dict:
+        start = int(self.source_offsets[position])
+        end = self._sources.find(b"\n", start)
+        return json.loads(self._sources[start:end])
+
+    def search(self, query: str, expanded_terms: list[str], size: int,
+               query_fields: list[str], expansion_fields: list[str]) -> dict:
+        """
+        Mirror of the Elasticsearch query in search.rag.build_search_body:
+        the original query must match (best_fields), expansion terms only
+        add to the score (cross_fields). Returns an ES-shaped response.
+        """
+        must = self.best_fields(self.term_ids(query), parse_fields(query_fields))
+        matched = np.flatnonzero(must > 0)
+
+        scores = must[matched]
+        if expanded_terms:
+            should = self.cross_fields(self.term_ids(" ".join(expanded_terms)), parse_fields(expansion_fields))
+            scores = scores + should[matched]
+
+        if len(matched) > size:
+            top = np.argpartition(-scores, size - 1)[:size]
+        else:
+            top = np.arange(len(matched))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        hits = [
+            {
+                "_index": self.index_name,
+                "_id": self.doc_ids[matched[i]],
+                "_score": float(scores[i]),
+                "_source": self.source(int(matched[i])),
+            }
+            for i in top
+        ]
+        return {
+            "hits": {
+                "total": {"value": int(len(matched)), "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            }
+        }
+
+
+def new_build_dir(output: str) -> str:
+    """
+    Fresh directory next to `output` to build the next index into.
+    """
+    return f"{os.path.abspath(output)}.{uuid.uuid4().hex[:12]}"
+
+
+def publish_index(build_dir: str, output: str):
+    """
+    Make `output` a symlink to `build_dir` with a single atomic rename, then
+    delete the build it replaces. Workers still mapping the old files keep
+    reading them until they reload.
+    """
+    output = os.path.abspath(output)
+    previous = os.path.realpath(output) if os.path.islink(output) else None
+    if os.path.isdir(output) and not os.path.islink(output):
+        # Index built before builds were published through a symlink: move it
+        # aside once, there is no atomic way to turn a directory into a link
+        previous = f"{output}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(output, previous)
+
+    link = f"{output}.link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(build_dir), link)
+    os.replace(link, output)
+
+    if previous and previous != os.path.realpath(build_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+# Reloaded when build_local_index publishes a new build
+load_index = ReloadingCache(LocalIndex, version=index_version)
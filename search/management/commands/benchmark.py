@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from search import clients
+from search.backends import get_backend
+from search.benchmark import (
+    level_report,
+    load_queries,
+    queries_from_titles,
+    run_async,
+    run_sync,
+)
+from search.indexing import iter_documents, read_rows, rebuild
+from search.local_index import build_index, load_index
+from search.metrics import flush as flush_metrics
+from search.rag import INDEX_NAME
+from search.standins import StandInElasticsearch, StandInLLM
+
+ENDPOINTS = {
+    "search": "/search/",
+    "async": "/search/async/",
+    "stream": "/search/stream/",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark indexing and the search endpoints against local stand-ins for "
+        "Elasticsearch and the LLM, with injected latency. No network access needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Tab-separated dump loaded into the stand-in")
+        parser.add_argument("--max-docs", type=int,
+                            help="Only load the first N rows of the dump")
+        parser.add_argument("--queries",
+                            help="NFCorpus .queries file or one query per line "
+                                 "(default: document titles from --source)")
+        parser.add_argument("--requests", type=int, default=100,
+                            help="Requests per concurrency level, cycling through the queries")
+        parser.add_argument("--concurrency", default="1,4,16",
+                            help="Comma-separated concurrency levels")
+        parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="search",
+                            help="View to drive: search (sync), async or stream (SSE)")
+        parser.add_argument("-k", type=int, default=5, help="Documents per search")
+        parser.add_argument("--backend", choices=["elasticsearch", "local"], default="elasticsearch",
+                            help="Retrieval backend to benchmark")
+        parser.add_argument("--es-latency", type=float, default=0.005,
+                            help="Seconds added to every stand-in Elasticsearch request")
+        parser.add_argument("--es-jitter", type=float, default=0.0)
+        parser.add_argument("--reject-rate", type=float, default=0.0,
+                            help="Fraction of bulk items the stand-in rejects with 429")
+        parser.add_argument("--llm-latency", type=float, default=0.5,
+                            help="Seconds before a stand-in LLM call starts answering")
+        parser.add_argument("--llm-token-latency", type=float, default=0.01,
+                            help="Seconds per generated token")
+        parser.add_argument("--llm-jitter", type=float, default=0.0)
+        parser.add_argument("--answer-tokens", type=int, default=150,
+                            help="Tokens in a stand-in answer")
+        parser.add_argument("--warm", action="store_true",
+                            help="Keep expansion and answer caches across requests "
+                                 "(default: caches disabled, every request does the full work)")
+        parser.add_argument("--output", default="benchmark.json",
+                            help="Where to write the machine-readable results")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers")
+        logging.getLogger("elastic_transport").setLevel(logging.WARNING)
+
+        workdir = tempfile.mkdtemp(prefix="search-benchmark-")
+        es_server = StandInElasticsearch(latency=options["es_latency"], jitter=options["es_jitter"],
+                                         reject_rate=options["reject_rate"]).start()
+        llm_options = dict(latency=options["llm_latency"], token_latency=options["llm_token_latency"],
+                           jitter=options["llm_jitter"], answer_tokens=options["answer_tokens"])
+        llm, async_llm = StandInLLM(**llm_options), StandInLLM(**llm_options, is_async=True)
+        clients.install(es=Elasticsearch(es_server.url), client=llm, async_client=async_llm)
+
+        try:
+            with override_settings(**self.isolated_settings(workdir, options)):
+                source = self.prepare_source(options, workdir)
+                results = {
+                    "started": datetime.now(timezone.utc).isoformat(),
+                    "host": {"python": platform.python_version(), "cpus": os.cpu_count()},
+                    "config": {key: options[key] for key in (
+                        "source", "max_docs", "queries", "requests", "endpoint", "k", "backend",
+                        "es_latency", "es_jitter", "reject_rate", "llm_latency", "llm_token_latency",
+                        "llm_jitter", "answer_tokens", "warm")},
+                    "indexing": self.benchmark_indexing(es_server, source, options),
+                    "levels": [],
+                }
+
+                queries = (load_queries(options["queries"]) if options["queries"]
+                           else queries_from_titles(source, options["requests"]))
+                if not queries:
+                    raise CommandError("No queries to replay")
+                workload = [queries[i % len(queries)] for i in range(options["requests"])]
+
+                for concurrency in levels:
+                    llm.calls = async_llm.calls = 0
+                    report = self.run_level(es_server, workload, concurrency, options)
+                    report["llm_calls"] = llm.calls + async_llm.calls
+                    results["levels"].append(report)
+                    self.print_level(report)
+
+                # Write out pending metrics while METRICS_DIR is still the scratch one
+                flush_metrics()
+        finally:
+            es_server.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def isolated_settings(self, workdir: str, options) -> dict:
+        """
+        Keep caches, locks and metrics of the run out of the real CACHE_DIR,
+        and its queries out of the database and the suggestions.
+        """
+        if options["warm"]:
+            caches = {alias: dict(config, LOCATION=os.path.join(workdir, "cache", alias))
+                      for alias, config in settings.CACHES.items() if "LOCATION" in config}
+            caches = {**settings.CACHES, **caches}
+        else:
+            caches = {alias: {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+                      for alias in settings.CACHES}
+        return {
+            "CACHES": caches,
+            "SEARCH_BACKEND": options["backend"],
+            "LOCAL_INDEX_DIR": os.path.join(workdir, "local_index"),
+            "SEARCH_COALESCE_DIR": os.path.join(workdir, "locks"),
+            "METRICS_DIR": os.path.join(workdir, "metrics"),
+            "SEARCH_PROFILE_DIR": os.path.join(workdir, "profiles"),
+            "SUGGESTIONS_FILE": os.path.join(workdir, "suggestions.json"),
+            "SUGGEST_RECORD_QUERIES": False,
+        }
+
+    def prepare_source(self, options, workdir: str) -> str:
+        if not options["max_docs"]:
+            return options["source"]
+        path = os.path.join(workdir, "source.txt")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for position, row in enumerate(read_rows(options["source"])):
+                if position >= options["max_docs"]:
+                    break
+                f.write("\t".join(row) + "\n")
+        return path
+
+    def benchmark_indexing(self, es_server, source: str, options) -> dict:
+        start = time.perf_counter()
+        if options["backend"] == "local":
+            count = build_index(iter_documents(source), settings.LOCAL_INDEX_DIR)
+            load_index.cache_clear()
+        else:
+            client = Elasticsearch(es_server.url)
+            rebuild(client, INDEX_NAME, source, min_ratio=0)
+            count = client.count(index=INDEX_NAME)["count"]
+        seconds = time.perf_counter() - start
+        get_backend.cache_clear()
+
+        report = {"backend": options["backend"], "documents": count, "seconds": round(seconds, 3),
+                  "docs_per_sec": round(count / seconds, 1) if seconds else None}
+        self.stdout.write(f"Indexed {count} documents into the {options['backend']} backend "
+                          f"in {seconds:.2f}s ({report['docs_per_sec']} docs/s)")
+        return report
+
+    def run_level(self, es_server, workload: list[str], concurrency: int, options) -> dict:
+        endpoint = ENDPOINTS[options["endpoint"]]
+        if options["endpoint"] == "search":
+            samples, seconds = run_sync(endpoint, workload, concurrency, options["k"])
+            return level_report(samples, seconds, concurrency)
+
+        async def run():
+            # The async client binds to the event loop it first runs on
+            async_es = AsyncElasticsearch(es_server.url)
+            clients.install(async_es=async_es)
+            try:
+                return await run_async(endpoint, workload, concurrency, options["k"],
+                                       streaming=options["endpoint"] == "stream")
+            finally:
+                await async_es.close()
+
+        samples, seconds = asyncio.run(run())
+        return level_report(samples, seconds, concurrency)
+
+    def print_level(self, report: dict):
+        self.stdout.write(
+            f"concurrency={report['concurrency']}: {report['throughput_rps']} req/s, "
+            f"{report['errors']} errors, {report['llm_calls']} LLM calls")
+        for stage, stats in report["latency_ms"].items():
+            if stats:
+                self.stdout.write(f"  {stage:<12} p50={stats['p50']:>9.1f}ms  p95={stats['p95']:>9.1f}ms  "
+                                  f"p99={stats['p99']:>9.1f}ms")
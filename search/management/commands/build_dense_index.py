@@ -0,0 +1,32 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.dense import build_dense_index, get_encoder
+from search.indexing import iter_documents
+from search.local_index import new_build_dir, publish_index
+
+
+class Command(BaseCommand):
+    help = "Encode documents with DENSE_ENCODER and write the vector index used by mode=hybrid"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Path to the tab-separated dump")
+        parser.add_argument("--output", default=settings.DENSE_INDEX_DIR,
+                            help="Directory to write the vectors to")
+        parser.add_argument("--batch-size", type=int, default=256,
+                            help="Documents encoded per batch")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+
+        # Same symlink flip as build_local_index
+        output = os.path.abspath(options["output"])
+        build_dir = new_build_dir(output)
+        count = build_dense_index(iter_documents(options["source"]), build_dir,
+                                  get_encoder(), batch_size=options["batch_size"])
+        publish_index(build_dir, output)
+
+        self.stdout.write(self.style.SUCCESS(f"Encoded {count} documents into {output}."))
@@ -0,0 +1,41 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.expansion import build_expansions, synonym_rules, write_expansions
+from search.indexing import iter_documents
+
+
+class Command(BaseCommand):
+    help = "Mine nfdump.txt for the local query expansion dictionary"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Path to the tab-separated dump")
+        parser.add_argument("--output", default=settings.EXPANSIONS_FILE,
+                            help="Where to write the expansion dictionary")
+        parser.add_argument("--min-count", type=int, default=3,
+                            help="Minimum co-occurrences for a candidate")
+        parser.add_argument("--max-terms", type=int, default=10,
+                            help="Candidates kept per key")
+        parser.add_argument("--synonyms",
+                            help="Also export Elasticsearch synonym rules to this file "
+                                 "(use with `index_data --synonyms`)")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+
+        expansions = build_expansions(iter_documents(options["source"]),
+                                      min_count=options["min_count"],
+                                      max_terms=options["max_terms"])
+        write_expansions(expansions, options["output"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(expansions)} expansion entries to {options['output']}."))
+
+        if options["synonyms"]:
+            rules = synonym_rules(expansions)
+            with open(options["synonyms"], "w", encoding="utf-8") as f:
+                f.write("\n".join(rules) + "\n")
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {len(rules)} synonym rules to {options['synonyms']}."))
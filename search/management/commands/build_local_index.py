@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.indexing import iter_documents
+from search.local_index import build_index, new_build_dir, publish_index
+
+
+class Command(BaseCommand):
+    help = "Build the memory-mapped BM25 index used by SEARCH_BACKEND='local'"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Path to the tab-separated dump")
+        parser.add_argument("--output", default=settings.LOCAL_INDEX_DIR,
+                            help="Directory to write the index to")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+
+        # Build next to the target and flip the symlink so running workers
+        # never map a half-written index
+        output = os.path.abspath(options["output"])
+        build_dir = new_build_dir(output)
+        count = build_index(iter_documents(options["source"]), build_dir)
+        publish_index(build_dir, output)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents into {output}."))
@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.indexing import iter_documents
+from search.suggest import build_suggestions, write_suggestions
+
+
+class Command(BaseCommand):
+    help = "Collect titles and tags from nfdump.txt for typeahead suggestions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Path to the tab-separated dump")
+        parser.add_argument("--output", default=settings.SUGGESTIONS_FILE,
+                            help="Where to write the suggestions")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+
+        suggestions = build_suggestions(iter_documents(options["source"]))
+        write_suggestions(suggestions, options["output"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(suggestions)} suggestions to {options['output']}."))
@@ -0,0 +1,74 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from search.cache import answer_cache
+from search.jobs import claim, fail, finish, purge_expired, requeue_stale
+from search.metrics import flush as flush_metrics, stage
+from search.views import request_answer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background generation jobs (searches made with defer=1), highest priority "
+        "first. All workers together run at most SEARCH_JOB_CONCURRENCY jobs at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=settings.SEARCH_JOB_CONCURRENCY,
+                            help="Jobs this worker runs at once (default: SEARCH_JOB_CONCURRENCY)")
+        parser.add_argument("--poll-interval", type=float, default=settings.SEARCH_JOB_POLL_INTERVAL,
+                            help="Seconds between checks of an empty or full queue")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit when no job is ready to run instead of waiting for new jobs")
+
+    def handle(self, *args, **options):
+        threads = max(1, options["threads"])
+        self.stdout.write(f"Generation worker running {threads} jobs at a time "
+                          f"(at most {settings.SEARCH_JOB_CONCURRENCY} across all workers)")
+        running = set()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="generation-worker") as pool:
+            try:
+                while True:
+                    requeue_stale()
+                    purge_expired()
+
+                    running = {future for future in running if not future.done()}
+                    while len(running) < threads:
+                        job = claim()
+                        if job is None:
+                            break
+                        running.add(pool.submit(self.run_job, job))
+                        processed += 1
+
+                    if options["once"] and not running:
+                        break
+                    time.sleep(options["poll_interval"])
+            except KeyboardInterrupt:
+                # Running jobs finish; queued ones wait for the next worker
+                self.stdout.write("Stopping after the running jobs")
+
+        flush_metrics()
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs."))
+
+    def run_job(self, job):
+        try:
+            # An identical search may have been answered since the job was queued
+            answer = answer_cache.get(job.query, *job.cache_key_parts)
+            if answer is None:
+                with stage("generation", view="job"):
+                    answer = request_answer(job.query, job.context_parts, job.cache_key_parts)
+        except Exception as e:
+            logger.warning(f"Generation job {job.id} failed (attempt {job.attempts}): {e}")
+            fail(job, str(e))
+        else:
+            finish(job, answer)
+        finally:
+            # Each pool thread has its own database connection
+            connections.close_all()
@@ -1,26 +1,123 @@
-from django.core.management.base import BaseCommand
-from search.elasticsearch_client import es, create_index
+import logging
+import os
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from search.clients import get_es
+from search.indexing import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_INITIAL_BACKOFF,
+    DEFAULT_MAX_CHUNK_BYTES,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_THREADS,
+    build_index_settings,
+    iter_actions,
+    live_index,
+    rebuild,
+    update_incrementally,
+)
+from search.passages import PASSAGE_INDEX_SETTINGS, PASSAGE_OVERLAP, PASSAGE_WORDS, iter_passage_actions
+from search.rag import INDEX_NAME
+from search.suggest import completion_weight
+
 
 class Command(BaseCommand):
-    help = "Index documents into Elasticsearch"
-
-    def handle(self, *args, **kwargs):
-        index_name = "documents"
-        create_index(index_name)
-
-        with open("core/data/doc_dump.txt", "r", encoding="utf-8") as f:
-          for line in f:
-              parts = line.strip().split("\t")
-              if len(parts) != 4:
-                  continue
-              doc_id, url, title, abstract = parts
-
-              doc = {
-                  "url": url,
-                  "title": title,
-                  "abstract": abstract
-              }
-
-              es.index(index=index_name, id=doc_id, body=doc)
-              
-        self.stdout.write(self.style.SUCCESS("Indexing completed."))
\ No newline at end of file
+    help = (
+        "Index nfdump.txt into Elasticsearch. Builds a new index generation "
+        "behind the alias, or updates the live one with --incremental."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="nfcorpus/raw/nfdump.txt",
+                            help="Path to the tab-separated dump")
+        parser.add_argument("--index", default=INDEX_NAME,
+                            help="Alias served to search; generations are named <index>_vN")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Only send new or changed rows and delete vanished ones")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Maximum documents per bulk request")
+        parser.add_argument("--max-chunk-bytes", type=int, default=DEFAULT_MAX_CHUNK_BYTES,
+                            help="Maximum bytes per bulk request")
+        parser.add_argument("--parallelism", type=int, default=DEFAULT_THREADS,
+                            help="Concurrent bulk requests")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes used to parse rows")
+        parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                            help="Retries per document rejected with 429")
+        parser.add_argument("--initial-backoff", type=float, default=DEFAULT_INITIAL_BACKOFF,
+                            help="Seconds to wait before the first 429 retry")
+        parser.add_argument("--keep", type=int, default=1,
+                            help="Previous generations to keep for rollback")
+        parser.add_argument("--synonyms",
+                            help="Synonym rules file from `build_expansions --synonyms` "
+                                 "to apply at search time")
+        parser.add_argument("--min-doc-ratio", type=float, default=0.9,
+                            help="Minimum size of the new generation relative to the live one")
+        parser.add_argument("--passages", action="store_true",
+                            help="Also rebuild <index>_passages, main_text split into overlapping "
+                                 "passages (used with SEARCH_PASSAGES)")
+        parser.add_argument("--passage-words", type=int, default=PASSAGE_WORDS,
+                            help="Words per passage")
+        parser.add_argument("--passage-overlap", type=int, default=PASSAGE_OVERLAP,
+                            help="Words shared by consecutive passages")
+
+    def handle(self, *args, **options):
+        if options["verbosity"] > 0:
+            logging.basicConfig(level=logging.INFO,
+                                format='%(asctime)s - %(levelname)s - %(message)s')
+            # Per-request transport logs drown out the progress reports
+            logging.getLogger("elastic_transport").setLevel(logging.WARNING)
+
+        if not os.path.exists(options["source"]):
+            raise CommandError(f"Source file not found: {options['source']}")
+
+        # Bulk requests need far more time than interactive searches
+        client = get_es().options(request_timeout=120, max_retries=5, retry_on_timeout=True)
+        alias = options["index"]
+        bulk_options = dict(
+            workers=options["workers"],
+            threads=options["parallelism"],
+            chunk_size=options["chunk_size"],
+            max_chunk_bytes=options["max_chunk_bytes"],
+            max_retries=options["max_retries"],
+            initial_backoff=options["initial_backoff"],
+        )
+
+        synonyms = None
+        if options["synonyms"]:
+            with open(options["synonyms"], encoding="utf-8") as f:
+                synonyms = [line.strip() for line in f if line.strip()]
+
+        # Completion inputs are weighted by how often they were searched so far
+        suggest_weight = completion_weight()
+
+        if options["incremental"] and live_index(client, alias):
+            changes = update_incrementally(client, alias, options["source"],
+                                           suggest_weight=suggest_weight, **bulk_options)
+            summary = ", ".join(f"{name}: {count}" for name, count in changes.items())
+            self.stdout.write(self.style.SUCCESS(f"Incremental update completed ({summary})."))
+        else:
+            if options["incremental"]:
+                self.stdout.write(f"{alias} does not exist yet, running a full build")
+            index_name = rebuild(client, alias, options["source"], keep=options["keep"],
+                                 min_ratio=options["min_doc_ratio"],
+                                 index_settings=build_index_settings(synonyms),
+                                 actions=partial(iter_actions, suggest_weight=suggest_weight),
+                                 **bulk_options)
+            count = client.count(index=alias)["count"]
+            self.stdout.write(self.style.SUCCESS(
+                f"Indexing completed. {alias} -> {index_name} ({count} documents)."))
+
+        if options["passages"]:
+            # Passages of changed documents can't be patched in place, so the
+            # passage index is always rebuilt as a whole
+            passage_alias = f"{alias}_passages"
+            actions = partial(iter_passage_actions, size=options["passage_words"],
+                              overlap=options["passage_overlap"])
+            index_name = rebuild(client, passage_alias, options["source"], keep=options["keep"],
+                                 min_ratio=options["min_doc_ratio"], actions=actions,
+                                 index_settings=build_index_settings(synonyms, base=PASSAGE_INDEX_SETTINGS),
+                                 **bulk_options)
+            count = client.count(index=passage_alias)["count"]
+            self.stdout.write(self.style.SUCCESS(
+                f"Passage indexing completed. {passage_alias} -> {index_name} ({count} passages)."))
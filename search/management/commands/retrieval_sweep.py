@@ -0,0 +1,119 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.cache import expansion_cache
+from search.clients import get_es
+from search.evaluation import DEFAULT_VARIANTS, evaluate_variant, load_qrels, load_query_file, resolve_variants
+from search.expansion import load_expander
+from search.rag import INDEX_NAME
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate search body variants on NFCorpus queries and qrels with batched _msearch "
+        "requests, reporting nDCG@k and recall@k next to Elasticsearch took and payload sizes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", required=True,
+                            help="NFCorpus .queries file (<id>\\t<text>)")
+        parser.add_argument("--qrels", required=True,
+                            help="NFCorpus .qrel file (<query id>\\t0\\t<doc id>\\t<relevance>)")
+        parser.add_argument("--index", default=INDEX_NAME, help="Index or alias to search")
+        parser.add_argument("--variants",
+                            help="JSON file with a list of variants, e.g. "
+                                 '[{"name": "flat", "query_fields": ["title", "main_text", "description"], '
+                                 '"k": 10}] '
+                                 "(default: a built-in grid around the production query)")
+        parser.add_argument("--expansion", choices=["cache", "local", "file", "none"], default="cache",
+                            help="Where expanded terms come from. 'cache' reads the expansion cache "
+                                 "filled by the search views without touching its stats; the LLM "
+                                 "is never called")
+        parser.add_argument("--expansions-file",
+                            help="JSON object mapping query text to a list of terms (with --expansion file)")
+        parser.add_argument("--limit", type=int, help="Only evaluate the first N judged queries")
+        parser.add_argument("--batch-size", type=int, default=100, help="Searches per _msearch request")
+        parser.add_argument("--output", default="retrieval_sweep.json",
+                            help="Where to write the machine-readable results")
+
+    def handle(self, *args, **options):
+        for option in ("queries", "qrels"):
+            if not os.path.exists(options[option]):
+                raise CommandError(f"File not found: {options[option]}")
+
+        qrels = load_qrels(options["qrels"])
+        queries = [(query_id, text) for query_id, text in load_query_file(options["queries"]).items()
+                   if query_id in qrels]
+        if options["limit"]:
+            queries = queries[:options["limit"]]
+        if not queries:
+            raise CommandError("None of the queries have relevance judgments")
+
+        try:
+            variants = resolve_variants(self.load_variants(options["variants"]))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        expansions = self.load_expansions([text for _, text in queries], options)
+        self.stdout.write(f"Evaluating {len(variants)} variants on {len(queries)} queries "
+                          f"({len(expansions)} with expansions from {options['expansion']})")
+
+        results = []
+        for variant in variants:
+            report = evaluate_variant(get_es(), options["index"], variant, queries, qrels, expansions,
+                                      batch_size=options["batch_size"])
+            results.append(report)
+            self.print_report(report)
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump({"index": options["index"], "queries": len(queries),
+                       "expansion": options["expansion"], "variants": results}, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def load_variants(self, path: str | None) -> list[dict]:
+        if not path:
+            return DEFAULT_VARIANTS
+        with open(path, encoding="utf-8") as f:
+            variants = json.load(f)
+        if not isinstance(variants, list) or not all(isinstance(variant, dict) for variant in variants):
+            raise ValueError("--variants must hold a JSON list of objects")
+        return variants
+
+    def load_expansions(self, texts: list[str], options) -> dict[str, list[str]]:
+        """
+        {query text: expanded terms} for the queries that have any.
+        """
+        source = options["expansion"]
+        if source == "none":
+            return {}
+        if source == "file":
+            if not options["expansions_file"]:
+                raise CommandError("--expansion file needs --expansions-file")
+            with open(options["expansions_file"], encoding="utf-8") as f:
+                mapping = json.load(f)
+            return {text: mapping[text] for text in texts if mapping.get(text)}
+        if source == "local":
+            expander = load_expander(settings.EXPANSIONS_FILE)
+            if expander is None:
+                raise CommandError(f"No expansion dictionary at {settings.EXPANSIONS_FILE}; "
+                                   "run manage.py build_expansions")
+            lookup = expander.expand
+        else:
+            # peek leaves the production hit/miss counters alone
+            lookup = expansion_cache.peek
+        expansions = {}
+        for text in texts:
+            terms = lookup(text)
+            if terms:
+                expansions[text] = terms
+        return expansions
+
+    def print_report(self, report: dict):
+        k = report["k"]
+        took, sent, received = report["took_ms"], report["request_bytes"], report["response_bytes"]
+        self.stdout.write(
+            f"{report['name']:<24} nDCG@{k}={report['ndcg']}  recall@{k}={report['recall']}  "
+            f"took p50={took.get('p50')}ms p95={took.get('p95')}ms  "
+            f"request={sent.get('mean')}B response={received.get('mean')}B  errors={report['errors']}")
@@ -0,0 +1,278 @@
+"""
+Latency and upstream metrics in the Prometheus text format.
+
+Each worker process keeps its counters and histograms in memory and writes
+a snapshot to `METRICS_DIR/<pid>.json` at most once per
+METRICS_FLUSH_INTERVAL seconds, from a background timer. The metrics
+endpoint merges the snapshots of all workers, so a scrape sees the whole
+deployment no matter which worker answers it. Clear METRICS_DIR when
+deploying, as Prometheus' own multiprocess mode requires.
+
+Stage timings of the current request are also collected in a context
+variable, which `search.middleware.ServerTimingMiddleware` turns into a
+`Server-Timing` header.
+"""
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds in seconds; LLM calls take several seconds, searches milliseconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY = []
+
+_lock = threading.Lock()
+_flush_timer = None
+
+# [(name, milliseconds)] for the request being served, set by the middleware
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> list:
+        with _lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(values: dict, key: tuple, value):
+        raise NotImplementedError
+
+    def samples(self, values: dict):
+        """
+        (name suffix, labels, value) triples for the text exposition.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _schedule_flush()
+
+    @staticmethod
+    def merge(values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            # Non-cumulative bucket counts, then +Inf, sum and count
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+        _schedule_flush()
+
+    @staticmethod
+    def merge(values, key, value):
+        if key in values:
+            values[key] = [a + b for a, b in zip(values[key], value)]
+        else:
+            values[key] = list(value)
+
+    def samples(self, values):
+        for key, state in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield "_bucket", {**labels, "le": le}, cumulative
+            yield "_sum", labels, state[-2]
+            yield "_count", labels, state[-1]
+
+
+STAGE_SECONDS = Histogram(
+    "search_stage_duration_seconds", "Time spent in each search pipeline stage.", ["view", "stage"])
+REQUEST_SECONDS = Histogram(
+    "search_request_duration_seconds", "Time to produce a response, by view.", ["view", "status"])
+BACKEND_TOOK_SECONDS = Histogram(
+    "search_backend_took_seconds", "Search time reported by the retrieval backend (`took`).",
+    ["backend", "mode"])
+LLM_TOKENS = Counter(
+    "search_llm_tokens_total", "Tokens used by LLM calls.", ["call", "kind"])
+UPSTREAM_REQUESTS = Counter(
+    "search_upstream_requests_total", "Calls to Elasticsearch and the LLM, by outcome.",
+    ["upstream", "outcome"])
+HEDGED_REQUESTS = Counter(
+    "search_hedged_requests_total", "Slow upstream calls that got a backup request, by which attempt answered.",
+    ["upstream", "winner"])
+DEGRADED_STAGES = Counter(
+    "search_degraded_stages_total", "Pipeline stages skipped or cut short by the latency budget or a full job queue.",
+    ["stage", "reason"])
+GENERATION_JOBS = Counter(
+    "search_generation_jobs_total", "Background generation jobs, by what happened to them.", ["outcome"])
+
+
+def add_timing(name: str, milliseconds: float):
+    """
+    Add an entry to the current request's Server-Timing header.
+    """
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((name, milliseconds))
+
+
+@contextmanager
+def stage(name: str, view: str = "search"):
+    """
+    Time a pipeline stage into STAGE_SECONDS and the Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, view=view, stage=name)
+        add_timing(name, elapsed * 1000)
+
+
+@contextmanager
+def upstream_call(upstream: str):
+    """
+    Count a call to an upstream service as ok or error. Exceptions propagate.
+    """
+    try:
+        yield
+    except Exception:
+        UPSTREAM_REQUESTS.inc(upstream=upstream, outcome="error")
+        raise
+    UPSTREAM_REQUESTS.inc(upstream=upstream, outcome="ok")
+
+
+def record_took(res: dict, backend: str, mode: str, timing: bool = True):
+    took = res.get("took")
+    if took is not None:
+        BACKEND_TOOK_SECONDS.observe(took / 1000, backend=backend, mode=mode)
+        if timing:
+            add_timing("took", took)
+
+
+def record_usage(call: str, response):
+    """
+    Count prompt and completion tokens from an LLM response's `usage`, when
+    the provider reports it.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            LLM_TOKENS.inc(tokens, call=call, kind=kind)
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(settings.METRICS_DIR, f"{pid}.json")
+
+
+def flush():
+    """
+    Write this process' metrics to its snapshot file.
+    """
+    global _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()  # No-op when called by the timer itself
+            _flush_timer = None
+    data = {metric.name: metric.snapshot() for metric in REGISTRY}
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _schedule_flush():
+    global _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            return
+        _flush_timer = threading.Timer(settings.METRICS_FLUSH_INTERVAL, flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def collect() -> dict:
+    """
+    Merge the snapshots of all workers: {metric name: {label key: value}}.
+    """
+    flush()
+    metrics = {metric.name: metric for metric in REGISTRY}
+    merged = {name: {} for name in metrics}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # Being replaced by its worker
+        for name, values in data.items():
+            if name not in metrics:
+                continue
+            for key, value in values:
+                metrics[name].merge(merged[name], tuple(key), value)
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    merged = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples(merged[metric.name]):
+            label_text = ",".join(f'{name}="{_escape(str(val))}"' for name, val in labels.items())
+            lines.append(f"{metric.name}{suffix}{{{label_text}}} {value}" if label_text
+                         else f"{metric.name}{suffix} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def server_timing_header(timings: list[tuple[str, float]]) -> str:
+    return ", ".join(f"{name};dur={milliseconds:.1f}" for name, milliseconds in timings)
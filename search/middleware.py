@@ -0,0 +1,114 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_SECONDS, add_timing, request_timings, server_timing_header
+from .profiling import (amay_profile, in_scope, may_profile, profile_requested, sampled, start_profile,
+                        stop_profile)
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the stage timings recorded while handling a request into a
+    `Server-Timing` header and observes the request duration per view.
+
+    Streaming responses leave before their body is generated, so only the
+    stages finished by then appear in their header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.finish(request, response, start)
+            return response
+        finally:
+            request_timings.reset(token)
+
+    async def __acall__(self, request):
+        token = request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.finish(request, response, start)
+            return response
+        finally:
+            request_timings.reset(token)
+
+    def finish(self, request, response, start: float):
+        elapsed = time.perf_counter() - start
+        add_timing("total", elapsed * 1000)
+        response["Server-Timing"] = server_timing_header(request_timings.get())
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, view=view, status=response.status_code)
+
+
+class ProfilingMiddleware:
+    """
+    Runs selected requests to the search app under cProfile (see
+    search.profiling) and returns the profile ID in an
+    `X-Search-Profile-Id` header. It must come after
+    AuthenticationMiddleware, which tells whether the user is staff.
+
+    cProfile only sees the thread it runs in. Under ASGI, sync views such as
+    `/search/` run in a worker thread and show up as time spent waiting, so
+    profile them under WSGI (runserver or gunicorn's sync workers). Profiles
+    of async views also include whatever other requests ran on the event loop
+    meanwhile. Streaming responses are profiled up to the moment their body
+    starts.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        selected = ((profile_requested(request) and may_profile(request)) or sampled()) and in_scope(request)
+        profiler = start_profile() if selected else None
+        if profiler is None:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stop_profile(profiler, request, 500, time.perf_counter() - start)
+            raise
+        response["X-Search-Profile-Id"] = stop_profile(profiler, request, response.status_code,
+                                                       time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        selected = ((profile_requested(request) and await amay_profile(request)) or sampled()) and in_scope(request)
+        profiler = start_profile() if selected else None
+        if profiler is None:
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            stop_profile(profiler, request, 500, time.perf_counter() - start)
+            raise
+        response["X-Search-Profile-Id"] = stop_profile(profiler, request, response.status_code,
+                                                       time.perf_counter() - start)
+        return response
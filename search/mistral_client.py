@@ -1,9 +1,15 @@
-import os
-from huggingface_hub import InferenceClient
-from dotenv import load_dotenv
+"""
+The inference clients, created by search.clients on first access: `client`
+and `async_client` (used by the async views and the streaming endpoint).
+New code calls `clients.get_llm()` / `clients.get_async_llm()` where it
+needs them.
+"""
+from . import clients
 
-load_dotenv()
-client = InferenceClient(
-    provider="hf-inference",
-    api_key=(os.getenv("API_KEY")),
-)
+MODEL = "mistralai/Mistral-7B-Instruct-v0.3"
+
+
+def __getattr__(name):
+    if name in ("client", "async_client"):
+        return clients.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
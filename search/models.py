@@ -1,3 +1,52 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class GenerationJob(models.Model):
+    """
+    A RAG answer generated in the background by `manage.py generation_worker`
+    for a search made with `defer=1`.
+    """
+    NEW = "new"  # Inserted by enqueue, not yet admitted to the queue
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(NEW, "New"), (QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.PositiveSmallIntegerField(default=5)  # Higher runs first
+    query = models.TextField()
+    context_parts = models.JSONField(default=list)
+    cache_key_parts = models.JSONField(default=list)  # rag.answer_cache_parts of the hits
+    document_count = models.PositiveSmallIntegerField(default=0)
+    answer = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    not_before = models.DateTimeField(null=True, blank=True)  # Retry backoff
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "-priority", "created_at"], name="search_job_queue_idx")]
+
+    def __str__(self):
+        return f"{self.query} ({self.status})"
+
+
+class PopularQuery(models.Model):
+    """
+    How often a query found documents; popular ones feed /search/suggest/.
+    """
+    text = models.CharField(max_length=200, unique=True)  # cache.normalize_query form
+    count = models.PositiveIntegerField(default=0)
+    last_searched = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["-count"], name="search_popular_count_idx")]
+
+    def __str__(self):
+        return f"{self.text} ({self.count})"
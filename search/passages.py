@@ -0,0 +1,197 @@
+"""
+Passage-level retrieval context.
+
+`index_data --passages` splits each document's `main_text` into
+overlapping word windows and indexes them into a separate passages index,
+one Elasticsearch document per passage linked to its parent by `doc_id`.
+Searching that index with `collapse` on `doc_id` returns the best documents
+together with their best passages, so the RAG prompt gets the parts of a
+document that match the query instead of the start of its text. Every
+passage carries its parent's PARENT_FIELDS, so the hits need no second
+request for them.
+
+Like search.indexing, this module has no Django dependency.
+"""
+import copy
+from collections import defaultdict
+
+from .analysis import tokenize
+from .indexing import INDEX_SETTINGS
+
+# Passage length and overlap in words
+PASSAGE_WORDS = 120
+PASSAGE_OVERLAP = 30
+
+PASSAGE_QUERY_FIELDS = ["title^2", "text"]
+
+# Parent document fields copied into each passage and returned with its hit
+PARENT_FIELDS = ["title", "url", "description", "content_hash"]
+
+PASSAGE_INDEX_SETTINGS = {
+    "settings": copy.deepcopy(INDEX_SETTINGS["settings"]),
+    "mappings": {
+        "properties": {
+            "doc_id": {"type": "keyword"},
+            "url": {"type": "keyword"},
+            "title": {"type": "text", "analyzer": "content_analyzer"},
+            "description": {"type": "text", "index": False},
+            "content_hash": {"type": "keyword"},
+            "position": {"type": "integer"},
+            "text": {"type": "text", "analyzer": "content_analyzer"}
+        }
+    }
+}
+
+
+def split_passages(text: str, size: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP) -> list[str]:
+    """
+    Windows of `size` words, each sharing `overlap` words with the previous one.
+    """
+    words = text.split()
+    step = max(1, size - overlap)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return passages
+
+
+def iter_passage_actions(index_name: str, docs, size: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP):
+    """
+    Bulk actions for the passages of every document with a `main_text`.
+    """
+    for doc in docs:
+        for position, text in enumerate(split_passages(doc.get("main_text", ""), size, overlap)):
+            yield {
+                "_index": index_name,
+                "_id": f"{doc['id']}-{position}",
+                "_source": {
+                    "doc_id": doc["id"],
+                    **{field: doc.get(field, "") for field in PARENT_FIELDS},
+                    "position": position,
+                    "text": text,
+                },
+            }
+
+
+def build_passage_search_body(query: str, expanded_terms: list[str], size: int, per_doc: int) -> dict:
+    """
+    Top `size` documents by their best passage, each with its `per_doc`
+    best passages as inner hits. The `documents` aggregation counts the
+    matching documents; hits.total counts passages.
+    """
+    return {
+        "size": size,
+        "query": {
+            "bool": {
+                "must": [
+                    {"multi_match": {"query": query, "fields": PASSAGE_QUERY_FIELDS, "type": "best_fields"}}
+                ],
+                "should": [
+                    {"multi_match": {"query": " ".join(expanded_terms), "fields": ["text"]}}
+                ],
+                "minimum_should_match": 0
+            }
+        },
+        "collapse": {
+            "field": "doc_id",
+            "inner_hits": {"name": "passages", "size": per_doc, "_source": ["position", "text"]}
+        },
+        "aggs": {"documents": {"cardinality": {"field": "doc_id"}}},
+        "_source": ["doc_id", *PARENT_FIELDS],
+    }
+
+
+def group_passage_hits(res: dict) -> dict:
+    """
+    Turn a collapsed passage search response into document hits (`_id` is
+    the parent document) that carry their best passages under `passages`,
+    counting matching documents rather than passages in hits.total.
+    """
+    hits = []
+    for hit in res["hits"]["hits"]:
+        source = hit["_source"]
+        inner = hit.get("inner_hits", {}).get("passages", {}).get("hits", {}).get("hits") or [hit]
+        hits.append({
+            "_index": hit["_index"],
+            "_id": source["doc_id"],
+            "_score": hit["_score"],
+            "_source": {field: source.get(field, "") for field in PARENT_FIELDS},
+            "passages": [
+                {"position": passage["_source"].get("position"), "score": passage["_score"],
+                 "text": passage["_source"]["text"]}
+                for passage in inner
+            ],
+        })
+    total = res["hits"]["total"]
+    documents = res.get("aggregations", {}).get("documents")
+    if documents is not None:
+        total = {"value": documents["value"], "relation": total.get("relation", "eq")}
+    return dict(res, hits=dict(res["hits"], total=total, hits=hits))
+
+
+def best_passages(text: str, query: str, per_doc: int) -> list[dict]:
+    """
+    Passages of `text` ranked by how many query terms they contain, for
+    backends without a passages index.
+    """
+    terms = set(tokenize(query))
+    scored = []
+    for position, passage in enumerate(split_passages(text)):
+        score = len(terms.intersection(tokenize(passage)))
+        scored.append({"position": position, "score": score, "text": passage})
+    scored.sort(key=lambda passage: (-passage["score"], passage["position"]))
+    return scored[:per_doc]
+
+
+def attach_passages(res: dict, query: str, expanded_terms: list[str], per_doc: int) -> dict:
+    """
+    Add `passages` to whole-document hits by splitting their `main_text`.
+    """
+    text = " ".join([query, *expanded_terms])
+    for hit in res["hits"]["hits"]:
+        hit["passages"] = best_passages(hit["_source"].get("main_text", ""), text, per_doc)
+    return res
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def pack_passages(hits: list[dict], token_budget: int) -> list[str]:
+    """
+    RAG context parts from the passages of `hits`, within `token_budget`.
+
+    Passages are taken round-robin, the best passage of every document
+    before the second best of any, so lower-ranked documents still get in.
+    Passages that don't fit are skipped in favour of shorter ones.
+    """
+    selected = defaultdict(list)
+    used = 0
+    depth = max((len(hit.get("passages", [])) for hit in hits), default=0)
+    for level in range(depth):
+        for rank, hit in enumerate(hits):
+            passages = hit.get("passages", [])
+            if level >= len(passages):
+                continue
+            cost = estimate_tokens(passages[level]["text"])
+            if rank not in selected:
+                cost += estimate_tokens(hit["_source"].get("title", "")) + 5  # Document header
+            if used + cost > token_budget:
+                continue
+            selected[rank].append(passages[level])
+            used += cost
+
+    context_parts = []
+    for rank in sorted(selected):
+        # Keep each document's passages in reading order
+        passages = sorted(selected[rank], key=lambda passage: passage["position"])
+        passage_lines = "\n".join(f"- {passage['text']}" for passage in passages)
+        context_parts.append(f"""Document {rank + 1}:
+Title: {hits[rank]["_source"].get("title", "")}
+Passages:
+{passage_lines}
+""")
+    return context_parts
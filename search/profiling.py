@@ -0,0 +1,161 @@
+"""
+Opt-in cProfile profiling of individual requests.
+
+With SEARCH_PROFILING on, a request to one of the search app's URLs is
+profiled when it carries the `X-Search-Profile: 1` header or is picked by
+SEARCH_PROFILING_SAMPLE_RATE. Other apps, such as the admin, are never
+profiled.
+The header is only honoured for staff users and clients in INTERNAL_IPS,
+who are also the only ones allowed to list profiles.
+Each profile is written to SEARCH_PROFILE_DIR as `<id>.prof` (load it with
+`python -m pstats` or snakeviz) next to `<id>.json`, a summary with the
+request, its duration and its most expensive functions. Only the newest
+SEARCH_PROFILE_KEEP profiles are kept.
+"""
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+PROFILE_HEADER = "X-Search-Profile"
+
+# Functions listed per profile in its summary
+TOP_FUNCTIONS = 15
+
+# cProfile hooks one profiler per thread and concurrent async requests share
+# the event loop thread, so only one request per process is profiled at a time.
+_active = threading.Lock()
+
+
+def profile_requested(request) -> bool:
+    return settings.SEARCH_PROFILING and request.headers.get(PROFILE_HEADER) == "1"
+
+
+def sampled() -> bool:
+    return settings.SEARCH_PROFILING and random.random() < settings.SEARCH_PROFILING_SAMPLE_RATE
+
+
+def in_scope(request) -> bool:
+    """
+    Whether the request goes to the search app. The URL hasn't been resolved
+    yet when middleware runs, so resolve it here.
+    """
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    return "search" in match.app_names
+
+
+def may_profile(request) -> bool:
+    """
+    Whether the client may ask for profiles: a staff user or an address in
+    INTERNAL_IPS.
+    """
+    if request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS:
+        return True
+    user = getattr(request, "user", None)
+    return user is not None and user.is_staff
+
+
+async def amay_profile(request) -> bool:
+    if request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS:
+        return True
+    if not hasattr(request, "auser"):
+        return False
+    user = await request.auser()
+    return user.is_staff
+
+
+def start_profile() -> cProfile.Profile | None:
+    """
+    Start profiling the current thread, or return None if another request
+    in this process is already being profiled.
+    """
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler: cProfile.Profile, request, status: int, duration: float) -> str:
+    """
+    Stop the profiler and save it with its summary. Returns the profile ID.
+    """
+    try:
+        profiler.disable()
+    finally:
+        _active.release()
+
+    os.makedirs(settings.SEARCH_PROFILE_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.randrange(16 ** 6):06x}"
+    base = os.path.join(settings.SEARCH_PROFILE_DIR, profile_id)
+    profiler.dump_stats(f"{base}.prof")
+
+    stats = pstats.Stats(profiler)
+    functions = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        functions.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "tottime": round(tottime, 6),
+            "cumtime": round(cumtime, 6),
+        })
+    functions.sort(key=lambda f: f["tottime"], reverse=True)
+
+    summary = {
+        "id": profile_id,
+        "path": request.path,
+        "query_string": request.META.get("QUERY_STRING", ""),
+        "status": status,
+        "duration_ms": round(duration * 1000, 3),
+        "total_calls": stats.total_calls,
+        "created": time.time(),
+        "top_functions": functions[:TOP_FUNCTIONS],
+    }
+    with open(f"{base}.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+
+    prune_profiles(settings.SEARCH_PROFILE_KEEP)
+    return profile_id
+
+
+def prune_profiles(keep: int):
+    summaries = glob.glob(os.path.join(settings.SEARCH_PROFILE_DIR, "*.json"))
+    summaries.sort(key=_modified_time)
+    for path in summaries[:max(0, len(summaries) - keep)]:
+        for extension in (".json", ".prof"):
+            try:
+                os.remove(path[:-len(".json")] + extension)
+            except FileNotFoundError:
+                pass
+
+
+def _modified_time(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+def list_profiles(limit: int = 20) -> list[dict]:
+    """
+    Summaries of the kept profiles, slowest first.
+    """
+    summaries = []
+    for path in glob.glob(os.path.join(settings.SEARCH_PROFILE_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Pruned or still being written
+    summaries.sort(key=lambda summary: summary["duration_ms"], reverse=True)
+    return summaries[:limit]
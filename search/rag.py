@@ -0,0 +1,248 @@
+"""
+Building blocks of the search-and-answer pipeline shared by the views.
+"""
+import re
+
+from .passages import pack_passages
+
+# Alias pointing at the live index generation (see search.indexing.rebuild)
+INDEX_NAME = "medicine"
+
+# Alias of the passage index built by `index_data --passages`
+PASSAGE_INDEX_NAME = f"{INDEX_NAME}_passages"
+
+# Field boosts for the original query and for the expansion terms. The
+# dump's summary field is `description`; responses call it `abstract`.
+QUERY_FIELDS = ["title^3", "description^2", "main_text"]
+EXPANSION_FIELDS = ["title^2", "description", "main_text"]
+
+# Stored fields fetched with each hit; everything build_documents reads,
+# plus the content hash that keys cached answers
+SOURCE_FIELDS = ["title", "url", "description", "main_text", "content_hash"]
+
+# Retrieval-only results endpoint: fields returned when none are requested,
+# page size limit, and how deep backends without search_after can page
+RESULT_FIELDS = ["title", "url", "description"]
+RESULTS_MAX_SIZE = 100
+RESULTS_MAX_WINDOW = 1000
+
+# Generation settings for query expansion
+EXPANSION_MAX_TOKENS = 100
+EXPANSION_TEMPERATURE = 0.3
+
+NO_DOCUMENTS_ANSWER = "No relevant documents found to answer your question."
+
+# Generation settings for the RAG answer
+ANSWER_MAX_TOKENS = 600
+ANSWER_TEMPERATURE = 0.2  # Lower temperature for more factual responses
+
+# Passage context (SEARCH_PASSAGES): passages kept per document and the
+# estimated prompt tokens they may fill together
+PASSAGES_PER_DOC = 3
+CONTEXT_TOKEN_BUDGET = 1200
+
+
+def build_expansion_prompt(query: str) -> str:
+    return f"""
+    You are a medical search assistant. Generate 3-5 relevant medical terms, synonyms, or related concepts for the query below.
+    Focus on medical terminology, alternative names, and closely related conditions.
+    Return ONLY the terms separated by commas, without numbering or extra text.
+
+    Query: "{query}"
+    """
+
+
+def parse_expansion(expanded_raw: str) -> list[str]:
+    """
+    Clean up the LLM response into a list of expansion terms.
+    """
+    cleaned = re.sub(r'\d+\.\s*', '', expanded_raw.strip())
+    cleaned = cleaned.replace('\n', ',')
+    expanded_terms = [term.strip() for term in cleaned.split(',') if term.strip()]
+
+    # Limit to 5 terms to avoid noise
+    return expanded_terms[:5]
+
+
+def build_search_body(query: str, expanded_terms: list[str], query_fields: list[str] = QUERY_FIELDS,
+                      expansion_fields: list[str] = EXPANSION_FIELDS, expansion_type: str = "cross_fields",
+                      highlight: bool = True) -> dict:
+    """
+    Original query as the main requirement, expanded terms as a boost.
+    The keyword arguments let `manage.py retrieval_sweep` try variants.
+    Only SOURCE_FIELDS are fetched, and highlights come from the offsets
+    stored in the postings instead of re-analyzing the text.
+    """
+    body = {
+        "query": {
+            "bool": {
+                "must": [
+                    {
+                        "multi_match": {
+                            "query": query,  # Original query as main requirement
+                            "fields": query_fields,
+                            "type": "best_fields"
+                        }
+                    }
+                ],
+                "should": [
+                    # Boost with expanded terms
+                    {
+                        "multi_match": {
+                            "query": " ".join(expanded_terms),
+                            "fields": expansion_fields,
+                            "type": expansion_type
+                        }
+                    }
+                ],
+                "minimum_should_match": 0
+            }
+        },
+        "_source": SOURCE_FIELDS
+    }
+    if highlight:
+        body["highlight"] = {
+            "type": "unified",
+            "fields": {
+                "title": {},
+                "description": {},
+                "main_text": {"fragment_size": 150}
+            }
+        }
+    return body
+
+
+def build_results_body(query: str, expanded_terms: list[str], size: int, tags: list[str] = (),
+                       fields: list[str] = RESULT_FIELDS, search_after: list | None = None) -> dict:
+    """
+    Retrieval-only page: the search body without highlighting, `topics_tags`
+    filters in filter context (not scored, cached by Elasticsearch) and a
+    `_score` then `id` sort so pages can continue with `search_after`.
+    """
+    body = build_search_body(query, expanded_terms, highlight=False)
+    if tags:
+        body["query"]["bool"]["filter"] = [{"term": {"topics_tags": tag}} for tag in tags]
+    body["_source"] = fields
+    body["size"] = size
+    body["sort"] = [{"_score": "desc"}, {"id": "asc"}]
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+
+def build_search_query(query: str, expanded_terms: list[str]) -> str:
+    """
+    Combine original query with expanded terms for display.
+    """
+    if expanded_terms:
+        return f"{query} {' '.join(expanded_terms)}"
+    return query
+
+
+def build_documents(hits: list[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> tuple[list[dict], list[str]]:
+    """
+    Prepare documents for both return and RAG context.
+
+    Hits that carry `passages` (SEARCH_PASSAGES) contribute their best
+    passages, packed into `token_budget`, instead of the start of main_text.
+    """
+    documents = []
+    context_parts = []
+
+    for i, hit in enumerate(hits, 1):
+        source = hit["_source"]
+
+        # Document info for return
+        doc_info = {
+            "rank": i,
+            "id": hit["_id"],
+            "score": hit["_score"],
+            "title": source["title"],
+            "abstract": source.get("description", "")[:300] + "..." if len(source.get("description", "")) > 300 else source.get("description", ""),
+            "url": source.get("url", ""),
+            "highlights": hit.get("highlight", {})
+        }
+        documents.append(doc_info)
+        if "passages" in hit:
+            doc_info["passages"] = hit["passages"]
+            continue  # Packed into the context below
+
+        # Context for RAG (include more text)
+        doc_context = f"""Document {i}:
+Title: {source["title"]}
+Abstract: {source.get("description", "")}
+Content: {source["main_text"][:800]}{"..." if len(source["main_text"]) > 800 else ""}
+"""
+        context_parts.append(doc_context)
+
+    if any("passages" in hit for hit in hits):
+        context_parts = pack_passages(hits, token_budget)
+
+    return documents, context_parts
+
+
+def build_rag_prompt(query: str, context_parts: list[str]) -> str:
+    full_context = "\n\n".join(context_parts)
+
+    return f"""You are a medical expert assistant. Based on the provided medical documents, answer the user's question comprehensively and accurately.
+
+Use the information from the documents below to provide a detailed, evidence-based answer. If the documents don't contain sufficient information to fully answer the question, clearly state what information is missing.
+
+Medical Documents:
+{full_context}
+
+Question: {query}
+
+Please provide a comprehensive answer based on the medical documents above:"""
+
+
+def answer_cache_parts(hits: list[dict], model: str) -> list[str]:
+    """
+    What an answer depends on besides the query: the model, the index
+    generation the hits came from and the ordered hits with their content
+    hashes. Hits carry the concrete index name (e.g. medicine_v3), so a
+    reindex changes the key; an incremental update writes into the same
+    index but changes the hash of every document it modifies.
+    """
+    generation = ",".join(sorted({hit["_index"] for hit in hits if "_index" in hit}))
+    return [model, generation, *[f"{hit['_id']}:{hit.get('_source', {}).get('content_hash', '')}" for hit in hits]]
+
+
+def answer_confidence(document_count: int) -> str:
+    return "high" if document_count >= 3 else "medium" if document_count >= 1 else "low"
+
+
+def build_response(query: str, expanded_terms: list[str], res: dict, documents: list[dict],
+                   k: int, llm_answer: str | None = None, cache: dict | None = None,
+                   degraded: dict | None = None, job: dict | None = None) -> dict:
+    """
+    Response body shared by the JSON and streaming endpoints. The streaming
+    endpoint sends it without the answer, which follows as separate events.
+    `degraded` lists the stages the latency budget skipped or cut short, and
+    `job` is the background job that will produce a deferred answer.
+    """
+    response = {
+        "query": {
+            "original": query,
+            "expanded_terms": expanded_terms,
+            "final_search_query": build_search_query(query, expanded_terms)
+        },
+        "search_results": {
+            "total_found": res["hits"]["total"]["value"],
+            "returned_count": len(documents),
+            "k_requested": k,
+            "documents": documents
+        },
+    }
+    if llm_answer is not None:
+        response["rag_answer"] = {
+            "answer": llm_answer,
+            "confidence": answer_confidence(len(documents))
+        }
+    if cache is not None:
+        response["cache"] = cache
+    if degraded:
+        response["degraded"] = degraded
+    if job is not None:
+        response["job"] = job
+    return response
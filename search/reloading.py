@@ -0,0 +1,77 @@
+"""
+Per-process caches of files and index directories that are rebuilt while
+workers keep running.
+
+An entry is keyed by its path and remembers the version it was loaded
+from: the resolved path plus the file's identity. Each lookup costs a few
+stat calls and reloads the data once the version changes, so a rebuilt
+dictionary or a newly published index is picked up without restarting the
+worker.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def file_version(path: str) -> tuple[str, int, int]:
+    """
+    Version of a data file that is replaced atomically when rebuilt: the
+    rename gives it a new inode even within the mtime's granularity.
+    """
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_ino, stat.st_mtime_ns
+
+
+def index_version(path: str) -> tuple[str, int]:
+    """
+    Version of an index directory: the build `path` currently resolves to
+    and the mtime of its meta.json, which is written last.
+    """
+    real_path = os.path.realpath(path)
+    return real_path, os.stat(os.path.join(real_path, "meta.json")).st_mtime_ns
+
+
+class ReloadingCache:
+    """
+    `loader(path)` results by path, reloaded when `version(path)` changes.
+    A missing path raises FileNotFoundError and is never cached.
+    """
+
+    def __init__(self, loader, version=file_version):
+        self.loader = loader
+        self.version = version
+        self._loaded = {}  # path -> (version, data)
+        self._missing = set()  # paths already reported missing
+        self._lock = threading.Lock()
+
+    def __call__(self, path: str):
+        version = self.version(path)
+        loaded = self._loaded.get(path)
+        if loaded is None or loaded[0] != version:
+            with self._lock:
+                loaded = self._loaded.get(path)
+                if loaded is None or loaded[0] != version:
+                    loaded = (version, self.loader(version[0]))
+                    self._loaded[path] = loaded
+                    self._missing.discard(path)
+        return loaded[1]
+
+    def get_optional(self, path: str, warning: str):
+        """
+        Like calling the cache, but None while `path` is missing. `warning`
+        is logged once until the path appears.
+        """
+        try:
+            return self(path)
+        except FileNotFoundError:
+            if path not in self._missing:
+                self._missing.add(path)
+                logger.warning(warning)
+            return None
+
+    def cache_clear(self):
+        with self._lock:
+            self._loaded.clear()
+            self._missing.clear()
@@ -0,0 +1,203 @@
+"""
+Request coalescing ("single flight") for expensive upstream calls.
+
+When many requests ask for the same thing at once, only one of them (the
+leader) runs the call; the others wait and share its result.
+
+- Within a worker, followers wait on the leader's in-memory call.
+- Across workers, the leader holds a lock file under SEARCH_COALESCE_DIR and
+  publishes its result to a short-lived slot in the shared 'coalesce' cache.
+  Followers in other workers poll that slot until the result appears, the
+  lock is released without a result (the leader failed), or
+  SEARCH_COALESCE_TIMEOUT (or the request's latency budget, whichever is
+  shorter) passes. In the last two cases they run the call
+  themselves. A lock is only broken as stale once it is older than the
+  longest latency budget a request can have, so a live leader keeps it.
+- Followers in the same worker wait for the leader just as long.
+
+Async calls are coalesced per event loop: under WSGI every async view runs
+in a loop of its own, and a task can't be awaited from another loop.
+
+Only results other than None are published to other workers, so a call
+can return None to signal a failure that should not be shared. A leader's
+exception is re-raised in the followers of the same worker.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .deadline import time_left
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of another worker's lock and result slot
+POLL_INTERVAL = 0.05
+
+# A lock is stale this long after the longest latency budget has run out
+STALE_LOCK_MARGIN = 10.0
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, namespace: str, alias: str = "coalesce"):
+        self.namespace = namespace
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = weakref.WeakKeyDictionary()  # event loop -> {key: task}
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, *parts) -> str:
+        raw = "\x1f".join(str(part) for part in parts)
+        return f"{self.namespace}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def do(self, key: str, fn):
+        """
+        Run fn() unless an identical call is already in flight, in which case
+        wait for it and return its result.
+        """
+        if not settings.SEARCH_COALESCE:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout=time_left(cap=settings.SEARCH_COALESCE_TIMEOUT)):
+                # The leader is too slow for this request's deadline
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn):
+        """
+        Async counterpart of do(); fn is a coroutine function.
+        """
+        if not settings.SEARCH_COALESCE:
+            return await fn()
+
+        futures = self._futures.setdefault(asyncio.get_running_loop(), {})
+        task = futures.get(key)
+        if task is None:
+            # A separate task, so the leader's request being cancelled
+            # doesn't cancel the call its followers are waiting on
+            task = futures[key] = asyncio.ensure_future(self._arun_shared(key, fn))
+            task.add_done_callback(lambda _: futures.pop(key, None))
+            return await asyncio.shield(task)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task),
+                                          timeout=time_left(cap=settings.SEARCH_COALESCE_TIMEOUT))
+        except asyncio.TimeoutError:
+            # The leader is too slow for this request's deadline
+            return await fn()
+
+    def _run_shared(self, key: str, fn):
+        wait_until = time.monotonic() + time_left(cap=settings.SEARCH_COALESCE_TIMEOUT)
+        while not self._acquire(key):
+            result = self.backend.get(key)
+            if result is not None:
+                return result
+            if not os.path.exists(self._lock_path(key)) or time.monotonic() > wait_until:
+                break
+            time.sleep(POLL_INTERVAL)
+        else:
+            try:
+                result = fn()
+                if result is not None:
+                    self.backend.set(key, result, settings.SEARCH_COALESCE_RESULT_TTL)
+                return result
+            finally:
+                self._release(key)
+
+        # The other worker failed or is too slow; don't wait any longer
+        result = self.backend.get(key)
+        return fn() if result is None else result
+
+    async def _arun_shared(self, key: str, fn):
+        wait_until = time.monotonic() + time_left(cap=settings.SEARCH_COALESCE_TIMEOUT)
+        while not self._acquire(key):
+            result = await sync_to_async(self.backend.get)(key)
+            if result is not None:
+                return result
+            if not os.path.exists(self._lock_path(key)) or time.monotonic() > wait_until:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        else:
+            try:
+                result = await fn()
+                if result is not None:
+                    await sync_to_async(self.backend.set)(key, result, settings.SEARCH_COALESCE_RESULT_TTL)
+                return result
+            finally:
+                self._release(key)
+
+        result = await sync_to_async(self.backend.get)(key)
+        return await fn() if result is None else result
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(settings.SEARCH_COALESCE_DIR, key.replace(":", "-") + ".lock")
+
+    def _acquire(self, key: str) -> bool:
+        """
+        Take the cross-worker lock for key. A lock older than any request
+        may run belongs to a crashed worker and is broken.
+        """
+        path = self._lock_path(key)
+        os.makedirs(settings.SEARCH_COALESCE_DIR, exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+
+        try:
+            stale = time.time() - os.path.getmtime(path) > settings.SEARCH_LATENCY_BUDGET_MAX + STALE_LOCK_MARGIN
+        except FileNotFoundError:
+            stale = False
+        if stale:
+            logger.warning(f"Breaking stale coalescing lock {path}")
+            self._release(key)
+        return False
+
+    def _release(self, key: str):
+        try:
+            os.remove(self._lock_path(key))
+        except FileNotFoundError:
+            pass
+
+
+search_flight = SingleFlight("search")
+expansion_flight = SingleFlight("expansion")
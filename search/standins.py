@@ -0,0 +1,585 @@
+"""
+Local stand-ins for Elasticsearch and the Hugging Face inference client,
+used by `manage.py benchmark` to measure the pipeline without network
+access.
+
+`StandInElasticsearch` is a small in-memory HTTP server that speaks enough
+of the Elasticsearch REST API for the indexer and the search views: index
+and alias management, `_bulk`, `_search` (with scroll, `collapse`,
+`cardinality` aggregations and `completion` suggestions), `_msearch`,
+`_mget` and `_count`. Queries are
+scored with a simple TF-IDF over `bool`, `multi_match`, `match`, `term(s)`
+and `ids` clauses; the ranking is not Elasticsearch's, the request and
+response shapes are.
+
+`StandInLLM` mimics `InferenceClient.chat.completions.create`, sync and
+async, streaming or not. Both inject configurable latency.
+"""
+import asyncio
+import fnmatch
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+from .analysis import tokenize
+
+# Fields scored when a clause lists none
+DEFAULT_FIELDS = ["title", "main_text"]
+
+
+def _latency(base: float, jitter: float) -> float:
+    return max(0.0, base + random.uniform(-jitter, jitter)) if jitter else base
+
+
+class _Index:
+    def __init__(self, body: dict | None = None):
+        body = body or {}
+        self.settings = body.get("settings", {})
+        self.mappings = body.get("mappings", {})
+        self.docs = {}
+        self.terms = {}  # doc ID -> {field: Counter of tokens}
+        self.postings = defaultdict(set)  # token -> doc IDs
+
+    def put(self, doc_id: str, source: dict):
+        self.delete(doc_id)
+        self.docs[doc_id] = source
+        terms = {field: Counter(tokenize(str(value))) for field, value in source.items()
+                 if isinstance(value, str)}
+        self.terms[doc_id] = terms
+        for token in {token for counter in terms.values() for token in counter}:
+            self.postings[token].add(doc_id)
+
+    def delete(self, doc_id: str) -> bool:
+        if doc_id not in self.docs:
+            return False
+        del self.docs[doc_id]
+        for token in {token for counter in self.terms.pop(doc_id).values() for token in counter}:
+            self.postings[token].discard(doc_id)
+        return True
+
+
+class _Store:
+    """
+    Indices and aliases of the stand-in, guarded by one lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.indices = {}
+        self.aliases = {}  # index -> set of aliases
+
+    def resolve(self, target: str) -> list[str]:
+        names = []
+        for name in target.split(","):
+            if name in ("_all", "*"):
+                names.extend(self.indices)
+            elif "*" in name:
+                names.extend(index for index in self.indices if fnmatch.fnmatch(index, name))
+            elif name in self.indices:
+                names.append(name)
+            else:
+                names.extend(index for index, aliases in self.aliases.items() if name in aliases)
+        return list(dict.fromkeys(names))
+
+    # Query evaluation: each clause returns {(index, doc ID): score}
+
+    def evaluate(self, index_names: list[str], query: dict) -> dict:
+        if not query or "match_all" in query:
+            return {(name, doc_id): 1.0 for name in index_names for doc_id in self.indices[name].docs}
+
+        kind, clause = next(iter(query.items()))
+        if kind == "bool":
+            return self._bool(index_names, clause)
+        if kind in ("multi_match", "match"):
+            if kind == "match":
+                field, clause = next(iter(clause.items()))
+                clause = clause if isinstance(clause, dict) else {"query": clause}
+                clause = dict(clause, fields=[field])
+            return self._text(index_names, clause.get("query", ""), clause.get("fields") or DEFAULT_FIELDS)
+        if kind in ("term", "terms"):
+            field, values = next(iter(clause.items()))
+            values = values if isinstance(values, list) else [values.get("value") if isinstance(values, dict) else values]
+            return self._terms(index_names, field, values)
+        if kind == "ids":
+            wanted = set(clause.get("values", []))
+            return {(name, doc_id): 1.0 for name in index_names for doc_id in self.indices[name].docs
+                    if doc_id in wanted}
+        raise ValueError(f"Unsupported query clause: {kind}")
+
+    def _bool(self, index_names, clause):
+        def as_list(value):
+            return value if isinstance(value, list) else [value]
+
+        scores = None
+        for sub in as_list(clause.get("must", [])):
+            matched = self.evaluate(index_names, sub)
+            scores = matched if scores is None else {
+                key: scores[key] + score for key, score in matched.items() if key in scores}
+        for sub in as_list(clause.get("filter", [])):
+            matched = self.evaluate(index_names, sub)
+            if scores is None:
+                scores = {key: 0.0 for key in matched}
+            else:
+                scores = {key: score for key, score in scores.items() if key in matched}
+
+        should = [self.evaluate(index_names, sub) for sub in as_list(clause.get("should", []))]
+        if scores is None:
+            # Without must or filter at least one should clause has to match
+            scores = {}
+            for matched in should:
+                for key, score in matched.items():
+                    scores[key] = scores.get(key, 0.0) + score
+        else:
+            for matched in should:
+                for key, score in matched.items():
+                    if key in scores:
+                        scores[key] += score
+
+        for sub in as_list(clause.get("must_not", [])):
+            excluded = self.evaluate(index_names, sub)
+            scores = {key: score for key, score in scores.items() if key not in excluded}
+        return scores
+
+    def _text(self, index_names, text, fields):
+        tokens = set(tokenize(text))
+        boosts = {}
+        for spec in fields:
+            name, _, boost = spec.partition("^")
+            boosts[name] = float(boost) if boost else 1.0
+
+        scores = {}
+        for name in index_names:
+            index = self.indices[name]
+            postings = {token: index.postings.get(token, ()) for token in tokens}
+            idf = {token: math.log(1 + len(index.docs) / (1 + len(docs))) for token, docs in postings.items()}
+            for doc_id in set().union(*postings.values()):
+                terms = index.terms[doc_id]
+                score = 0.0
+                for field, boost in boosts.items():
+                    counter = terms.get(field)
+                    if counter:
+                        score += boost * sum(math.sqrt(counter[token]) * idf[token] for token in tokens if token in counter)
+                if score:
+                    scores[name, doc_id] = score
+        return scores
+
+    def _terms(self, index_names, field, values):
+        wanted = set(map(str, values))
+        matched = {}
+        for name in index_names:
+            for doc_id, source in self.indices[name].docs.items():
+                value = source.get(field)
+                present = set(map(str, value)) if isinstance(value, list) else {str(value)}
+                if present & wanted:
+                    matched[name, doc_id] = 1.0
+        return matched
+
+    def search(self, index_names: list[str], body: dict, size: int | None = None) -> dict:
+        started = time.perf_counter()
+        scores = self.evaluate(index_names, body.get("query", {}))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0][1]))
+        size = body.get("size", 10) if size is None else size
+        total = len(ranked)
+        aggregations = {}
+        for agg_name, agg in body.get("aggs", {}).items():
+            if "cardinality" in agg:
+                field = agg["cardinality"]["field"]
+                values = {self.indices[name].docs[doc_id].get(field) for (name, doc_id), _ in ranked}
+                aggregations[agg_name] = {"value": len(values - {None})}
+
+        groups = {}
+        collapse = body.get("collapse")
+        if collapse:
+            # Keep the best hit per field value; the rest become its inner hits
+            for key, score in ranked:
+                value = self.indices[key[0]].docs[key[1]].get(collapse["field"])
+                groups.setdefault(value, []).append((key, score))
+            ranked = [members[0] for members in groups.values()]
+
+        # Any `sort` is treated as score then ID, the order hits already have
+        if "search_after" in body:
+            after_score, after_id = body["search_after"]
+            ranked = [(key, score) for key, score in ranked if (-score, key[1]) > (-after_score, after_id)]
+
+        hits = []
+        for (name, doc_id), score in ranked[body.get("from", 0):][:size]:
+            hit = self._hit(name, doc_id, score, body.get("_source", True))
+            if "sort" in body:
+                hit["sort"] = [score, doc_id]
+            if collapse and "inner_hits" in collapse:
+                inner = collapse["inner_hits"]
+                members = groups[self.indices[name].docs[doc_id].get(collapse["field"])]
+                inner_hits = [self._hit(*key, member_score, inner.get("_source", True))
+                              for key, member_score in members[:inner.get("size", 3)]]
+                hit["inner_hits"] = {inner["name"]: {"hits": {
+                    "total": {"value": len(members), "relation": "eq"}, "hits": inner_hits}}}
+            hits.append(hit)
+
+        res = {
+            "took": max(1, round((time.perf_counter() - started) * 1000)),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            },
+        }
+        if aggregations:
+            res["aggregations"] = aggregations
+        if "suggest" in body:
+            res["suggest"] = {name: [self.complete(index_names, spec)] for name, spec in body["suggest"].items()}
+        return res
+
+    def complete(self, index_names: list[str], spec: dict) -> dict:
+        """
+        `completion` suggester: inputs of the field that start with the
+        prefix, case-insensitively, best weight first. Inputs are strings
+        (weight 1) or {"input", "weight"} objects.
+        """
+        prefix, completion = spec["prefix"], spec["completion"]
+        options = []
+        for name in index_names:
+            for doc_id, source in sorted(self.indices[name].docs.items()):
+                inputs = source.get(completion["field"], [])
+                for entry in [inputs] if isinstance(inputs, (str, dict)) else inputs:
+                    if isinstance(entry, dict):
+                        text, weight = entry["input"], entry.get("weight", 1)
+                    else:
+                        text, weight = entry, 1
+                    if text.lower().startswith(prefix.lower()):
+                        options.append({"text": text, "_index": name, "_id": doc_id, "_score": float(weight)})
+        options.sort(key=lambda option: (-option["_score"], option["text"].lower()))
+        if completion.get("skip_duplicates"):
+            seen = set()
+            options = [option for option in options
+                       if option["text"].lower() not in seen and not seen.add(option["text"].lower())]
+        return {"text": prefix, "offset": 0, "length": len(prefix),
+                "options": options[:completion.get("size", 5)]}
+
+    def _hit(self, name: str, doc_id: str, score: float, source_filter) -> dict:
+        hit = {"_index": name, "_id": doc_id, "_score": score}
+        source = self.indices[name].docs[doc_id]
+        if isinstance(source_filter, list):
+            hit["_source"] = {key: value for key, value in source.items() if key in source_filter}
+        elif source_filter is not False:
+            hit["_source"] = source
+        return hit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StandInElasticsearch"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        time.sleep(_latency(self.server.latency, self.server.jitter))
+
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        store = self.server.store
+        try:
+            with store.lock:
+                status, body = self._route(store, method, parts, raw, parse_qs(url.query))
+        except Exception as e:
+            status, body = 400, {"error": {"type": "stand_in_exception", "reason": str(e)}, "status": 400}
+        self._send(status, body, head=method == "HEAD")
+
+    def _send(self, status: int, body, head: bool = False):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def _route(self, store, method, parts, raw, params):
+        if not parts:
+            return 200, {"name": "stand-in", "cluster_name": "stand-in",
+                         "version": {"number": "9.0.0"}, "tagline": "You Know, for Search"}
+
+        endpoint = parts[-1] if parts[-1].startswith("_") else None
+        target = parts[0] if not parts[0].startswith("_") else None
+
+        if endpoint == "_bulk":
+            return 200, self._bulk(store, target, raw)
+        if parts[0] == "_aliases":
+            return 200, self._update_aliases(store, json.loads(raw))
+        if endpoint == "_msearch":
+            lines = [json.loads(line) for line in raw.decode("utf-8").splitlines() if line.strip()]
+            responses = []
+            for header, body in zip(lines[::2], lines[1::2]):
+                names = store.resolve(header.get("index", target or ""))
+                responses.append(dict(store.search(names, body), status=200))
+            return 200, {"took": sum(res["took"] for res in responses), "responses": responses}
+        if parts[:2] == ["_search", "scroll"]:
+            if method == "DELETE":
+                for scroll_id in json.loads(raw or b"{}").get("scroll_id", []):
+                    self.server.scrolls.pop(scroll_id, None)
+                return 200, {"succeeded": True, "num_freed": 1}
+            return 200, self._scroll(store, json.loads(raw or b"{}").get("scroll_id", ""))
+        if endpoint == "_mget":
+            return 200, self._mget(store, target, json.loads(raw))
+        if parts[0] == "_alias" or endpoint in ("_alias", "_aliases"):
+            name = parts[-1] if parts[0] == "_alias" else None
+            names = store.resolve(target) if target else list(store.indices)
+            found = {index: {"aliases": {alias: {} for alias in store.aliases.get(index, ())
+                                         if name is None or alias == name}}
+                     for index in names}
+            found = {index: value for index, value in found.items() if value["aliases"] or name is None}
+            return (200 if found else 404), found
+
+        names = store.resolve(target)
+        if endpoint is None:
+            return self._index(store, method, target, names, raw)
+        if endpoint == "_search":
+            body = json.loads(raw) if raw else {}
+            size = int(params["size"][0]) if "size" in params else None
+            if "scroll" in params:
+                return 200, self._start_scroll(store, names, body, size)
+            return 200, store.search(names, body, size)
+        if endpoint == "_count":
+            body = json.loads(raw) if raw else {}
+            return 200, {"count": len(store.evaluate(names, body.get("query", {})))}
+        if endpoint == "_refresh":
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if endpoint == "_settings":
+            if method == "PUT":
+                body = json.loads(raw)
+                for name in names:
+                    store.indices[name].settings.setdefault("index", {}).update(body.get("index", body))
+                return 200, {"acknowledged": True}
+            return 200, {name: {"settings": store.indices[name].settings} for name in names}
+        if endpoint == "_doc" or (len(parts) == 3 and parts[1] == "_doc"):
+            doc_id = parts[2]
+            source = store.indices[names[0]].docs.get(doc_id) if names else None
+            return (200 if source else 404), {"_index": target, "_id": doc_id, "found": source is not None,
+                                               **({"_source": source} if source else {})}
+        return 404, {"error": {"type": "unsupported", "reason": f"{method} /{'/'.join(parts)}"}, "status": 404}
+
+    def _index(self, store, method, target, names, raw):
+        if method == "HEAD":
+            return (200 if names else 404), None
+        if method == "PUT":
+            body = json.loads(raw) if raw else {}
+            store.indices[target] = _Index(body)
+            for alias in body.get("aliases") or {}:
+                store.aliases.setdefault(target, set()).add(alias)
+            return 200, {"acknowledged": True, "shards_acknowledged": True, "index": target}
+        if method == "DELETE":
+            for name in names:
+                store.indices.pop(name, None)
+                store.aliases.pop(name, None)
+            return (200 if names else 404), {"acknowledged": True}
+        return 200, {name: {"settings": store.indices[name].settings, "mappings": store.indices[name].mappings,
+                            "aliases": {alias: {} for alias in store.aliases.get(name, ())}}
+                     for name in names}
+
+    def _bulk(self, store, target, raw):
+        lines = [json.loads(line) for line in raw.decode("utf-8").splitlines() if line.strip()]
+        items, errors, position = [], False, 0
+        while position < len(lines):
+            op, meta = next(iter(lines[position].items()))
+            position += 1
+            source = None
+            if op != "delete":
+                source = lines[position]
+                position += 1
+
+            name = meta.get("_index") or target
+            name = (store.resolve(name) or [name])[0]
+            doc_id = meta.get("_id") or f"{len(items)}-{time.time_ns()}"
+            if random.random() < self.server.reject_rate:
+                errors = True
+                items.append({op: {"_index": name, "_id": doc_id, "status": 429,
+                                   "error": {"type": "es_rejected_execution_exception"}}})
+                continue
+
+            index = store.indices.setdefault(name, _Index())
+            if op in ("index", "create"):
+                status = 200 if doc_id in index.docs else 201
+                index.put(doc_id, source)
+            elif op == "update":
+                if doc_id in index.docs:
+                    index.put(doc_id, {**index.docs[doc_id], **source.get("doc", {})})
+                    status = 200
+                elif source.get("doc_as_upsert"):
+                    index.put(doc_id, source["doc"])
+                    status = 201
+                else:
+                    status, errors = 404, True
+            else:
+                status = 200 if index.delete(doc_id) else 404
+            items.append({op: {"_index": name, "_id": doc_id, "status": status}})
+        return {"took": 1, "errors": errors, "items": items}
+
+    def _update_aliases(self, store, body):
+        for action in body["actions"]:
+            op, args = next(iter(action.items()))
+            if op == "add":
+                store.aliases.setdefault(args["index"], set()).add(args["alias"])
+            elif op == "remove":
+                store.aliases.get(args["index"], set()).discard(args["alias"])
+            elif op == "remove_index":
+                store.indices.pop(args["index"], None)
+                store.aliases.pop(args["index"], None)
+        return {"acknowledged": True}
+
+    def _mget(self, store, target, body):
+        docs = []
+        for spec in body.get("docs") or [{"_id": doc_id} for doc_id in body.get("ids", [])]:
+            names = store.resolve(spec.get("_index") or target)
+            source = store.indices[names[0]].docs.get(spec["_id"]) if names else None
+            doc = {"_index": names[0] if names else target, "_id": spec["_id"], "found": source is not None}
+            if source is not None:
+                doc["_source"] = source
+            docs.append(doc)
+        return {"docs": docs}
+
+    def _start_scroll(self, store, names, body, size):
+        # The whole result is computed up front and paged out of memory
+        hits = store.search(names, dict(body, size=10 ** 9))["hits"]["hits"]
+        scroll_id = f"scroll-{time.time_ns()}"
+        self.server.scrolls[scroll_id] = [hits, size or body.get("size", 10), 0]
+        return self._scroll(store, scroll_id)
+
+    def _scroll(self, store, scroll_id):
+        hits, size, offset = self.server.scrolls.get(scroll_id, [[], 10, 0])
+        if scroll_id in self.server.scrolls:
+            self.server.scrolls[scroll_id][2] = offset + size
+        return {
+            "_scroll_id": scroll_id,
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": None,
+                     "hits": hits[offset:offset + size]},
+        }
+
+
+class StandInElasticsearch(ThreadingHTTPServer):
+    """
+    In-memory Elasticsearch stand-in listening on 127.0.0.1. Every request
+    waits `latency` ± `jitter` seconds; `reject_rate` is the fraction of bulk
+    items answered with 429.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, reject_rate: float = 0.0, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.reject_rate = reject_rate
+        self.store = _Store()
+        self.scrolls = {}  # scroll ID -> [hits, page size, offset]
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInLLM:
+    """
+    Stand-in for `InferenceClient` / `AsyncInferenceClient`. A call takes
+    `latency` ± `jitter` seconds plus `token_latency` per generated token.
+    Expansion prompts get a comma-separated list of terms, other prompts an
+    answer of `answer_tokens` words taken from the prompt. Set `is_async`
+    for the async client's interface.
+    """
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0, jitter: float = 0.0,
+                 answer_tokens: int = 150, is_async: bool = False):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.answer_tokens = answer_tokens
+        self.is_async = is_async
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._acreate if is_async else self._create))
+
+    def _completion(self, messages: list[dict], max_tokens: int | None) -> tuple[str, list[str], int]:
+        self.calls += 1
+        prompt = messages[-1]["content"]
+        words = tokenize(prompt)
+        if "Return ONLY the terms separated by commas" in prompt:
+            query = prompt.rsplit("Query:", 1)[-1]
+            terms = [f"{term} disorder" for term in tokenize(query)[:5]] or ["medicine"]
+            return ", ".join(terms), [", ".join(terms)], len(words)
+
+        count = min(self.answer_tokens, max_tokens or self.answer_tokens)
+        tokens = [(words[i % len(words)] if words else "answer") + " " for i in range(count)]
+        return "".join(tokens).strip(), tokens, len(words)
+
+    def _response(self, text: str, tokens: list[str], prompt_tokens: int):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=text), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(tokens),
+                                  total_tokens=prompt_tokens + len(tokens)),
+        )
+
+    @staticmethod
+    def _chunk(token: str):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def _create(self, model=None, messages=(), max_tokens=None, temperature=None, stream=False, **kwargs):
+        text, tokens, prompt_tokens = self._completion(messages, max_tokens)
+        time.sleep(_latency(self.latency, self.jitter))
+        if stream:
+            return self._stream(tokens)
+        time.sleep(self.token_latency * len(tokens))
+        return self._response(text, tokens, prompt_tokens)
+
+    def _stream(self, tokens):
+        for token in tokens:
+            time.sleep(self.token_latency)
+            yield self._chunk(token)
+
+    async def _acreate(self, model=None, messages=(), max_tokens=None, temperature=None, stream=False, **kwargs):
+        text, tokens, prompt_tokens = self._completion(messages, max_tokens)
+        await asyncio.sleep(_latency(self.latency, self.jitter))
+        if stream:
+            return self._astream(tokens)
+        await asyncio.sleep(self.token_latency * len(tokens))
+        return self._response(text, tokens, prompt_tokens)
+
+    async def _astream(self, tokens):
+        for token in tokens:
+            await asyncio.sleep(self.token_latency)
+            yield self._chunk(token)
@@ -0,0 +1,307 @@
+"""
+Typeahead suggestions for `/search/suggest/`.
+
+`build_suggestions` collects the titles and topics_tags of nfdump.txt into a
+JSON file, each weighted by how many documents carry it. `PrefixIndex` loads
+it into each process (again whenever it is rebuilt) as a sorted array and
+answers a prefix with a binary search, so a keystroke costs no upstream
+call. Every word of a suggestion can start a match ('diab' finds 'type 2
+diabetes'); matches at the start of the suggestion rank higher.
+
+Queries that found documents are counted in the PopularQuery table; those
+searched at least SUGGEST_MIN_QUERY_COUNT times are suggested too, which
+steers users towards queries that are already cached. Searches only count
+in memory; a background timer adds the counts to the table at most every
+SUGGEST_FLUSH_INTERVAL seconds, so a search never waits for a write.
+
+With SEARCH_SUGGEST_BACKEND = 'elasticsearch' the candidates come from the
+`suggest` completion field of the index instead, whose inputs `index_data`
+weights by the same popular query counts.
+"""
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.db.models import F
+
+from .cache import normalize_query
+from .clients import get_es
+from .metrics import upstream_call
+from .models import PopularQuery
+from .rag import INDEX_NAME
+from .reloading import ReloadingCache
+
+logger = logging.getLogger(__name__)
+
+# Score multiplier for suggestions that start with the prefix
+PREFIX_START_BOOST = 2.0
+
+# Longest query recorded as a popular query
+MAX_QUERY_LENGTH = 200
+
+# Elasticsearch's limit for completion weights
+MAX_COMPLETION_WEIGHT = 2 ** 31 - 1
+
+# Searches counted since the last flush, by normalized query
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flush_timer = None
+
+
+def build_suggestions(docs) -> dict[str, dict]:
+    """
+    Suggestion entries from parsed documents, keyed by normalized text:
+    {key: {"text", "kind": "title" | "tag", "weight"}}, the weight being the
+    number of documents with that title or tag.
+    """
+    counts = Counter()
+    texts = {}
+    kinds = {}
+    num_docs = 0
+
+    for doc in docs:
+        num_docs += 1
+        candidates = [(doc.get("title", ""), "title")] + [(tag, "tag") for tag in doc.get("topics_tags", [])]
+        for text, kind in candidates:
+            key = normalize_query(text)
+            if not key:
+                continue
+            counts[key] += 1
+            texts.setdefault(key, " ".join(text.split()))
+            # A tag that is also a title is suggested as a tag
+            if kinds.get(key) != "tag":
+                kinds[key] = kind
+
+    suggestions = {key: {"text": texts[key], "kind": kinds[key], "weight": count}
+                   for key, count in counts.items()}
+    logger.info(f"Built {len(suggestions)} suggestions from {num_docs} documents")
+    return suggestions
+
+
+def write_suggestions(suggestions: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Replace the file in one rename so running workers never read half of it
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "suggestions": suggestions}, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+class PrefixIndex:
+    """
+    Sorted array of (match key, entry) pairs; every word-start suffix of an
+    entry's normalized text is a key.
+    """
+
+    def __init__(self, entries: list[tuple[str, str, str, float]]):
+        # entries: (normalized text, text, kind, weight)
+        self.entries = entries
+        pairs = []
+        for i, (key, _, _, _) in enumerate(entries):
+            words = key.split()
+            for start in range(len(words)):
+                pairs.append((" ".join(words[start:]), i))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.ids = [i for _, i in pairs]
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            suggestions = json.load(f)["suggestions"]
+        return cls([(key, entry["text"], entry["kind"], entry["weight"]) for key, entry in suggestions.items()])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def complete(self, prefix: str, limit: int) -> list[dict]:
+        """
+        The `limit` best entries with a word starting with `prefix`, which
+        must be normalized.
+        """
+        if not prefix:
+            return []
+        scores = {}
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            entry_id = self.ids[i]
+            key, _, _, weight = self.entries[entry_id]
+            score = weight * PREFIX_START_BOOST if key.startswith(prefix) else weight
+            scores[entry_id] = max(score, scores.get(entry_id, 0))
+            i += 1
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -len(self.entries[item[0]][0])))
+        return [{"text": self.entries[entry_id][1], "kind": self.entries[entry_id][2], "score": round(score, 4)}
+                for entry_id, score in best]
+
+
+_suggesters = ReloadingCache(PrefixIndex.from_file)
+
+
+def load_suggester(path: str) -> PrefixIndex | None:
+    """
+    The suggestions at `path`, reloaded when the file is rebuilt. None while
+    the file is missing; that isn't cached, so suggestions built after
+    startup are picked up.
+    """
+    return _suggesters.get_optional(path, f"Suggestions not found at {path}; run manage.py build_suggestions")
+
+
+def record_query(query: str):
+    """
+    Count a search that found documents. The count is written by the next
+    flush_queries.
+    """
+    global _flush_timer
+    if not settings.SUGGEST_RECORD_QUERIES:
+        return
+    text = normalize_query(query)
+    if not text or len(text) > MAX_QUERY_LENGTH:
+        return
+    with _pending_lock:
+        _pending[text] += 1
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(settings.SUGGEST_FLUSH_INTERVAL, flush_queries)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def _add_count(text: str, count: int):
+    try:
+        if not PopularQuery.objects.filter(text=text).update(count=F("count") + count):
+            PopularQuery.objects.create(text=text, count=count)
+    except IntegrityError:
+        # Created by another process since the update
+        PopularQuery.objects.filter(text=text).update(count=F("count") + count)
+
+
+def flush_queries():
+    """
+    Add the searches counted in this process to the PopularQuery table.
+    """
+    global _flush_timer
+    with _pending_lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()  # No-op when called by the timer itself
+            _flush_timer = None
+        pending = dict(_pending)
+        _pending.clear()
+    for text, count in pending.items():
+        try:
+            _add_count(text, count)
+        except Exception as e:
+            logger.warning(f"Could not record query '{text}': {e}")
+    if threading.current_thread() is not threading.main_thread():
+        # No request closes the timer thread's connection
+        connection.close()
+
+
+def _after_fork():
+    # The parent flushes its own counts, and its timer isn't running here
+    global _flush_timer, _pending_lock
+    _pending_lock = threading.Lock()
+    _pending.clear()
+    _flush_timer = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush_queries)
+
+
+class PopularQueries:
+    """
+    Prefix index over the popular queries, reloaded from the database at
+    most every SUGGEST_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.index = PrefixIndex([])
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def get(self) -> PrefixIndex:
+        now = time.monotonic()
+        if self.loaded_at is not None and now - self.loaded_at < settings.SUGGEST_REFRESH_INTERVAL:
+            return self.index
+        # One request reloads; the others keep using the current index
+        if self.lock.acquire(blocking=False):
+            try:
+                self.index = self.load()
+            except Exception as e:
+                logger.warning(f"Could not load popular queries: {e}")
+            finally:
+                self.loaded_at = now
+                self.lock.release()
+        return self.index
+
+    @staticmethod
+    def load() -> PrefixIndex:
+        rows = (PopularQuery.objects.filter(count__gte=settings.SUGGEST_MIN_QUERY_COUNT)
+                .order_by("-count").values_list("text", "count")[:settings.SUGGEST_MAX_POPULAR])
+        return PrefixIndex([(text, text, "query", count * settings.SUGGEST_POPULAR_WEIGHT) for text, count in rows])
+
+
+popular_queries = PopularQueries()
+
+
+def completion_weight():
+    """
+    Index-time weight function for completion inputs (see
+    indexing.completion_inputs): 1, plus SUGGEST_POPULAR_WEIGHT per search of
+    the same text, for texts searched at least SUGGEST_MIN_QUERY_COUNT times.
+    """
+    counts = dict(PopularQuery.objects.filter(count__gte=settings.SUGGEST_MIN_QUERY_COUNT)
+                  .values_list("text", "count"))
+
+    def weight(text: str) -> int:
+        popularity = counts.get(normalize_query(text), 0) * settings.SUGGEST_POPULAR_WEIGHT
+        return min(1 + round(popularity), MAX_COMPLETION_WEIGHT)
+
+    return weight
+
+
+def completion_suggestions(prefix: str, limit: int) -> list[dict]:
+    """
+    Suggestions from the index's `suggest` completion field, best weight
+    first. Inputs weigh more the more they were searched as of the last
+    `index_data` run.
+    """
+    body = {
+        "_source": False,
+        "suggest": {"typeahead": {"prefix": prefix,
+                                  "completion": {"field": "suggest", "size": limit, "skip_duplicates": True}}},
+    }
+    with upstream_call("elasticsearch"):
+        res = get_es().options(request_timeout=settings.SUGGEST_ES_TIMEOUT).search(index=INDEX_NAME, body=body)
+    options = res["suggest"]["typeahead"][0]["options"]
+    return [{"text": option["text"], "kind": "completion", "score": option["_score"]} for option in options]
+
+
+def corpus_suggestions(prefix: str, limit: int) -> list[dict]:
+    if settings.SEARCH_SUGGEST_BACKEND == "elasticsearch":
+        return completion_suggestions(prefix, limit)
+    suggester = load_suggester(settings.SUGGESTIONS_FILE)
+    return suggester.complete(prefix, limit) if suggester is not None else []
+
+
+def suggest(prefix: str, limit: int) -> list[dict]:
+    """
+    Up to `limit` suggestions for what has been typed so far: corpus titles
+    and tags merged with popular queries, best first.
+    """
+    prefix = normalize_query(prefix)
+    if not prefix:
+        return []
+    merged = {}
+    for suggestion in popular_queries.get().complete(prefix, limit) + corpus_suggestions(prefix, limit):
+        key = normalize_query(suggestion["text"])
+        if key not in merged or suggestion["score"] > merged[key]["score"]:
+            merged[key] = suggestion
+    return sorted(merged.values(), key=lambda suggestion: -suggestion["score"])[:limit]
@@ -1,3 +1,1064 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from huggingface_hub import get_session
+
+from . import clients, deadline, encoding
+from .backends import LocalBackend, get_backend, hybrid_search
+from .cache import QueryCache, canonical_query, expansion_cache, normalize_query
+from .checks import check_hybrid_encoder
+from .deadline import ahedged, deadline_scope, hedged
+from .dense import HashingEncoder, build_dense_index, get_encoder, load_dense_index, reciprocal_rank_fusion
+from .encoding import FastJsonResponse
+from .evaluation import DEFAULT_VARIANTS, ndcg_at_k, recall_at_k, resolve_variants
+from .expansion import LocalExpander, build_expansions, load_expander, write_expansions
+from .indexing import (FIELD_NAMES, INDEX_SETTINGS, content_hash, iter_actions, iter_documents,
+                       list_generations, live_index, parallel_streaming_bulk, rebuild, update_incrementally)
+from .jobs import QueueFull, claim, enqueue, fail, finish, requeue_stale
+from .local_index import build_index, load_index, new_build_dir, publish_index
+from .metrics import LLM_TOKENS, REGISTRY, UPSTREAM_REQUESTS, Histogram, collect
+from .models import GenerationJob, PopularQuery
+from .passages import estimate_tokens, group_passage_hits, pack_passages
+from .rag import INDEX_NAME, SOURCE_FIELDS, answer_cache_parts, build_search_body
+from .singleflight import SingleFlight
+from .standins import StandInElasticsearch, StandInLLM
+from .suggest import (PrefixIndex, build_suggestions, completion_suggestions, completion_weight, load_suggester,
+                      popular_queries, suggest, write_suggestions)
+from .views import decode_cursor, encode_cursor
+
+# (id, title, main_text, topics_tags, description)
+CORPUS = [
+    ("MED-1", "Insulin resistance and type 2 diabetes",
+     "Insulin resistance precedes type 2 diabetes. Diet and exercise improve insulin sensitivity.",
+     "Diabetes,Insulin", "How insulin resistance leads to diabetes"),
+    ("MED-2", "Green tea and breast cancer",
+     "Green tea polyphenols were studied for breast cancer risk in older women.",
+     "Tea,Cancer", "Green tea and cancer risk"),
+    ("MED-3", "Fiber and colon health",
+     "Dietary fiber lowers colon cancer risk and feeds gut bacteria.",
+     "Fiber,Cancer", "Fiber for the colon"),
+    ("MED-4", "Blood pressure and salt",
+     "Salt raises blood pressure; potassium from vegetables lowers it.",
+     "Salt", "Salt and hypertension"),
+    ("MED-5", "Soy and prostate cancer",
+     "Soy isoflavones and prostate cancer outcomes in men.",
+     "Soy,Cancer", "Soy for the prostate"),
+]
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="search-tests-")
+
+TEST_SETTINGS = dict(
+    CACHES={alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+            for alias in ("default", "expansions", "answers", "coalesce")},
+    SEARCH_BACKEND="elasticsearch",
+    SEARCH_COALESCE_DIR=os.path.join(SCRATCH_DIR, "locks"),
+    METRICS_DIR=os.path.join(SCRATCH_DIR, "metrics"),
+    SEARCH_PASSAGES=False,
+    SUGGEST_RECORD_QUERIES=False,
+)
+
+
+def write_corpus(path: str, corpus=CORPUS):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for doc_id, title, main_text, tags, description in corpus:
+            values = {"url": f"http://example.org/{doc_id}", "title": title, "main_text": main_text,
+                      "topics_tags": tags, "description": description}
+            f.write("\t".join([doc_id] + [values.get(name, "") for name in FIELD_NAMES]) + "\n")
+
+
+class StandInMixin:
+    """
+    Index CORPUS into a stand-in Elasticsearch and install it, with
+    stand-in LLMs, as this process's clients.
+    """
+    llm_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        cls.source = os.path.join(cls.workdir, "corpus.txt")
+        write_corpus(cls.source)
+        cls.es_server = StandInElasticsearch().start()
+        cls.es = Elasticsearch(cls.es_server.url)
+        cls.llm = StandInLLM(**cls.llm_options)
+        cls.async_llm = StandInLLM(**cls.llm_options, is_async=True)
+        clients.install(es=cls.es, client=cls.llm, async_client=cls.async_llm)
+        rebuild(cls.es, INDEX_NAME, cls.source, min_ratio=0)
+        get_backend.cache_clear()
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        clients.uninstall("es", "client", "async_client")
+        cls.es_server.stop()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = QueryCache("expansions", "test")
+        self.cache.backend.clear()
+
+    def test_rewordings_share_a_key(self):
+        key = self.cache.make_key("what causes diabetes")
+        self.assertEqual(self.cache.make_key("causes of diabetes?"), key)
+        self.assertEqual(self.cache.make_key("Diabetes causes"), key)
+        self.assertNotEqual(self.cache.make_key("diabetes causes", "other-model"), key)
+
+    @override_settings(QUERY_SIMILARITY_THRESHOLD=0.8)
+    def test_near_duplicate_hit(self):
+        self.cache.set("green tea breast cancer risk women", ["catechins"])
+        self.assertEqual(self.cache.get("green tea breast cancer risk in older women"), ["catechins"])
+        self.assertEqual(self.cache.stats()["near_hits"], 1)
+        # Extra key parts must match exactly
+        self.assertIsNone(self.cache.get("green tea breast cancer risk in older women", "other-hits"))
+
+    @override_settings(QUERY_SIMILARITY_THRESHOLD=0.8)
+    def test_dissimilar_query_misses(self):
+        self.cache.set("green tea breast cancer risk women", ["catechins"])
+        self.assertIsNone(self.cache.get("green tea colon health"))
+
+    @override_settings(QUERY_SIMILARITY_THRESHOLD=0.8)
+    def test_peek_leaves_no_trace(self):
+        self.cache.set("green tea breast cancer risk women", ["catechins"])
+        stats = self.cache.stats()
+        query = "green tea breast cancer risk in older women"
+        self.assertEqual(self.cache.peek(query), ["catechins"])
+        self.assertIsNone(self.cache.backend.get(self.cache.make_key(query)))
+        self.assertEqual(self.cache.stats(), stats)
+
+    @override_settings(QUERY_SIMILARITY_THRESHOLD=1)
+    def test_near_duplicates_off(self):
+        self.cache.set("green tea breast cancer risk women", ["catechins"])
+        self.assertIsNone(self.cache.get("green tea breast cancer risk in older women"))
+        self.assertEqual(canonical_query("Green tea, breast cancer risk women"),
+                         canonical_query("green tea breast cancer risk women"))
+
+
+@override_settings(**TEST_SETTINGS, SEARCH_COALESCE=True)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight(f"test-{self._testMethodName}")
+
+    def test_concurrent_calls_share_one_run(self):
+        calls = []
+        started = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.set()
+            time.sleep(0.3)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.flight.do("k", slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(self.flight.do("k", slow))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader, *followers]:
+            thread.join()
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_async_calls_on_one_loop_share_one_run(self):
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(*[self.flight.ado("k", slow) for _ in range(3)])
+
+        self.assertEqual(asyncio.run(run()), ["result"] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_follower_gives_up_at_its_deadline(self):
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(1.0)
+            return "leader"
+
+        leader = threading.Thread(target=lambda: self.flight.do("k", slow))
+        leader.start()
+        started.wait()
+        start = time.monotonic()
+        with deadline_scope(0.2):
+            result = self.flight.do("k", lambda: "own")
+        self.assertEqual(result, "own")
+        self.assertLess(time.monotonic() - start, 0.8)
+        leader.join()
+
+
+class RankingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        source = os.path.join(cls.workdir, "corpus.txt")
+        write_corpus(source)
+        build_index(iter_documents(source), os.path.join(cls.workdir, "index"))
+        cls.index = load_index(os.path.join(cls.workdir, "index"))
+
+    @classmethod
+    def tearDownClass(cls):
+        load_index.cache_clear()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_bm25_score(self):
+        res = self.index.search("fiber", [], 5, ["title"], ["title"])
+        self.assertEqual(res["hits"]["total"]["value"], 1)
+        hit = res["hits"]["hits"][0]
+        self.assertEqual(hit["_id"], "MED-3")
+
+        # One match of 'fiber' in 'Fiber and colon health' (3 tokens after
+        # stop words) among five titles
+        lengths = self.index.fields["title"]["lengths"]
+        avg_length = float(sum(lengths)) / len(lengths)
+        idf = math.log(1 + (5 - 1 + 0.5) / (1 + 0.5))
+        expected = idf * 2.2 / (1 + 1.2 * (1 - 0.75 + 0.75 * 3 / avg_length))
+        self.assertAlmostEqual(hit["_score"], expected, places=4)
+
+    def test_bm25_ranks_matching_documents(self):
+        res = self.index.search("cancer risk", [], 5, ["title^2", "main_text"], ["main_text"])
+        ids = [hit["_id"] for hit in res["hits"]["hits"]]
+        self.assertEqual(set(ids), {"MED-2", "MED-3", "MED-5"})
+        scores = [hit["_score"] for hit in res["hits"]["hits"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_expansion_terms_only_add_to_matches(self):
+        plain = self.index.search("cancer", [], 5, ["title", "main_text"], ["main_text"])
+        expanded = self.index.search("cancer", ["salt"], 5, ["title", "main_text"], ["main_text"])
+        self.assertEqual(expanded["hits"]["total"], plain["hits"]["total"])
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+        self.assertEqual([doc_id for doc_id, _ in fused], ["a", "c", "b"])
+        self.assertAlmostEqual(dict(fused)["a"], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(dict(fused)["c"], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(dict(fused)["b"], 1 / 62)
+
+    def test_hybrid_refuses_lexical_encoder(self):
+        with self.settings(SEARCH_RETRIEVAL_MODE="hybrid", DENSE_ENCODER="hashing"):
+            self.assertEqual([error.id for error in check_hybrid_encoder(None)], ["search.E002"])
+        with self.settings(SEARCH_RETRIEVAL_MODE="bm25", DENSE_ENCODER="hashing"):
+            self.assertEqual(check_hybrid_encoder(None), [])
+        with self.settings(SEARCH_RETRIEVAL_MODE="hybrid", DENSE_ENCODER="sentence-transformers"):
+            self.assertEqual(check_hybrid_encoder(None), [])
+
+
+@override_settings(**TEST_SETTINGS)
+class LocalIndexSwapTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.output = os.path.join(self.workdir, "index")
+
+    def tearDown(self):
+        load_index.cache_clear()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def publish(self, corpus):
+        source = os.path.join(self.workdir, "corpus.txt")
+        write_corpus(source, corpus)
+        build_dir = new_build_dir(self.output)
+        build_index(iter_documents(source), build_dir)
+        publish_index(build_dir, self.output)
+        return build_dir
+
+    def test_running_backend_sees_rebuild(self):
+        first = self.publish(CORPUS)
+        backend = LocalBackend(self.output)
+        self.assertEqual([hit["_id"] for hit in backend.search("insulin", [], 3)["hits"]["hits"]], ["MED-1"])
+
+        second = self.publish(CORPUS[1:])
+        self.assertEqual(backend.search("insulin", [], 3)["hits"]["hits"], [])
+        self.assertEqual(os.path.realpath(self.output), second)
+        self.assertFalse(os.path.exists(first))
+
+    def test_hits_identify_their_build(self):
+        self.publish(CORPUS)
+        backend = LocalBackend(self.output)
+        hits = backend.search("insulin", [], 3)["hits"]["hits"]
+        self.assertEqual(hits[0]["_source"]["content_hash"], content_hash(next(iter_documents(
+            os.path.join(self.workdir, "corpus.txt")))))
+        before = answer_cache_parts(hits, "model")
+
+        self.publish(CORPUS)
+        self.assertNotEqual(answer_cache_parts(backend.search("insulin", [], 3)["hits"]["hits"], "model"), before)
+
+    def test_dense_only_hits_identify_their_build(self):
+        self.publish(CORPUS)
+        dense_dir = os.path.join(self.workdir, "dense")
+        build_dense_index(iter_documents(os.path.join(self.workdir, "corpus.txt")), dense_dir, HashingEncoder())
+        try:
+            with self.settings(DENSE_ENCODER="hashing", DENSE_INDEX_DIR=dense_dir, HYBRID_CANDIDATES=5):
+                hits = hybrid_search(LocalBackend(self.output), "insulin", [], 5)["hits"]["hits"]
+        finally:
+            get_encoder.cache_clear()
+            load_dense_index.cache_clear()
+        self.assertEqual(len(hits), len(CORPUS))
+        self.assertEqual({hit["_index"] for hit in hits}, {load_index(self.output).index_name})
+        self.assertTrue(all(hit["_source"]["content_hash"] for hit in hits))
+
+    def test_legacy_directory_is_replaced(self):
+        os.makedirs(self.output)
+        build_dir = self.publish(CORPUS)
+        self.assertTrue(os.path.islink(self.output))
+        self.assertEqual(sorted(os.listdir(self.workdir)), sorted(["corpus.txt", "index", os.path.basename(build_dir)]))
+
+
+class ExpansionTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.source = os.path.join(self.workdir, "corpus.txt")
+        write_corpus(self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_tags_expand_to_cooccurring_tags(self):
+        expansions = build_expansions(iter_documents(self.source), min_count=1)
+        self.assertIn("cancer", dict(expansions["tea"]))
+        terms = LocalExpander(expansions).expand("green tea")
+        self.assertIn("cancer", terms)
+        self.assertNotIn("tea", terms)
+
+    def test_dictionary_is_loaded_once_it_exists_and_reloaded(self):
+        path = os.path.join(self.workdir, "expansions.json")
+        self.assertIsNone(load_expander(path))
+
+        write_expansions({"salt": [["sodium", 1.0]]}, path)
+        expander = load_expander(path)
+        self.assertEqual(expander.expand("salt"), ["sodium"])
+        self.assertIs(load_expander(path), expander)
+
+        write_expansions({"salt": [["hypertension", 1.0]]}, path)
+        self.assertEqual(load_expander(path).expand("salt"), ["hypertension"])
+
+
+@override_settings(**TEST_SETTINGS)
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.settings_override = self.settings(METRICS_DIR=self.metrics_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ["view"], buckets=(0.1, 1.0))
+        REGISTRY.remove(histogram)
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value, view="search")
+        samples = list(histogram.samples(histogram._values))
+        self.assertEqual(samples, [
+            ("_bucket", {"view": "search", "le": "0.1"}, 1),
+            ("_bucket", {"view": "search", "le": "1.0"}, 3),
+            ("_bucket", {"view": "search", "le": "+Inf"}, 4),
+            ("_sum", {"view": "search"}, 6.25),
+            ("_count", {"view": "search"}, 4),
+        ])
+
+    def test_snapshots_of_all_workers_are_merged(self):
+        key = ("generation", "prompt")
+        before = collect()[LLM_TOKENS.name].get(key, 0)
+        LLM_TOKENS.inc(2, call="generation", kind="prompt")
+        with open(os.path.join(self.metrics_dir, "999999.json"), "w", encoding="utf-8") as f:
+            json.dump({LLM_TOKENS.name: [[list(key), 5]], "removed_metric": [[[], 1]]}, f)
+        self.assertEqual(collect()[LLM_TOKENS.name][key], before + 7)
+
+    def test_exposition_format(self):
+        UPSTREAM_REQUESTS.inc(upstream='es "primary"', outcome="ok")
+        response = Client().get("/search/metrics")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE search_upstream_requests_total counter", lines)
+        self.assertIn("# TYPE search_request_duration_seconds histogram", lines)
+        sample = 'search_upstream_requests_total{upstream="es \\"primary\\"",outcome="ok"} '
+        self.assertTrue(any(line.startswith(sample) for line in lines))
+
+
+@override_settings(**TEST_SETTINGS, SEARCH_PROFILING=True, INTERNAL_IPS=["127.0.0.1"])
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.settings_override = self.settings(SEARCH_PROFILE_DIR=self.profile_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def get(self, path: str, remote_addr: str = "127.0.0.1", **headers):
+        return Client(headers=headers).get(path, REMOTE_ADDR=remote_addr)
+
+    def test_header_is_honoured_for_internal_clients_only(self):
+        self.assertIn("X-Search-Profile-Id", self.get("/search/cache-stats/", **{"X-Search-Profile": "1"}))
+        outside = self.get("/search/cache-stats/", "203.0.113.7", **{"X-Search-Profile": "1"})
+        self.assertNotIn("X-Search-Profile-Id", outside)
+
+    def test_only_search_urls_are_profiled(self):
+        with self.settings(SEARCH_PROFILING_SAMPLE_RATE=1.0):
+            self.assertIn("X-Search-Profile-Id", self.get("/search/cache-stats/"))
+            self.assertNotIn("X-Search-Profile-Id", self.get("/admin/login/"))
+            self.assertNotIn("X-Search-Profile-Id", self.get("/missing/"))
+
+    def test_profile_list_access(self):
+        profile_id = self.get("/search/cache-stats/", **{"X-Search-Profile": "1"})["X-Search-Profile-Id"]
+        response = self.get("/search/profiles/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([profile["id"] for profile in json.loads(response.content)["profiles"]], [profile_id])
+
+        self.assertEqual(self.get("/search/profiles/", "203.0.113.7").status_code, 403)
+        with self.settings(SEARCH_PROFILING=False):
+            self.assertEqual(self.get("/search/profiles/").status_code, 404)
+
+
+@override_settings(**TEST_SETTINGS)
+class RetrievalSweepTests(StandInMixin, SimpleTestCase):
+    def test_ranking_metrics(self):
+        relevant = {"a": 2, "b": 1, "c": 0}
+        self.assertEqual(ndcg_at_k(["a", "b"], relevant, 2), 1.0)
+        self.assertAlmostEqual(ndcg_at_k(["b", "a"], relevant, 2),
+                               (1 + 3 / math.log2(3)) / (3 + 1 / math.log2(3)))
+        self.assertEqual(recall_at_k(["c", "a", "x"], relevant, 2), 0.5)
+        self.assertEqual(ndcg_at_k(["a"], {"a": 0}, 5), 0.0)
+
+    def test_unknown_variant_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            resolve_variants([{"name": "typo", "query_feilds": ["title"]}])
+
+    def test_sweep_reads_cached_expansions_without_counting(self):
+        queries = os.path.join(self.workdir, "test.queries")
+        qrels = os.path.join(self.workdir, "test.qrel")
+        output = os.path.join(self.workdir, "sweep.json")
+        with open(queries, "w", encoding="utf-8") as f:
+            f.write("Q1\tinsulin resistance\nQ2\tgreen tea cancer\nQ3\tunjudged\n")
+        with open(qrels, "w", encoding="utf-8") as f:
+            f.write("Q1\t0\tMED-1\t2\nQ2\t0\tMED-2\t2\nQ2\t0\tMED-3\t1\n")
+        expansion_cache.set("green tea cancer", ["polyphenols"])
+        stats = expansion_cache.stats()
+
+        call_command("retrieval_sweep", queries=queries, qrels=qrels, output=output, stdout=io.StringIO())
+        self.assertEqual(expansion_cache.stats(), stats)
+
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+        self.assertEqual(report["queries"], 2)
+        variants = {variant["name"]: variant for variant in report["variants"]}
+        self.assertEqual(set(variants), {variant["name"] for variant in DEFAULT_VARIANTS})
+        self.assertEqual(variants["baseline"]["errors"], 0)
+        self.assertEqual(variants["k10"]["recall"], 1.0)
+
+
+@override_settings(**TEST_SETTINGS)
+class BatchSearchTests(StandInMixin, SimpleTestCase):
+    def post(self, body) -> tuple[int, dict]:
+        response = Client().post("/search/batch/", body if isinstance(body, str) else json.dumps(body),
+                                 content_type="application/json")
+        return response.status_code, json.loads(response.content)
+
+    def test_results_follow_request_order(self):
+        calls = self.llm.calls
+        status, body = self.post({"queries": ["insulin", {"q": "green tea", "k": 1}, "insulin"], "expand": False})
+        self.assertEqual(status, 200)
+        self.assertEqual((body["count"], body["errors"]), (3, 0))
+        self.assertEqual([result["index"] for result in body["results"]], [0, 1, 2])
+        self.assertEqual([result["search_results"]["documents"][0]["id"] for result in body["results"]],
+                         ["MED-1", "MED-2", "MED-1"])
+        self.assertEqual(body["results"][1]["search_results"]["k_requested"], 1)
+        self.assertTrue(all(result["status"] == "ok" and result["rag_answer"] for result in body["results"]))
+        # The repeated query was answered once
+        self.assertEqual(self.llm.calls - calls, 2)
+
+    def test_invalid_batches_are_rejected(self):
+        self.assertEqual(Client().get("/search/batch/").status_code, 405)
+        self.assertEqual(self.post("not json")[0], 400)
+        self.assertEqual(self.post({"queries": []})[0], 400)
+        self.assertEqual(self.post({"queries": ["insulin", " "]})[0], 400)
+        with self.settings(SEARCH_BATCH_MAX_QUERIES=2):
+            status, body = self.post({"queries": ["a", "b", "c"]})
+        self.assertEqual((status, body["status"]), (400, "error"))
+
+
+@override_settings(**TEST_SETTINGS)
+class ResponseSizeTests(StandInMixin, SimpleTestCase):
+    def test_search_fetches_only_needed_fields(self):
+        body = build_search_body("insulin", [])
+        self.assertEqual(body["_source"], SOURCE_FIELDS)
+        self.assertEqual(body["highlight"]["type"], "unified")
+        self.assertNotIn("highlight", build_search_body("insulin", [], highlight=False))
+        for field in body["highlight"]["fields"]:
+            self.assertEqual(INDEX_SETTINGS["mappings"]["properties"][field]["index_options"], "offsets")
+
+        hits = get_backend().search("insulin", [], 3)["hits"]["hits"]
+        self.assertLessEqual(set(hits[0]["_source"]), set(SOURCE_FIELDS))
+        self.assertNotIn("topics_tags", hits[0]["_source"])
+
+    def test_encoders_agree(self):
+        data = {"text": "Café ☕", "score": 1.5, "price": Decimal("2.50"), "label": gettext_lazy("Search"),
+                "items": [1, None, True]}
+        fast = encoding.dumps(data)
+        with mock.patch.object(encoding, "orjson", None):
+            plain = encoding.dumps(data)
+        self.assertEqual(json.loads(fast), json.loads(plain))
+        self.assertEqual(json.loads(fast)["price"], "2.50")
+
+        response = FastJsonResponse({"ok": True})
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content), {"ok": True})
+
+
+class HedgeTests(SimpleTestCase):
+    def setUp(self):
+        deadline._hedge_tokens = 0.0
+        self.calls = []
+
+    def slow_read(self):
+        self.calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return "result"
+
+    @override_settings(SEARCH_HEDGE_MAX_RATIO=1.0)
+    def test_slow_call_gets_a_backup(self):
+        self.assertEqual(hedged(self.slow_read, "test", 0.01), "result")
+        self.assertEqual(len(self.calls), 2)
+
+    @override_settings(SEARCH_HEDGE_MAX_RATIO=0.25)
+    def test_backups_are_limited(self):
+        for _ in range(8):
+            hedged(self.slow_read, "test", 0.01)
+        # Eight calls earn two backups
+        self.assertEqual(len(self.calls), 10)
+
+    @override_settings(SEARCH_HEDGE_MAX_RATIO=1.0)
+    def test_busy_pool_runs_inline(self):
+        _, slots = deadline._get_hedge_pool()
+        for _ in range(deadline.HEDGE_POOL_SIZE):
+            slots.acquire()
+        try:
+            self.assertEqual(hedged(self.slow_read, "test", 0.01), "result")
+        finally:
+            for _ in range(deadline.HEDGE_POOL_SIZE):
+                slots.release()
+        self.assertEqual(self.calls, [threading.current_thread().name])
+
+    @override_settings(SEARCH_HEDGE_MAX_RATIO=0.5)
+    def test_async_backups_are_limited(self):
+        async def slow_read():
+            self.calls.append("call")
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run():
+            return [await ahedged(slow_read, "test", 0.01) for _ in range(4)]
+
+        self.assertEqual(asyncio.run(run()), ["result"] * 4)
+        self.assertEqual(len(self.calls), 6)
+
+
+@override_settings(**TEST_SETTINGS, SEARCH_SUGGEST_BACKEND="local")
+class SuggestTests(StandInMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        popular_queries.loaded_at = None
+        self.path = os.path.join(self.workdir, f"suggestions-{self._testMethodName}.json")
+
+    def test_any_word_can_match_and_the_start_ranks_higher(self):
+        index = PrefixIndex([("soy and prostate cancer", "Soy and prostate cancer", "title", 1.5),
+                             ("prostate cancer", "Prostate cancer", "tag", 1),
+                             ("green tea", "Green tea", "tag", 1)])
+        self.assertEqual(index.complete("prostate", 5), [
+            {"text": "Prostate cancer", "kind": "tag", "score": 2.0},
+            {"text": "Soy and prostate cancer", "kind": "title", "score": 1.5},
+        ])
+        self.assertEqual(index.complete("tea", 5), [{"text": "Green tea", "kind": "tag", "score": 1}])
+        self.assertEqual(index.complete("rostate", 5), [])
+
+    def test_suggester_is_loaded_once_it_exists_and_reloaded(self):
+        self.assertIsNone(load_suggester(self.path))
+
+        write_suggestions(build_suggestions(iter_documents(self.source)), self.path)
+        suggester = load_suggester(self.path)
+        self.assertEqual(suggester.complete("cancer", 1), [{"text": "Cancer", "kind": "tag", "score": 6.0}])
+        self.assertIs(load_suggester(self.path), suggester)
+
+        write_suggestions({"sodium": {"text": "Sodium", "kind": "tag", "weight": 1}}, self.path)
+        self.assertEqual([s["text"] for s in load_suggester(self.path).complete("so", 5)], ["Sodium"])
+
+    def test_popular_queries_are_merged_with_the_corpus(self):
+        write_suggestions(build_suggestions(iter_documents(self.source)), self.path)
+        PopularQuery.objects.create(text="soy milk", count=10)
+        PopularQuery.objects.create(text="soy sauce", count=1)
+        with override_settings(SUGGESTIONS_FILE=self.path):
+            texts = [s["text"] for s in suggest("So", 5)]
+        self.assertEqual(texts[0], "soy milk")
+        self.assertIn("Soy and prostate cancer", texts)
+        self.assertNotIn("soy sauce", texts)
+
+    def test_completion_inputs_are_weighted_by_popularity(self):
+        self.assertEqual([s["text"] for s in completion_suggestions("s", 3)],
+                         ["Salt", "Soy", "Soy and prostate cancer"])
+
+        PopularQuery.objects.create(text=normalize_query("Soy and prostate cancer"), count=5)
+        rebuild(self.es, INDEX_NAME, self.source, min_ratio=0,
+                actions=partial(iter_actions, suggest_weight=completion_weight()))
+        suggestions = completion_suggestions("s", 3)
+        self.assertEqual(suggestions[0], {"text": "Soy and prostate cancer", "kind": "completion", "score": 6.0})
+        self.assertEqual([s["text"] for s in suggestions[1:]], ["Salt", "Soy"])
+
+
+@override_settings(**TEST_SETTINGS, ES_WARMUP_CONNECTIONS=3, LLM_WARMUP_CONNECTIONS=2,
+                   QUERY_EXPANSION="llm", SEARCH_SUGGEST_BACKEND="elasticsearch")
+class WarmUpTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Slow enough that concurrent warm-up requests need connections of their own
+        cls.es_server = StandInElasticsearch(latency=0.1).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.es_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        # Each test starts from a process that has no clients yet, and
+        # readiness() doesn't start warm-ups in the background
+        for patch in (mock.patch.dict(clients._clients, clear=True), mock.patch.dict(clients._overrides, clear=True),
+                      mock.patch.dict(clients._warmup, {"status": "pending"}, clear=True),
+                      mock.patch.object(clients, "_llm_adapter", None),
+                      mock.patch.object(clients, "start_warm_up")):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_warm_up_opens_connections_and_reports_ready(self):
+        clients.install(es=Elasticsearch(self.es_server.url), client=StandInLLM())
+        with self.assertLogs("search.clients", "INFO"):
+            clients.warm_up()
+        state = clients.readiness()
+        self.assertEqual(state["status"], "ready")
+        pool, = state["clients"]["es"]["pools"]
+        self.assertEqual(pool["opened"], 3)
+        self.assertEqual(pool["idle"], 3)
+
+    def test_failed_warm_up_is_unavailable_and_retried(self):
+        clients.install(es=Elasticsearch("http://127.0.0.1:1", max_retries=0), client=StandInLLM())
+        with self.assertLogs("search.clients", "WARNING"):
+            clients.warm_up()
+        state = clients.readiness()
+        self.assertEqual(state["status"], "unavailable")
+        self.assertEqual(state["warmup"]["status"], "failed")
+        clients.start_warm_up.assert_called_once()
+
+        response = Client().get("/search/ready/")
+        self.assertEqual(response.status_code, 503)
+
+    def test_llm_connections_are_opened_in_the_shared_pool(self):
+        with mock.patch.object(clients, "llm_endpoint", return_value=f"{self.es_server.url}/"):
+            clients.warm_up_llm()
+        pool, = clients.readiness()["clients"]["client"]["pools"]
+        self.assertEqual(pool["node"], self.es_server.url)
+        self.assertEqual(pool["opened"], 2)
+        # Request threads' sessions use the same pool
+        adapters = []
+        thread = threading.Thread(target=lambda: adapters.append(get_session().get_adapter(self.es_server.url)))
+        thread.start()
+        thread.join()
+        self.assertIs(adapters[0], clients._llm_adapter)
+
+    def test_unreachable_inference_endpoint_does_not_fail_the_warm_up(self):
+        with mock.patch.object(clients, "llm_endpoint", return_value="http://127.0.0.1:1/"):
+            with self.assertLogs("search.clients", "WARNING"):
+                clients.warm_up_llm()
+
+    def test_async_client_keeps_connections_alive(self):
+        async def info():
+            async_es = clients.get_async_es()
+            try:
+                return await async_es.info()
+            finally:
+                await async_es.close()
+
+        with (mock.patch.dict(os.environ, {"ES_URL": self.es_server.url}),
+              mock.patch.object(clients, "_keepalive_socket", wraps=clients._keepalive_socket) as factory):
+            self.assertIn("version", asyncio.run(info()))
+        factory.assert_called()
+
+    def test_installed_clients_are_restored(self):
+        stand_in, replacement = StandInLLM(), StandInLLM()
+        clients.install(client=stand_in)
+        with clients.installed(client=replacement, async_client=replacement):
+            self.assertIs(clients.get_llm(), replacement)
+            self.assertIs(clients.get_async_llm(), replacement)
+        self.assertIs(clients.get_llm(), stand_in)
+        self.assertNotIn("async_client", clients._overrides)
+
+        clients.uninstall()
+        self.assertEqual(clients._overrides, {})
+        with self.assertRaises(ValueError):
+            clients.install(llm=stand_in)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor([1.5, "MED-1"])), [1.5, "MED-1"])
+        self.assertEqual(decode_cursor(encode_cursor([2, "MED-2"])), [2, "MED-2"])
+
+    def test_malformed_cursors(self):
+        for cursor in ["!!!", encode_cursor([1.5]), encode_cursor({"a": 1}), encode_cursor(["a", "b"]),
+                       encode_cursor([True, "MED-1"]), encode_cursor([1.5, 2])]:
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_bad_cursor_is_a_bad_request(self):
+        response = Client().get("/search/results/", {"q": "diabetes", "cursor": "WyJhIiwiYiJd"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"status": "error", "detail": "Invalid cursor"})
+
+
+@override_settings(**TEST_SETTINGS, QUERY_EXPANSION="llm")
+class LatencyBudgetTests(StandInMixin, SimpleTestCase):
+    def test_short_budget_skips_llm_stages(self):
+        self.llm.latency = 3.0
+        try:
+            start = time.monotonic()
+            response = Client().get("/search/", {"q": "insulin diabetes", "budget": "1"})
+            elapsed = time.monotonic() - start
+        finally:
+            self.llm.latency = 0.0
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["degraded"], {"expansion": "skipped", "generation": "skipped"})
+        self.assertNotIn("rag_answer", data)
+        self.assertGreater(data["search_results"]["returned_count"], 0)
+        self.assertLess(elapsed, 1.5)
+
+    def test_ample_budget_is_not_degraded(self):
+        data = Client().get("/search/", {"q": "insulin diabetes", "budget": "10"}).json()
+        self.assertNotIn("degraded", data)
+        self.assertIn("rag_answer", data)
+
+
+@override_settings(**TEST_SETTINGS, SEARCH_JOB_CONCURRENCY=1, SEARCH_JOB_MAX_ATTEMPTS=2,
+                   SEARCH_JOB_RETRY_DELAY=60, SEARCH_JOB_MAX_QUEUED=10)
+class GenerationJobTests(TestCase):
+    def make_job(self, query: str, priority: int) -> GenerationJob:
+        return enqueue(query, ["context"], ["model"], 1, priority)
+
+    def test_claim_respects_priority_and_concurrency(self):
+        low = self.make_job("low", 1)
+        high = self.make_job("high", 9)
+        job = claim()
+        self.assertEqual(job.pk, high.pk)
+        self.assertEqual((job.status, job.attempts), (GenerationJob.RUNNING, 1))
+        # At SEARCH_JOB_CONCURRENCY
+        self.assertIsNone(claim())
+        finish(job, "answer")
+        self.assertEqual(claim().pk, low.pk)
+
+    @override_settings(SEARCH_JOB_MAX_QUEUED=2)
+    def test_queue_is_capped(self):
+        self.make_job("first", 5)
+        self.make_job("second", 5)
+        with self.assertRaises(QueueFull):
+            self.make_job("third", 5)
+        self.assertEqual(list(GenerationJob.objects.values_list("status", flat=True)), [GenerationJob.QUEUED] * 2)
+        # A claimed job frees its place
+        claim()
+        self.assertEqual(self.make_job("third", 5).status, GenerationJob.QUEUED)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        self.make_job("only", 5)
+        with override_settings(SEARCH_JOB_CONCURRENCY=5):
+            self.assertIsNotNone(claim())
+            self.assertIsNone(claim())
+
+    def test_failed_job_is_retried_after_a_delay_then_given_up(self):
+        job_id = self.make_job("flaky", 5).pk
+        job = claim()
+        fail(job, "rate limited")
+        job = GenerationJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, GenerationJob.QUEUED)
+        self.assertGreater(job.not_before, timezone.now() + timedelta(seconds=50))
+        self.assertIsNone(claim())
+
+        GenerationJob.objects.filter(pk=job_id).update(not_before=timezone.now())
+        job = claim()
+        self.assertEqual(job.attempts, 2)
+        fail(job, "rate limited")
+        job = GenerationJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.error), (GenerationJob.FAILED, "rate limited"))
+
+    def test_stale_job_is_requeued(self):
+        job_id = self.make_job("lost", 5).pk
+        claim()
+        GenerationJob.objects.filter(pk=job_id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(GenerationJob.objects.get(pk=job_id).status, GenerationJob.QUEUED)
+
+
+class GenerationTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.source = os.path.join(self.workdir, "corpus.txt")
+        write_corpus(self.source)
+        self.es_server = StandInElasticsearch().start()
+        self.es = Elasticsearch(self.es_server.url)
+
+    def tearDown(self):
+        self.es_server.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_rebuild_swaps_alias_and_prunes(self):
+        for _ in range(3):
+            rebuild(self.es, "docs", self.source, keep=1)
+        self.assertEqual(list_generations(self.es, "docs"), ["docs_v2", "docs_v3"])
+        self.assertEqual(live_index(self.es, "docs"), "docs_v3")
+        self.assertEqual(self.es.count(index="docs")["count"], len(CORPUS))
+
+    def test_failed_verification_keeps_the_live_generation(self):
+        rebuild(self.es, "docs", self.source)
+        smaller = os.path.join(self.workdir, "smaller.txt")
+        write_corpus(smaller, CORPUS[:2])
+        with self.assertRaises(RuntimeError):
+            rebuild(self.es, "docs", smaller, min_ratio=0.9)
+        self.assertEqual(list_generations(self.es, "docs"), ["docs_v1"])
+        self.assertEqual(live_index(self.es, "docs"), "docs_v1")
+
+    def test_legacy_index_is_replaced(self):
+        self.es.indices.create(index="docs")
+        rebuild(self.es, "docs", self.source, min_ratio=0)
+        self.assertTrue(self.es.indices.exists_alias(name="docs"))
+        self.assertEqual(live_index(self.es, "docs"), "docs_v1")
+
+
+class BulkIndexingTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.source = os.path.join(self.workdir, "corpus.txt")
+        write_corpus(self.source)
+        self.es_server = StandInElasticsearch().start()
+        self.es = Elasticsearch(self.es_server.url)
+
+    def tearDown(self):
+        self.es_server.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_parallel_parse_matches_serial(self):
+        serial = list(iter_documents(self.source))
+        self.assertEqual(list(iter_documents(self.source, workers=2)), serial)
+        self.assertEqual([doc["id"] for doc in serial], [row[0] for row in CORPUS])
+
+    def test_rejected_documents_are_retried(self):
+        self.es_server.reject_rate = 0.5
+        self.es.indices.create(index="docs")
+        stats = parallel_streaming_bulk(self.es, iter_actions("docs", iter_documents(self.source)),
+                                        threads=3, chunk_size=2, max_retries=20, initial_backoff=0.001)
+        self.assertEqual((stats.indexed, stats.failed), (len(CORPUS), 0))
+        self.es_server.reject_rate = 0
+        self.es.indices.refresh(index="docs")
+        self.assertEqual(self.es.count(index="docs")["count"], len(CORPUS))
+
+    def test_exhausted_retries_are_counted(self):
+        self.es_server.reject_rate = 1
+        self.es.indices.create(index="docs")
+        stats = parallel_streaming_bulk(self.es, iter_actions("docs", iter_documents(self.source)),
+                                        threads=2, chunk_size=2, max_retries=1, initial_backoff=0.001)
+        self.assertEqual((stats.indexed, stats.failed), (0, len(CORPUS)))
+
+
+@override_settings(**TEST_SETTINGS)
+class ContentHashTests(StandInMixin, SimpleTestCase):
+    def test_hash_follows_the_fields(self):
+        doc = {"id": "MED-1", "title": "Insulin", "topics_tags": ["Diabetes"]}
+        self.assertEqual(content_hash(doc), content_hash(dict(reversed(list(doc.items())))))
+        self.assertEqual(content_hash(doc), content_hash(dict(doc, content_hash="stale")))
+        self.assertNotEqual(content_hash(doc), content_hash(dict(doc, title="Insulin resistance")))
+
+    def test_fetched_documents_carry_their_generation(self):
+        documents = get_backend().get_documents(["MED-2", "MED-404"])
+        self.assertEqual(list(documents), ["MED-2"])
+        self.assertEqual(documents["MED-2"]["_index"], live_index(self.es, INDEX_NAME))
+        self.assertTrue(documents["MED-2"]["_source"]["content_hash"])
+
+    def test_incremental_update_detects_changes(self):
+        hits = get_backend().search("insulin", [], 3)["hits"]["hits"]
+        before = answer_cache_parts(hits, "model")
+
+        changed = os.path.join(self.workdir, "changed.txt")
+        write_corpus(changed, [CORPUS[0][:2] + ("Insulin resistance is reversible.",) + CORPUS[0][3:],
+                               *CORPUS[1:4]])
+        changes = update_incrementally(self.es, INDEX_NAME, changed)
+        self.assertEqual(changes, {"new": 0, "changed": 1, "unchanged": 3, "deleted": 1, "failed": 0})
+
+        hits = get_backend().search("insulin", [], 3)["hits"]["hits"]
+        self.assertEqual([hit["_id"] for hit in hits], ["MED-1"])
+        self.assertNotEqual(answer_cache_parts(hits, "model"), before)
+
+        # Back to the shared corpus for the other tests
+        rebuild(self.es, INDEX_NAME, self.source, min_ratio=0)
+
+
+@override_settings(**TEST_SETTINGS, QUERY_EXPANSION="llm")
+class AsyncSearchTests(StandInMixin, SimpleTestCase):
+    async def search(self, params: dict) -> dict:
+        # The async client binds to the event loop it first runs on
+        async_es = AsyncElasticsearch(self.es_server.url)
+        try:
+            with clients.installed(async_es=async_es):
+                response = await AsyncClient().get("/search/async/", params)
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.content)
+        finally:
+            await async_es.close()
+
+    async def test_matches_sync_view(self):
+        params = {"q": "insulin diabetes", "k": "3"}
+        body = await self.search(params)
+        self.assertIn("insulin disorder", body["query"]["expanded_terms"])
+        self.assertEqual(body["search_results"]["documents"][0]["id"], "MED-1")
+        self.assertEqual(body["cache"], {"answer": "miss"})
+
+        sync_body = await sync_to_async(lambda: json.loads(Client().get("/search/", params).content))()
+        self.assertEqual(sync_body["query"], body["query"])
+        self.assertEqual(sync_body["search_results"], body["search_results"])
+        self.assertEqual(sync_body["cache"], {"answer": "hit"})
+
+    async def test_slow_expansion_falls_back_to_first_pass(self):
+        self.async_llm.latency = 0.2
+        try:
+            with self.settings(SEARCH_EXPANSION_TIMEOUT=0.01):
+                body = await self.search({"q": "green tea"})
+            self.assertEqual(body["query"]["expanded_terms"], [])
+            self.assertEqual(body["degraded"], {"expansion": "timeout"})
+            self.assertEqual(body["search_results"]["documents"][0]["id"], "MED-2")
+
+            # The abandoned expansion still finishes and lands in the cache
+            await asyncio.sleep(0.3)
+            cached = await sync_to_async(expansion_cache.get)("green tea")
+            self.assertIn("green disorder", cached)
+        finally:
+            self.async_llm.latency = 0
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchStreamTests(StandInMixin, SimpleTestCase):
+    llm_options = {"answer_tokens": 5}
+
+    async def stream(self, params: dict) -> list[tuple[str, dict]]:
+        response = await AsyncClient().get("/search/stream/", params)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return parse_events(b"".join([chunk async for chunk in response.streaming_content]).decode())
+
+    async def test_event_sequence(self):
+        # The async client binds to the event loop it first runs on
+        async_es = AsyncElasticsearch(self.es_server.url)
+        try:
+            with clients.installed(async_es=async_es):
+                events = await self.stream({"q": "insulin diabetes", "expand": "0"})
+                names = [name for name, _ in events]
+                self.assertEqual(names, ["documents"] + ["token"] * 5 + ["done"])
+                self.assertEqual(events[0][1]["search_results"]["documents"][0]["id"], "MED-1")
+                self.assertEqual(events[-1][1]["cache"], {"answer": "miss"})
+
+                # The streamed answer was cached and comes back as one token
+                events = await self.stream({"q": "diabetes insulin", "expand": "0"})
+                self.assertEqual([name for name, _ in events], ["documents", "token", "done"])
+                self.assertEqual(events[-1][1]["cache"], {"answer": "hit"})
+
+                events = await self.stream({"q": "xylophone", "expand": "0"})
+                self.assertEqual([name for name, _ in events], ["documents", "token", "done"])
+                self.assertEqual(events[-1][1]["cache"], {"answer": "bypass"})
+        finally:
+            await async_es.close()
+
+
+class PassageTests(SimpleTestCase):
+    @staticmethod
+    def hit(title: str, *passages: str) -> dict:
+        return {"_source": {"title": title},
+                "passages": [{"position": position, "score": 1.0, "text": text}
+                             for position, text in enumerate(passages)]}
+
+    def test_packing_is_round_robin_within_budget(self):
+        hits = [self.hit("First", "a" * 40, "b" * 40, "c" * 40), self.hit("Second", "d" * 40, "e" * 40)]
+        # Headers cost title/4 + 5 tokens, passages 10 tokens each
+        parts = pack_passages(hits, 2 * (1 + 5 + 10) + 10)
+        self.assertEqual(len(parts), 2)
+        self.assertIn("a" * 40, parts[0])
+        self.assertIn("b" * 40, parts[0])
+        self.assertNotIn("c" * 40, parts[0])
+        self.assertIn("d" * 40, parts[1])
+        self.assertNotIn("e" * 40, parts[1])
+
+    def test_oversized_passages_are_skipped(self):
+        hits = [self.hit("First", "x" * 400, "short"), self.hit("Second", "y" * 20)]
+        parts = pack_passages(hits, 30)
+        used = sum(estimate_tokens(text) for text in ["short", "y" * 20]) + 2 * 5 + 2 * estimate_tokens("First")
+        self.assertLessEqual(used, 30)
+        self.assertNotIn("x" * 400, "".join(parts))
+        self.assertIn("short", parts[0])
+        self.assertIn("y" * 20, parts[1])
+
+    def test_passages_keep_reading_order(self):
+        hits = [{"_source": {"title": "T"}, "passages": [
+            {"position": 4, "score": 2.0, "text": "later"}, {"position": 1, "score": 1.0, "text": "earlier"}]}]
+        part = pack_passages(hits, 100)[0]
+        self.assertLess(part.index("earlier"), part.index("later"))
+
+    def test_grouped_hits_count_documents(self):
+        passage = {"_index": "medicine_passages_v1", "_id": "MED-1-0", "_score": 2.0,
+                   "_source": {"doc_id": "MED-1", "title": "T", "url": "u", "description": "d",
+                               "content_hash": "h", "position": 0, "text": "insulin"}}
+        res = {"hits": {"total": {"value": 7, "relation": "eq"}, "hits": [dict(passage, inner_hits={
+            "passages": {"hits": {"hits": [passage]}}})]},
+               "aggregations": {"documents": {"value": 3}}}
+        grouped = group_passage_hits(res)
+        self.assertEqual(grouped["hits"]["total"], {"value": 3, "relation": "eq"})
+        hit = grouped["hits"]["hits"][0]
+        self.assertEqual(hit["_id"], "MED-1")
+        self.assertEqual(hit["_source"], {"title": "T", "url": "u", "description": "d", "content_hash": "h"})
+        self.assertEqual(hit["passages"], [{"position": 0, "score": 2.0, "text": "insulin"}])
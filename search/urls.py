@@ -1,10 +1,23 @@
 from django.urls import path
-from .views import es_health_check, search, llm_health_check, perform_rag
+from .views import es_health_check, search, llm_health_check, perform_rag, cache_stats, search_stream, async_search_with_rag, metrics, profiles, search_batch, search_results, job_status, job_stream, search_suggest, ready
+
+app_name = 'search'
 
 urlpatterns = [
     path('es-check/', es_health_check),
     path('', search),
+    path('stream/', search_stream),
+    path('async/', async_search_with_rag),
+    path('batch/', search_batch),
+    path('results/', search_results),
+    path('suggest/', search_suggest),
+    path('jobs/<uuid:job_id>/', job_status, name='job_status'),
+    path('jobs/<uuid:job_id>/stream/', job_stream, name='job_stream'),
     path('generate/', perform_rag),
     path('llm-check/', llm_health_check),
+    path('ready/', ready),
+    path('cache-stats/', cache_stats),
+    path('metrics', metrics),
+    path('profiles/', profiles),
 ]
 
@@ -1,11 +1,51 @@
-import re
-from django.http import JsonResponse
-from .elasticsearch_client import es
-from .mistral_client import client
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from .cache import answer_cache, canonical_query, expansion_cache
+from .deadline import PoolFull, call_with_timeout, deadline_scope, degrade, time_left
+from .backends import aretrieve, retrieve, retrieve_many, retrieve_page
+from .clients import get_async_llm, get_es, get_llm, readiness
+from .encoding import FastJsonResponse, dumps
+from .expansion import load_expander
+from .indexing import FIELD_NAMES
+from .jobs import QueueFull, enqueue, get_job, job_payload
+from .metrics import LLM_TOKENS, record_usage, render, stage, upstream_call
+from .profiling import list_profiles, may_profile
+from .mistral_client import MODEL
+from .rag import (
+    ANSWER_MAX_TOKENS,
+    ANSWER_TEMPERATURE,
+    EXPANSION_MAX_TOKENS,
+    EXPANSION_TEMPERATURE,
+    NO_DOCUMENTS_ANSWER,
+    RESULT_FIELDS,
+    RESULTS_MAX_SIZE,
+    answer_cache_parts,
+    answer_confidence,
+    build_documents,
+    build_expansion_prompt,
+    build_rag_prompt,
+    build_response,
+    parse_expansion,
+)
+from .singleflight import expansion_flight, search_flight
+from .suggest import record_query, suggest
+
+logger = logging.getLogger(__name__)
 
 def es_health_check(request):
     try:
-        info = es.info()
+        info = get_es().info()
         return JsonResponse({
             "name": info['name'],
             "cluster_name": info['cluster_name'],
@@ -15,10 +55,18 @@ def es_health_check(request):
     except Exception as e:
         return JsonResponse({"status": "error", "detail": str(e)}, status=500)
 
+def ready(request):
+    """
+    Readiness probe: 503 until this worker's upstream clients are warmed
+    up, with the state of their connection pools.
+    """
+    state = readiness()
+    return JsonResponse(state, status=200 if state["status"] == "ready" else 503)
+
 def llm_health_check(request):
     try:
-        completion = client.chat.completions.create(
-            model="mistralai/Mistral-7B-Instruct-v0.3",
+        completion = get_llm().chat.completions.create(
+            model=MODEL,
             messages=[
                 {"role": "user", "content": "What is the capital of Indonesia?"}
             ],
@@ -31,39 +79,341 @@ def llm_health_check(request):
     except Exception as e:
         return JsonResponse({"status": "error", "detail": str(e)}, status=500)
 
+def local_expand_query(query: str) -> list[str]:
+    """
+    Expand query from the corpus-derived dictionary (manage.py build_expansions).
+    """
+    expander = load_expander(settings.EXPANSIONS_FILE)
+    return expander.expand(query) if expander else []
+
 def expand_query(query: str) -> list[str]:
     """
     Expand query with relevant medical terms for better search results.
+
+    QUERY_EXPANSION selects the source: 'local' uses only the corpus-derived
+    dictionary, 'local+llm' falls back to the LLM when the dictionary has no
+    terms, and 'llm' always asks the LLM. LLM results are cached per
+    normalized query and shared by all workers.
+    """
+    expanded_terms = available_expansion(query)
+    if expanded_terms is not None:
+        return expanded_terms
+    return llm_expand_query(query)
+
+def available_expansion(query: str) -> list[str] | None:
+    """
+    Expansion terms that need no LLM call: from the local dictionary or the
+    cache. None when only the LLM can provide them.
+    """
+    if settings.QUERY_EXPANSION in ('local', 'local+llm'):
+        expanded_terms = local_expand_query(query)
+        if expanded_terms or settings.QUERY_EXPANSION == 'local':
+            return expanded_terms
+
+    return expansion_cache.get(query)
+
+def llm_expand_query(query: str) -> list[str]:
+    # Concurrent misses for the same query share one LLM call
+    key = expansion_flight.make_key(canonical_query(query))
+    return expansion_flight.do(key, lambda: _llm_expand_query(query)) or []
+
+def expand_within_budget(query: str) -> list[str]:
+    """
+    expand_query limited to SEARCH_EXPANSION_BUDGET_SHARE of the request's
+    latency budget. Without time for an LLM call the query isn't expanded;
+    an LLM call that runs out of time still fills the cache when it returns.
+    """
+    expanded_terms = available_expansion(query)
+    if expanded_terms is not None:
+        return expanded_terms
+
+    timeout = time_left(share=settings.SEARCH_EXPANSION_BUDGET_SHARE)
+    if timeout is not None and timeout < settings.SEARCH_MIN_EXPANSION_TIME:
+        degrade("expansion", "skipped")
+        return []
+    try:
+        return call_with_timeout(lambda: llm_expand_query(query), timeout)
+    except PoolFull:
+        degrade("expansion", "skipped")
+        return []
+    except TimeoutError:
+        degrade("expansion", "timeout")
+        return []
+
+def _llm_expand_query(query: str) -> list[str] | None:
+    """
+    Ask the LLM for expansion terms and cache them. Returns None when the
+    call fails so that failures are neither cached nor shared.
+    """
+    try:
+        with upstream_call("llm"):
+            expansion = get_llm().chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "user", "content": build_expansion_prompt(query)}
+                ],
+                max_tokens=EXPANSION_MAX_TOKENS,
+                temperature=EXPANSION_TEMPERATURE
+            )
+        record_usage("expansion", expansion)
+        expanded_terms = parse_expansion(expansion.choices[0].message.content)
+    except Exception as e:
+        logger.warning(f"Query expansion failed: {e}")
+        return None
+
+    expansion_cache.set(query, expanded_terms)
+    return expanded_terms
+
+async def async_expand_query(query: str) -> list[str]:
+    """
+    Async counterpart of expand_query, sharing the same cache.
+    """
+    if settings.QUERY_EXPANSION in ('local', 'local+llm'):
+        expanded_terms = local_expand_query(query)
+        if expanded_terms or settings.QUERY_EXPANSION == 'local':
+            return expanded_terms
+
+    cached = await sync_to_async(expansion_cache.get)(query)
+    if cached is not None:
+        return cached
+
+    key = expansion_flight.make_key(canonical_query(query))
+    return await expansion_flight.ado(key, lambda: _allm_expand_query(query)) or []
+
+async def _allm_expand_query(query: str) -> list[str] | None:
+    """
+    Async counterpart of _llm_expand_query.
+    """
+    try:
+        with upstream_call("llm"):
+            expansion = await get_async_llm().chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "user", "content": build_expansion_prompt(query)}
+                ],
+                max_tokens=EXPANSION_MAX_TOKENS,
+                temperature=EXPANSION_TEMPERATURE
+            )
+        record_usage("expansion", expansion)
+        expanded_terms = parse_expansion(expansion.choices[0].message.content)
+    except Exception as e:
+        logger.warning(f"Query expansion failed: {e}")
+        return None
+
+    await sync_to_async(expansion_cache.set)(query, expanded_terms)
+    return expanded_terms
+
+def cache_stats(request):
+    return JsonResponse({
+        "expansions": expansion_cache.stats(),
+        "answers": answer_cache.stats(),
+    })
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint, aggregated over all workers.
+    """
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def profiles(request):
+    """
+    Slowest recently profiled requests; only available with SEARCH_PROFILING on,
+    to staff users and INTERNAL_IPS.
+    """
+    if not settings.SEARCH_PROFILING:
+        raise Http404("Profiling is disabled")
+    if not may_profile(request):
+        return JsonResponse({"status": "error", "detail": "Profiles are only available to staff"}, status=403)
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({"status": "error", "detail": "limit must be an integer"}, status=400)
+    return JsonResponse({"profiles": list_profiles(limit)})
+
+def parse_search_params(request):
+    """
+    Validate the shared `q` and `k` parameters. Returns (query, k, error_response).
+    """
+    if request.method != 'GET':
+        return None, None, JsonResponse({"status": "error", "detail": "Use GET method"}, status=405)
+
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return None, None, JsonResponse({"status": "error", "detail": "Query is required"}, status=400)
+
+    # Get configurable k parameter (default to 5)
+    try:
+        k = int(request.GET.get('k', 5))
+        k = max(1, min(k, 20))  # Limit k between 1 and 20
+    except ValueError:
+        k = 5
+
+    return query, k, None
+
+def parse_budget(request) -> float:
+    """
+    Optional `budget` parameter: the request's latency budget in seconds,
+    SEARCH_LATENCY_BUDGET by default and at most SEARCH_LATENCY_BUDGET_MAX.
+    """
+    try:
+        budget = float(request.GET.get('budget', settings.SEARCH_LATENCY_BUDGET))
+    except ValueError:
+        budget = settings.SEARCH_LATENCY_BUDGET
+    return max(0.1, min(budget, settings.SEARCH_LATENCY_BUDGET_MAX))
+
+def parse_job_priority(request) -> int | None:
+    """
+    Optional `defer` (1 to generate the answer in a background job) and
+    `priority` (0-9, higher runs first) parameters. Returns the job
+    priority, or None to generate the answer in the request.
     """
-    prompt = f"""
-    You are a medical search assistant. Generate 3-5 relevant medical terms, synonyms, or related concepts for the query below.
-    Focus on medical terminology, alternative names, and closely related conditions.
-    Return ONLY the terms separated by commas, without numbering or extra text.
+    if request.GET.get('defer', '0').lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+    try:
+        priority = int(request.GET.get('priority', settings.SEARCH_JOB_DEFAULT_PRIORITY))
+    except ValueError:
+        priority = settings.SEARCH_JOB_DEFAULT_PRIORITY
+    return max(0, min(priority, 9))
 
-    Query: "{query}"
+def parse_retrieval_options(request):
     """
+    Optional `mode` (bm25 or hybrid) and `expand` (0 to skip LLM expansion)
+    parameters. Returns (mode, expand).
+    """
+    mode = request.GET.get('mode', settings.SEARCH_RETRIEVAL_MODE)
+    if mode not in ('bm25', 'hybrid'):
+        mode = settings.SEARCH_RETRIEVAL_MODE
+    expand = request.GET.get('expand', '1').lower() not in ('0', 'false', 'no', 'off')
+    return mode, expand
+
+def generate_answer(query: str, hits: list[dict], context_parts: list[str]) -> tuple[str | None, str]:
+    """
+    RAG answer for the retrieved hits, served from the answer cache when the
+    same query already got the same documents from the same index generation.
+    Returns (answer, cache_status); the answer is None when the latency
+    budget left no time for it.
+    """
+    if not hits:
+        return NO_DOCUMENTS_ANSWER, "bypass"
+
+    key_parts = answer_cache_parts(hits, MODEL)
+    cached = answer_cache.get(query, *key_parts)
+    if cached is not None:
+        return cached, "hit"
+
+    timeout = time_left()
+    if timeout is not None and timeout < settings.SEARCH_MIN_GENERATION_TIME:
+        degrade("generation", "skipped")
+        return None, "miss"
 
     try:
-        expansion = client.chat.completions.create(
-            model="mistralai/Mistral-7B-Instruct-v0.3",
+        llm_answer = call_with_timeout(lambda: request_answer(query, context_parts, key_parts), timeout)
+    except PoolFull:
+        degrade("generation", "skipped")
+        return None, "miss"
+    except TimeoutError:
+        degrade("generation", "timeout")
+        return None, "miss"
+    except Exception as e:
+        logger.warning(f"Answer generation failed: {e}")
+        return f"Error generating answer: {str(e)}", "miss"
+
+    return llm_answer, "miss"
+
+def request_answer(query: str, context_parts: list[str], key_parts: list[str]) -> str:
+    """
+    Ask the LLM for the answer and cache it, also when the request that
+    asked has stopped waiting.
+    """
+    with upstream_call("llm"):
+        rag_response = get_llm().chat.completions.create(
+            model=MODEL,
             messages=[
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": build_rag_prompt(query, context_parts)}
             ],
-            max_tokens=100,
-            temperature=0.3
+            max_tokens=ANSWER_MAX_TOKENS,
+            temperature=ANSWER_TEMPERATURE
         )
+    record_usage("generation", rag_response)
+    llm_answer = rag_response.choices[0].message.content
+    answer_cache.set(query, llm_answer, *key_parts)
+    return llm_answer
+
+async def agenerate_answer(query: str, hits: list[dict], context_parts: list[str]) -> tuple[str | None, str]:
+    """
+    Async counterpart of generate_answer, sharing the same cache.
+    """
+    if not hits:
+        return NO_DOCUMENTS_ANSWER, "bypass"
+
+    key_parts = answer_cache_parts(hits, MODEL)
+    cached = await sync_to_async(answer_cache.get)(query, *key_parts)
+    if cached is not None:
+        return cached, "hit"
+
+    timeout = time_left()
+    if timeout is not None and timeout < settings.SEARCH_MIN_GENERATION_TIME:
+        degrade("generation", "skipped")
+        return None, "miss"
 
-        expanded_raw = expansion.choices[0].message.content.strip()
-        # Clean up the response
-        cleaned = re.sub(r'\d+\.\s*', '', expanded_raw)
-        cleaned = cleaned.replace('\n', ',')
-        expanded_terms = [term.strip() for term in cleaned.split(',') if term.strip()]
-        
-        # Limit to 5 terms to avoid noise
-        return expanded_terms[:5]
+    task = asyncio.ensure_future(arequest_answer(query, context_parts, key_parts))
+    try:
+        llm_answer = await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+    except asyncio.TimeoutError:
+        keep_in_background(task)
+        degrade("generation", "timeout")
+        return None, "miss"
     except Exception as e:
-        print(f"Query expansion failed: {e}")
-        return []
+        logger.warning(f"Answer generation failed: {e}")
+        return f"Error generating answer: {str(e)}", "miss"
+
+    return llm_answer, "miss"
+
+async def arequest_answer(query: str, context_parts: list[str], key_parts: list[str]) -> str:
+    """
+    Async counterpart of request_answer.
+    """
+    with upstream_call("llm"):
+        rag_response = await get_async_llm().chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "user", "content": build_rag_prompt(query, context_parts)}
+            ],
+            max_tokens=ANSWER_MAX_TOKENS,
+            temperature=ANSWER_TEMPERATURE
+        )
+    record_usage("generation", rag_response)
+    llm_answer = rag_response.choices[0].message.content
+    await sync_to_async(answer_cache.set)(query, llm_answer, *key_parts)
+    return llm_answer
+
+def defer_answer(query: str, hits: list[dict], context_parts: list[str], priority: int) -> tuple[str | None, str, dict | None]:
+    """
+    Queue the RAG answer as a background job instead of generating it.
+    Returns (answer, cache_status, job); cached answers and searches
+    without documents need no job.
+    """
+    if not hits:
+        return NO_DOCUMENTS_ANSWER, "bypass", None
+
+    key_parts = answer_cache_parts(hits, MODEL)
+    cached = answer_cache.get(query, *key_parts)
+    if cached is not None:
+        return cached, "hit", None
+
+    try:
+        job = enqueue(query, context_parts, key_parts, len(hits), priority)
+    except QueueFull as e:
+        logger.warning(f"Answer not queued: {e}")
+        degrade("generation", "queue_full")
+        return None, "miss", None
+
+    return None, "miss", {
+        "id": str(job.id),
+        "status": job.status,
+        "url": reverse('search:job_status', args=[job.id]),
+        "events": reverse('search:job_stream', args=[job.id]),
+    }
 
 def search_with_rag(request):
     """
@@ -73,148 +423,530 @@ def search_with_rag(request):
     3. Searches for top k documents
     4. Performs RAG with the retrieved documents
     5. Returns both LLM answer and top k documents
+
+    Identical requests that arrive while one is running wait for it and
+    return the same response instead of repeating the upstream calls.
+
+    The whole pipeline runs within the request's latency budget; stages
+    that don't fit are skipped and reported under `degraded`. With `defer=1`
+    the answer is queued as a background job and the response carries its
+    ID instead of waiting for the LLM.
     """
-    if request.method != 'GET':
-        return JsonResponse({"status": "error", "detail": "Use GET method"}, status=405)
+    query, k, error = parse_search_params(request)
+    if error:
+        return error
+    mode, expand = parse_retrieval_options(request)
+    budget = parse_budget(request)
+    job_priority = parse_job_priority(request)
 
-    query = request.GET.get('q', '').strip()
-    if not query:
-        return JsonResponse({"status": "error", "detail": "Query is required"}, status=400)
+    try:
+        # Opened here so that waiting for an identical search counts against the budget
+        with deadline_scope(budget):
+            key = search_flight.make_key(query, k, mode, expand, budget, job_priority)
+            return FastJsonResponse(search_flight.do(
+                key, lambda: run_search_pipeline(query, k, mode, expand, budget, job_priority)
+            ))
+
+    except Exception as e:
+        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
+
+def run_search_pipeline(query: str, k: int, mode: str, expand: bool, budget: float,
+                        job_priority: int | None = None) -> dict:
+    with deadline_scope(budget, inherit=True) as deadline:
+        # Step 1: Expand the query within its share of the budget
+        with stage("expansion"):
+            expanded_terms = expand_within_budget(query) if expand else []
+
+        # Step 2: Search for top k documents using expanded query
+        with stage("retrieval"):
+            res = retrieve(query, expanded_terms, k, mode)
+
+        # Step 3: Prepare documents for both return and RAG context
+        with stage("context"):
+            documents, context_parts = build_documents(res["hits"]["hits"])
+
+        # Step 4: Perform RAG with retrieved documents if there is time left, or queue it
+        job = None
+        if job_priority is None:
+            with stage("generation"):
+                llm_answer, answer_cache_status = generate_answer(query, res["hits"]["hits"], context_parts)
+        else:
+            with stage("enqueue"):
+                llm_answer, answer_cache_status, job = defer_answer(query, res["hits"]["hits"], context_parts,
+                                                                    job_priority)
+
+        # Step 5: Count the query for suggestions and return comprehensive response
+        if documents:
+            record_query(query)
+        return build_response(query, expanded_terms, res, documents, k, llm_answer,
+                              cache={"answer": answer_cache_status}, degraded=deadline.degraded, job=job)
+
+# Keeps references to tasks that outlive their request
+_background_tasks = set()
+
+def keep_in_background(task: asyncio.Future):
+    """
+    Let an abandoned task finish, e.g. so that its result lands in a cache.
+    """
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    # Retrieve a failure so it isn't logged as never retrieved
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+async def async_search_with_rag(request):
+    """
+    Async version of search_with_rag.
+
+    Query expansion and an unexpanded first-pass search start together. If the
+    expansion arrives within SEARCH_EXPANSION_TIMEOUT (and its share of the
+    latency budget) the search is re-issued
+    with the expanded `should` clause, otherwise the first-pass hits are used.
+    Generation runs on the async inference client, so the worker can serve
+    other requests while waiting on I/O.
+    """
+    query, k, error = parse_search_params(request)
+    if error:
+        return error
+    mode, expand = parse_retrieval_options(request)
+    budget = parse_budget(request)
+    job_priority = parse_job_priority(request)
 
-    # Get configurable k parameter (default to 5)
     try:
-        k = int(request.GET.get('k', 5))
-        k = max(1, min(k, 20))  # Limit k between 1 and 20
+        # Opened here so that waiting for an identical search counts against the budget
+        with deadline_scope(budget):
+            key = search_flight.make_key(query, k, mode, expand, budget, job_priority)
+            return FastJsonResponse(await search_flight.ado(
+                key, lambda: arun_search_pipeline(query, k, mode, expand, budget, job_priority)
+            ))
+
+    except Exception as e:
+        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
+
+async def arun_search_pipeline(query: str, k: int, mode: str, expand: bool, budget: float,
+                               job_priority: int | None = None) -> dict:
+    with deadline_scope(budget, inherit=True) as deadline:
+        # Step 1: Expand the query while a first-pass search runs
+        first_pass_task = asyncio.create_task(aretrieve(query, [], k, mode))
+        expanded_terms = []
+        if expand:
+            expansion_task = asyncio.create_task(async_expand_query(query))
+            timeout = time_left(cap=settings.SEARCH_EXPANSION_TIMEOUT, share=settings.SEARCH_EXPANSION_BUDGET_SHARE)
+            with stage("expansion", view="async"):
+                try:
+                    expanded_terms = await asyncio.wait_for(asyncio.shield(expansion_task), timeout=timeout)
+                except asyncio.TimeoutError:
+                    # Let the expansion finish in the background so it lands in the cache
+                    keep_in_background(expansion_task)
+                    degrade("expansion", "timeout")
+
+        # Step 2: Re-issue with expanded terms, or fall back to the first pass
+        with stage("retrieval", view="async"):
+            if expanded_terms:
+                first_pass_task.cancel()
+                res = await aretrieve(query, expanded_terms, k, mode)
+            else:
+                res = await first_pass_task
+
+        # Step 3: Prepare documents for both return and RAG context
+        with stage("context", view="async"):
+            documents, context_parts = build_documents(res["hits"]["hits"])
+
+        # Step 4: Perform RAG with retrieved documents if there is time left, or queue it
+        job = None
+        if job_priority is None:
+            with stage("generation", view="async"):
+                llm_answer, answer_cache_status = await agenerate_answer(query, res["hits"]["hits"], context_parts)
+        else:
+            with stage("enqueue", view="async"):
+                llm_answer, answer_cache_status, job = await sync_to_async(defer_answer)(
+                    query, res["hits"]["hits"], context_parts, job_priority
+                )
+
+        # Step 5: Count the query for suggestions and return comprehensive response
+        if documents:
+            await sync_to_async(record_query)(query)
+        return build_response(query, expanded_terms, res, documents, k, llm_answer,
+                              cache={"answer": answer_cache_status}, degraded=deadline.degraded, job=job)
+
+def encode_cursor(sort_values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Malformed cursor")
+    # [score, document ID]; bool is an int but no score
+    score, doc_id = values
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not isinstance(doc_id, str):
+        raise ValueError("Malformed cursor")
+    return values
+
+def search_results(request):
+    """
+    Retrieval only, without LLM expansion or generation, for result lists
+    and infinite scroll while the answer is fetched separately.
+
+    Parameters: `q`; `size` (1-100, default 10); `expand` (none, cached or
+    local, default cached: terms an earlier search got from the LLM);
+    `fields` (comma-separated stored fields); `tag` (repeatable, documents
+    must carry every tag); `cursor` (`next_cursor` of the previous page).
+    """
+    query, _, error = parse_search_params(request)
+    if error:
+        return error
+
+    try:
+        size = max(1, min(int(request.GET.get('size', 10)), RESULTS_MAX_SIZE))
     except ValueError:
-        k = 5
+        size = 10
+
+    expand = request.GET.get('expand', 'cached')
+    if expand not in ('none', 'cached', 'local'):
+        return JsonResponse({"status": "error", "detail": "expand must be none, cached or local"}, status=400)
+
+    fields = [field.strip() for field in request.GET.get('fields', '').split(',') if field.strip()] or RESULT_FIELDS
+    unknown = set(fields) - set(FIELD_NAMES)
+    if unknown:
+        return JsonResponse({"status": "error", "detail": f"Unknown fields: {', '.join(sorted(unknown))}"},
+                            status=400)
+
+    search_after = None
+    if request.GET.get('cursor'):
+        try:
+            search_after = decode_cursor(request.GET['cursor'])
+        except (ValueError, binascii.Error):
+            return JsonResponse({"status": "error", "detail": "Invalid cursor"}, status=400)
 
     try:
-        # Step 1: Expand the query
-        expanded_terms = expand_query(query)
-        
-        # Step 2: Build enhanced search query
-        # Combine original query with expanded terms
-        search_query = query
-        if expanded_terms:
-            search_query = f"{query} {' '.join(expanded_terms)}"
-
-        # Step 3: Search for top k documents using expanded query
-        search_body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {
-                            "multi_match": {
-                                "query": query,  # Original query as main requirement
-                                "fields": ["title^3", "abstract^2", "main_text"],
-                                "type": "best_fields"
-                            }
-                        }
-                    ],
-                    "should": [
-                        # Boost with expanded terms
-                        {
-                            "multi_match": {
-                                "query": " ".join(expanded_terms),
-                                "fields": ["title^2", "abstract", "main_text"],
-                                "type": "cross_fields"
-                            }
-                        }
-                    ],
-                    "minimum_should_match": 0
-                }
-            },
-            "highlight": {
-                "fields": {
-                    "title": {},
-                    "abstract": {},
-                    "main_text": {"fragment_size": 150}
-                }
-            }
-        }
-
-        res = es.search(index="medicine", size=k, body=search_body)
-        hits = res["hits"]["hits"]
+        # Step 1: Expansion terms that cost no LLM call
+        with stage("expansion", view="results"):
+            if expand == 'cached':
+                expanded_terms = expansion_cache.get(query) or []
+            elif expand == 'local':
+                expanded_terms = local_expand_query(query)
+            else:
+                expanded_terms = []
 
-        # Step 4: Prepare documents for both return and RAG context
-        documents = []
-        context_parts = []
-
-        for i, hit in enumerate(hits, 1):
-            source = hit["_source"]
-            
-            # Document info for return
-            doc_info = {
-                "rank": i,
-                "id": hit["_id"],
-                "score": hit["_score"],
-                "title": source["title"],
-                "abstract": source.get("abstract", "")[:300] + "..." if len(source.get("abstract", "")) > 300 else source.get("abstract", ""),
-                "url": source.get("url", ""),
-                "highlights": hit.get("highlight", {})
-            }
-            documents.append(doc_info)
-
-            # Context for RAG (include more text)
-            doc_context = f"""Document {i}:
-Title: {source["title"]}
-Abstract: {source.get("abstract", "")}
-Content: {source["main_text"][:800]}{"..." if len(source["main_text"]) > 800 else ""}
-"""
-            context_parts.append(doc_context)
-
-        # Step 5: Perform RAG with retrieved documents
-        if documents:
-            full_context = "\n\n".join(context_parts)
-            
-            rag_prompt = f"""You are a medical expert assistant. Based on the provided medical documents, answer the user's question comprehensively and accurately.
+        # Step 2: One page of hits
+        with stage("retrieval", view="results"):
+            res = retrieve_page(query, expanded_terms, size, request.GET.getlist('tag'), fields, search_after)
+
+    except Exception as e:
+        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
+
+    hits = res["hits"]["hits"]
+    return FastJsonResponse({
+        "query": {"original": query, "expansion": expand, "expanded_terms": expanded_terms},
+        "total": res["hits"]["total"],
+        "documents": [{"id": hit["_id"], "score": hit["_score"], **hit["_source"]} for hit in hits],
+        # A short page is the last one
+        "next_cursor": encode_cursor(hits[-1]["sort"]) if len(hits) == size else None,
+    })
+
+# Shared by all batch requests, so concurrent batches together make at most
+# SEARCH_BATCH_WORKERS expansion and generation calls per process
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def get_batch_pool() -> ThreadPoolExecutor:
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPoolExecutor(max_workers=settings.SEARCH_BATCH_WORKERS,
+                                             thread_name_prefix="search-batch")
+        return _batch_pool
+
+def search_suggest(request):
+    """
+    Typeahead suggestions for the partial query `q`: titles and tags from
+    the corpus and popular past queries, best first. Answered from memory,
+    so it can be called on every keystroke.
+    """
+    prefix = request.GET.get('q', '')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', settings.SUGGEST_LIMIT)), 20))
+    except ValueError:
+        return JsonResponse({"status": "error", "detail": "limit must be an integer"}, status=400)
+
+    try:
+        with stage("suggest", view="suggest"):
+            suggestions = suggest(prefix, limit)
+        return FastJsonResponse({"query": prefix, "suggestions": suggestions})
+
+    except Exception as e:
+        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
+
+def parse_batch_request(request):
+    """
+    Validate a batch body. Returns ([(query, k)], mode, expand, error_response).
+    """
+    if request.method != 'POST':
+        return None, None, None, JsonResponse({"status": "error", "detail": "Use POST method"}, status=405)
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return None, None, None, JsonResponse({"status": "error", "detail": "Body must be JSON"}, status=400)
+    if not isinstance(body, dict) or not isinstance(body.get('queries'), list) or not body['queries']:
+        return None, None, None, JsonResponse(
+            {"status": "error", "detail": "queries must be a non-empty list"}, status=400)
+    if len(body['queries']) > settings.SEARCH_BATCH_MAX_QUERIES:
+        return None, None, None, JsonResponse(
+            {"status": "error", "detail": f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries per batch"},
+            status=400)
+
+    searches = []
+    for entry in body['queries']:
+        # Each entry is a query string or {"q": ..., "k": ...}
+        entry = entry if isinstance(entry, dict) else {"q": entry}
+        query = entry.get('q')
+        if not isinstance(query, str) or not query.strip():
+            return None, None, None, JsonResponse(
+                {"status": "error", "detail": "Every query must be a non-empty string"}, status=400)
+        try:
+            k = max(1, min(int(entry.get('k', body.get('k', 5))), 20))
+        except (TypeError, ValueError):
+            k = 5
+        searches.append((query.strip(), k))
+
+    mode = body.get('mode', settings.SEARCH_RETRIEVAL_MODE)
+    if mode not in ('bm25', 'hybrid'):
+        mode = settings.SEARCH_RETRIEVAL_MODE
+    expand = body.get('expand', True) not in (False, 0, '0', 'false', 'no', 'off')
+    return searches, mode, expand, None
+
+@csrf_exempt
+def search_batch(request):
+    """
+    Run many searches in one request:
 
-Use the information from the documents below to provide a detailed, evidence-based answer. If the documents don't contain sufficient information to fully answer the question, clearly state what information is missing.
+        POST {"queries": ["...", {"q": "...", "k": 3}], "k": 5, "mode": "bm25", "expand": true}
 
-Medical Documents:
-{full_context}
+    Queries are expanded concurrently, retrieved together in one `_msearch`
+    and answered by a bounded pool of generation workers, so a batch takes
+    about as long as its slowest query. Each result has its own status; a
+    failing query does not fail the batch.
+    """
+    searches, mode, expand, error = parse_batch_request(request)
+    if error:
+        return error
 
-Question: {query}
+    try:
+        results = run_batch_pipeline(searches, mode, expand)
+    except Exception as e:
+        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
 
-Please provide a comprehensive answer based on the medical documents above:"""
+    return FastJsonResponse({
+        "count": len(results),
+        "errors": sum(1 for result in results if result["status"] == "error"),
+        "results": results,
+    })
 
+def run_batch_pipeline(searches: list[tuple[str, int]], mode: str, expand: bool) -> list[dict]:
+    pool = get_batch_pool()
+    # Repeated (query, k) pairs are only searched and answered once
+    unique = list(dict.fromkeys(searches))
+
+    # Step 1: Expand all queries concurrently
+    with stage("expansion", view="batch"):
+        expansion_futures = [pool.submit(expand_query, query) if expand else None for query, _ in unique]
+        expansions = []
+        for (query, _), future in zip(unique, expansion_futures):
             try:
-                rag_response = client.chat.completions.create(
-                    model="mistralai/Mistral-7B-Instruct-v0.3",
-                    messages=[
-                        {"role": "user", "content": rag_prompt}
-                    ],
-                    max_tokens=600,
-                    temperature=0.2  # Lower temperature for more factual responses
-                )
-                
-                llm_answer = rag_response.choices[0].message.content
+                expansions.append(future.result() if future else [])
+            except Exception as e:
+                logger.warning(f"Query expansion failed for {query!r}: {e}")
+                expansions.append([])
+
+    # Step 2: Retrieve every query in one round trip
+    with stage("retrieval", view="batch"):
+        try:
+            responses = retrieve_many([(query, expanded_terms, k)
+                                       for (query, k), expanded_terms in zip(unique, expansions)], mode)
+        except Exception as e:
+            responses = [e] * len(unique)
+
+    # Step 3: Generate answers in the worker pool
+    def answer(query, k, expanded_terms, res):
+        hits = res["hits"]["hits"]
+        documents, context_parts = build_documents(hits)
+        llm_answer, answer_cache_status = generate_answer(query, hits, context_parts)
+        return build_response(query, expanded_terms, res, documents, k, llm_answer,
+                              cache={"answer": answer_cache_status})
+
+    with stage("generation", view="batch"):
+        answer_futures = [
+            None if isinstance(res, Exception) else pool.submit(answer, query, k, expanded_terms, res)
+            for (query, k), expanded_terms, res in zip(unique, expansions, responses)
+        ]
+        outcomes = {}
+        for search, res, future in zip(unique, responses, answer_futures):
+            try:
+                outcomes[search] = {"status": "ok", **future.result()} if future else res
             except Exception as e:
-                llm_answer = f"Error generating answer: {str(e)}"
+                outcomes[search] = e
+
+    # Step 4: One result per requested query, in request order
+    results = []
+    for position, search in enumerate(searches):
+        outcome = outcomes[search]
+        if isinstance(outcome, Exception):
+            results.append({"index": position, "status": "error", "detail": str(outcome)})
         else:
-            llm_answer = "No relevant documents found to answer your question."
+            results.append({"index": position, **outcome})
+    return results
 
-        # Step 6: Return comprehensive response
-        return JsonResponse({
-            "query": {
-                "original": query,
-                "expanded_terms": expanded_terms,
-                "final_search_query": search_query
-            },
-            "search_results": {
-                "total_found": res["hits"]["total"]["value"],
-                "returned_count": len(documents),
-                "k_requested": k,
-                "documents": documents
-            },
-            "rag_answer": {
-                "answer": llm_answer,
-                "confidence": "high" if len(documents) >= 3 else "medium" if len(documents) >= 1 else "low"
-            }
-        })
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+async def search_stream(request):
+    """
+    Server-Sent Events version of search_with_rag.
+
+    Emits a `documents` event as soon as retrieval finishes, then one `token`
+    event per generated chunk and a final `done` event. Serve it through the
+    ASGI application so the events are flushed as they are produced. When
+    the latency budget runs out mid-answer, the stream ends with a `done`
+    event that reports the generation as degraded.
+    """
+    query, k, error = parse_search_params(request)
+    if error:
+        return error
+    mode, expand = parse_retrieval_options(request)
+    budget = parse_budget(request)
+
+    async def events():
+        with deadline_scope(budget) as deadline:
+            async for event in stream_events(query, k, mode, expand, deadline):
+                yield event
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Stop proxies from buffering the stream
+    return response
 
+async def stream_events(query: str, k: int, mode: str, expand: bool, deadline):
+    """
+    The events of search_stream, within `deadline`.
+    """
+    def done(documents: list[dict], answer_cache_status: str) -> str:
+        data = {"confidence": answer_confidence(len(documents)), "cache": {"answer": answer_cache_status}}
+        if deadline.degraded:
+            data["degraded"] = deadline.degraded
+        return sse_event("done", data)
+
+    try:
+        with stage("expansion", view="stream"):
+            expanded_terms = await sync_to_async(expand_within_budget)(query) if expand else []
+        with stage("retrieval", view="stream"):
+            res = await aretrieve(query, expanded_terms, k, mode)
+        with stage("context", view="stream"):
+            documents, context_parts = build_documents(res["hits"]["hits"])
     except Exception as e:
-        return JsonResponse({"status": "error", "detail": str(e)}, status=500)
+        yield sse_event("error", {"status": "error", "detail": str(e)})
+        return
+
+    yield sse_event("documents", build_response(query, expanded_terms, res, documents, k,
+                                                degraded=deadline.degraded))
+
+    hits = res["hits"]["hits"]
+    if not hits:
+        yield sse_event("token", {"text": NO_DOCUMENTS_ANSWER})
+        yield done([], "bypass")
+        return
+    await sync_to_async(record_query)(query)
+
+    key_parts = answer_cache_parts(hits, MODEL)
+    cached = await sync_to_async(answer_cache.get)(query, *key_parts)
+    if cached is not None:
+        yield sse_event("token", {"text": cached})
+        yield done(documents, "hit")
+        return
+
+    if time_left() < settings.SEARCH_MIN_GENERATION_TIME:
+        degrade("generation", "skipped")
+        yield done(documents, "miss")
+        return
+
+    answer_parts = []
+    try:
+        with stage("generation", view="stream"), upstream_call("llm"):
+            stream = await asyncio.wait_for(get_async_llm().chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "user", "content": build_rag_prompt(query, context_parts)}
+                ],
+                max_tokens=ANSWER_MAX_TOKENS,
+                temperature=ANSWER_TEMPERATURE,
+                stream=True
+            ), timeout=time_left())
+            chunks = aiter(stream)
+            while True:
+                # Every chunk has to arrive within what is left of the budget
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), timeout=time_left())
+                except StopAsyncIteration:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer_parts.append(chunk.choices[0].delta.content)
+                    yield sse_event("token", {"text": chunk.choices[0].delta.content})
+    except asyncio.TimeoutError:
+        # A cut-off answer is not cached
+        degrade("generation", "timeout")
+    except Exception as e:
+        logger.warning(f"Answer generation failed: {e}")
+        yield sse_event("error", {"status": "error", "detail": f"Error generating answer: {str(e)}"})
+    else:
+        await sync_to_async(answer_cache.set)(query, "".join(answer_parts), *key_parts)
+    # Streamed chunks carry one generated token each
+    LLM_TOKENS.inc(len(answer_parts), call="generation", kind="completion")
+
+    yield done(documents, "miss")
+
+def job_status(request, job_id):
+    """
+    A background generation job; carries `rag_answer` once it is done.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({"status": "error", "detail": "Job not found"}, status=404)
+    return FastJsonResponse(job_payload(job))
+
+async def job_stream(request, job_id):
+    """
+    Server-Sent Events for a background generation job: a `status` event
+    whenever its status or queue position changes, then `answer` (or
+    `error`) and `done`. Gives up when nothing changes for SEARCH_JOB_TIMEOUT.
+    """
+    job = await sync_to_async(get_job)(job_id)
+    if job is None:
+        return JsonResponse({"status": "error", "detail": "Job not found"}, status=404)
+
+    async def events():
+        current, last, changed = job, None, time.monotonic()
+        while current is not None:
+            payload = await sync_to_async(job_payload)(current)
+            state = {key: payload[key] for key in ("status", "queue_position") if key in payload}
+            if state != last:
+                last, changed = state, time.monotonic()
+                yield sse_event("status", state)
+            if "rag_answer" in payload:
+                yield sse_event("answer", payload["rag_answer"])
+                break
+            if "detail" in payload:
+                yield sse_event("error", {"status": "error", "detail": payload["detail"]})
+                break
+            if time.monotonic() - changed > settings.SEARCH_JOB_TIMEOUT:
+                yield sse_event("error", {"status": "error", "detail": "Timed out waiting for the job"})
+                break
+            await asyncio.sleep(settings.SEARCH_JOB_POLL_INTERVAL)
+            current = await sync_to_async(get_job)(job_id)
+        yield sse_event("done", {"id": str(job_id), "status": last["status"]})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 # Keep the old functions for backward compatibility, but mark them as deprecated
 def search(request):
@@ -13,9 +13,14 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings and the upstream credentials can come from a .env file
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -42,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'search.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'search.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,6 +90,205 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Query expansions and RAG answers use file-based caches so every gunicorn
+# worker shares the same entries; a per-process cache would miss on most
+# workers.
+
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'expansions': {
+        'BACKEND': 'search.cache.LRUFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'expansions'),
+        'TIMEOUT': int(os.getenv('EXPANSION_CACHE_TTL', 60 * 60 * 24)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('EXPANSION_CACHE_MAX_ENTRIES', 10000)),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    'answers': {
+        'BACKEND': 'search.cache.LRUFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'answers'),
+        'TIMEOUT': int(os.getenv('ANSWER_CACHE_TTL', 60 * 60 * 6)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 5000)),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    # Result slots shared between workers by request coalescing
+    'coalesce': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'coalesce'),
+        'TIMEOUT': 60,
+    },
+}
+
+
+# Expansions and answers are cached per canonical query: its content words,
+# stemmed and sorted, so rewordings of a question share an entry. On a miss,
+# an entry of a recent query whose words overlap by at least
+# QUERY_SIMILARITY_THRESHOLD (Jaccard similarity) is used instead; answers
+# still need the same retrieved documents. 1 turns this lookup off.
+QUERY_SIMILARITY_THRESHOLD = float(os.getenv('QUERY_SIMILARITY_THRESHOLD', 0.8))
+
+# Upstream clients (search.clients), created on first use in each process.
+# Elasticsearch requests time out after ES_REQUEST_TIMEOUT seconds (a
+# request's latency budget can cut that shorter) and are retried up to
+# ES_MAX_RETRIES times; each process keeps up to ES_MAX_CONNECTIONS
+# connections per node. Inference calls time out after LLM_REQUEST_TIMEOUT
+# seconds, with up to LLM_MAX_CONNECTIONS pooled connections per process;
+# beyond LLM_MAX_CONNECTIONS concurrent calls within a deadline, expansion
+# and generation are skipped.
+# Idle pooled connections send TCP keep-alive probes after
+# CLIENT_KEEPALIVE_IDLE seconds (0 disables).
+ES_REQUEST_TIMEOUT = float(os.getenv('ES_REQUEST_TIMEOUT', 10.0))
+ES_MAX_CONNECTIONS = int(os.getenv('ES_MAX_CONNECTIONS', 10))
+ES_MAX_RETRIES = int(os.getenv('ES_MAX_RETRIES', 3))
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 120.0))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 10))
+CLIENT_KEEPALIVE_IDLE = float(os.getenv('CLIENT_KEEPALIVE_IDLE', 60.0))
+
+# When a server starts, every worker opens ES_WARMUP_CONNECTIONS connections
+# to Elasticsearch in the background (and with ES_WARMUP_QUERIES runs a few
+# searches), LLM_WARMUP_CONNECTIONS to the inference endpoint, and loads its
+# local indexes; /search/ready/ answers 503 until then. Only runserver,
+# gunicorn, uvicorn, daphne, hypercorn and uwsgi warm up on start; under
+# other servers the first /search/ready/ call starts it.
+CLIENT_WARMUP = os.getenv('CLIENT_WARMUP', 'True').lower() in ('1', 'true', 'yes')
+ES_WARMUP_CONNECTIONS = int(os.getenv('ES_WARMUP_CONNECTIONS', 4))
+ES_WARMUP_QUERIES = os.getenv('ES_WARMUP_QUERIES', 'False').lower() in ('1', 'true', 'yes')
+LLM_WARMUP_CONNECTIONS = int(os.getenv('LLM_WARMUP_CONNECTIONS', 2))
+
+# Search pipeline
+# SEARCH_BACKEND picks where hits come from: 'elasticsearch', or 'local' for
+# the in-process BM25 index built by `manage.py build_local_index`.
+
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'elasticsearch')
+LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', os.path.join(BASE_DIR, 'local_index'))
+
+# Query expansion source: 'llm', 'local' (corpus-derived dictionary from
+# `manage.py build_expansions`) or 'local+llm' (dictionary first, LLM when
+# it has nothing for the query).
+QUERY_EXPANSION = os.getenv('QUERY_EXPANSION', 'llm')
+EXPANSIONS_FILE = os.getenv('EXPANSIONS_FILE', os.path.join(BASE_DIR, 'expansions', 'expansions.json'))
+
+# Typeahead suggestions (/search/suggest/): titles and tags from
+# `manage.py build_suggestions`, or with SEARCH_SUGGEST_BACKEND =
+# 'elasticsearch' the index's `suggest` completion field (requests time out
+# after SUGGEST_ES_TIMEOUT seconds). Queries that found documents at least
+# SUGGEST_MIN_QUERY_COUNT times are suggested too, scoring
+# SUGGEST_POPULAR_WEIGHT per search; the top SUGGEST_MAX_POPULAR are reloaded
+# every SUGGEST_REFRESH_INTERVAL seconds. Each process counts searches in
+# memory and writes them at most every SUGGEST_FLUSH_INTERVAL seconds;
+# SUGGEST_RECORD_QUERIES = False stops counting.
+SEARCH_SUGGEST_BACKEND = os.getenv('SEARCH_SUGGEST_BACKEND', 'local')
+SUGGESTIONS_FILE = os.getenv('SUGGESTIONS_FILE', os.path.join(BASE_DIR, 'suggestions', 'suggestions.json'))
+SUGGEST_LIMIT = int(os.getenv('SUGGEST_LIMIT', 8))
+SUGGEST_ES_TIMEOUT = float(os.getenv('SUGGEST_ES_TIMEOUT', 0.5))
+SUGGEST_MIN_QUERY_COUNT = int(os.getenv('SUGGEST_MIN_QUERY_COUNT', 3))
+SUGGEST_POPULAR_WEIGHT = float(os.getenv('SUGGEST_POPULAR_WEIGHT', 1.0))
+SUGGEST_MAX_POPULAR = int(os.getenv('SUGGEST_MAX_POPULAR', 10000))
+SUGGEST_REFRESH_INTERVAL = float(os.getenv('SUGGEST_REFRESH_INTERVAL', 60.0))
+SUGGEST_RECORD_QUERIES = os.getenv('SUGGEST_RECORD_QUERIES', 'True').lower() in ('1', 'true', 'yes')
+SUGGEST_FLUSH_INTERVAL = float(os.getenv('SUGGEST_FLUSH_INTERVAL', 10.0))
+
+# Dense retrieval for `mode=hybrid`: BM25 and vector hits fused by reciprocal
+# rank fusion. Vectors come from `manage.py build_dense_index`. The
+# 'hashing' encoder is a lexical placeholder for tests and benchmarks, and
+# `manage.py check` rejects it when hybrid is the default mode.
+SEARCH_RETRIEVAL_MODE = os.getenv('SEARCH_RETRIEVAL_MODE', 'bm25')
+DENSE_INDEX_DIR = os.getenv('DENSE_INDEX_DIR', os.path.join(BASE_DIR, 'dense_index'))
+DENSE_ENCODER = os.getenv('DENSE_ENCODER', 'sentence-transformers')
+DENSE_ENCODER_MODEL = os.getenv('DENSE_ENCODER_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 50))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', 60))
+
+# Build the RAG context from passages instead of the start of each
+# document: the best passages per document from the index built by
+# `index_data --passages`, packed into a fixed token budget. Backends
+# without a passages index split main_text on the fly.
+SEARCH_PASSAGES = os.getenv('SEARCH_PASSAGES', 'False').lower() in ('1', 'true', 'yes')
+
+# Seconds the async view waits for query expansion before answering with
+# the unexpanded first-pass hits.
+
+SEARCH_EXPANSION_TIMEOUT = float(os.getenv('SEARCH_EXPANSION_TIMEOUT', 3.0))
+
+# Every search runs within a latency budget of SEARCH_LATENCY_BUDGET seconds,
+# which a request can change with `budget` (up to SEARCH_LATENCY_BUDGET_MAX).
+# Expansion may use SEARCH_EXPANSION_BUDGET_SHARE of it, or is skipped when
+# that is under SEARCH_MIN_EXPANSION_TIME and no local or cached terms exist.
+# Generation is skipped with less than SEARCH_MIN_GENERATION_TIME left and
+# abandoned when the budget runs out; the response then has no answer and
+# lists the stages that gave way under `degraded`. Elasticsearch searches
+# still running after SEARCH_HEDGE_DELAY seconds get a backup request
+# (0 disables hedging), for at most SEARCH_HEDGE_MAX_RATIO of searches.
+SEARCH_LATENCY_BUDGET = float(os.getenv('SEARCH_LATENCY_BUDGET', 30.0))
+SEARCH_LATENCY_BUDGET_MAX = float(os.getenv('SEARCH_LATENCY_BUDGET_MAX', 120.0))
+SEARCH_EXPANSION_BUDGET_SHARE = float(os.getenv('SEARCH_EXPANSION_BUDGET_SHARE', 0.25))
+SEARCH_MIN_EXPANSION_TIME = float(os.getenv('SEARCH_MIN_EXPANSION_TIME', 1.0))
+SEARCH_MIN_GENERATION_TIME = float(os.getenv('SEARCH_MIN_GENERATION_TIME', 2.0))
+SEARCH_HEDGE_DELAY = float(os.getenv('SEARCH_HEDGE_DELAY', 0.5))
+SEARCH_HEDGE_MAX_RATIO = float(os.getenv('SEARCH_HEDGE_MAX_RATIO', 0.05))
+
+# Background generation (`defer=1`): answers are queued as jobs in the
+# default database and run by `manage.py generation_worker`, at most
+# SEARCH_JOB_CONCURRENCY at a time across all workers. Searches are answered
+# without a job once SEARCH_JOB_MAX_QUEUED jobs are waiting. A job running
+# longer than SEARCH_JOB_TIMEOUT seconds is requeued, failures are retried
+# up to SEARCH_JOB_MAX_ATTEMPTS in all (after SEARCH_JOB_RETRY_DELAY seconds,
+# doubling each time), and finished jobs are deleted after SEARCH_JOB_TTL
+# seconds. Workers and job event streams check the queue every
+# SEARCH_JOB_POLL_INTERVAL seconds. SEARCH_JOB_TIMEOUT must exceed
+# LLM_REQUEST_TIMEOUT by 30 seconds (checked at startup), so a job still
+# waiting for the LLM isn't handed to a second worker.
+SEARCH_JOB_CONCURRENCY = int(os.getenv('SEARCH_JOB_CONCURRENCY', 4))
+SEARCH_JOB_MAX_QUEUED = int(os.getenv('SEARCH_JOB_MAX_QUEUED', 500))
+SEARCH_JOB_DEFAULT_PRIORITY = int(os.getenv('SEARCH_JOB_DEFAULT_PRIORITY', 5))
+SEARCH_JOB_TIMEOUT = float(os.getenv('SEARCH_JOB_TIMEOUT', LLM_REQUEST_TIMEOUT + 60))
+SEARCH_JOB_MAX_ATTEMPTS = int(os.getenv('SEARCH_JOB_MAX_ATTEMPTS', 3))
+SEARCH_JOB_RETRY_DELAY = float(os.getenv('SEARCH_JOB_RETRY_DELAY', 5.0))
+SEARCH_JOB_TTL = int(os.getenv('SEARCH_JOB_TTL', 24 * 60 * 60))
+SEARCH_JOB_POLL_INTERVAL = float(os.getenv('SEARCH_JOB_POLL_INTERVAL', 0.5))
+
+# POST /search/batch/: at most SEARCH_BATCH_MAX_QUERIES queries per request.
+# Expansion and generation for all batches in a worker process share a pool
+# of SEARCH_BATCH_WORKERS threads.
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', 100))
+SEARCH_BATCH_WORKERS = int(os.getenv('SEARCH_BATCH_WORKERS', 8))
+
+# Identical concurrent searches and LLM expansions share one upstream call.
+# Workers coordinate through lock files; followers in other workers wait up
+# to SEARCH_COALESCE_TIMEOUT seconds (or their latency budget) for the
+# leader's result, which is kept for SEARCH_COALESCE_RESULT_TTL seconds. A
+# lock is broken as stale only after SEARCH_LATENCY_BUDGET_MAX seconds.
+SEARCH_COALESCE = os.getenv('SEARCH_COALESCE', 'True').lower() in ('1', 'true', 'yes')
+SEARCH_COALESCE_DIR = os.getenv('SEARCH_COALESCE_DIR', os.path.join(CACHE_DIR, 'locks'))
+SEARCH_COALESCE_TIMEOUT = float(os.getenv('SEARCH_COALESCE_TIMEOUT', 30.0))
+SEARCH_COALESCE_RESULT_TTL = int(os.getenv('SEARCH_COALESCE_RESULT_TTL', 10))
+
+# Prometheus metrics: every worker writes its counters to METRICS_DIR at most
+# once per METRICS_FLUSH_INTERVAL seconds and /search/metrics merges them.
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(CACHE_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+
+# Opt-in request profiling: with SEARCH_PROFILING on, requests sent with an
+# `X-Search-Profile: 1` header, plus a SEARCH_PROFILING_SAMPLE_RATE fraction
+# of all requests, run under cProfile. /search/profiles/ lists the slowest.
+# The header and /search/profiles/ are reserved to staff users and to the
+# comma-separated INTERNAL_IPS.
+SEARCH_PROFILING = os.getenv('SEARCH_PROFILING', 'False').lower() in ('1', 'true', 'yes')
+SEARCH_PROFILING_SAMPLE_RATE = float(os.getenv('SEARCH_PROFILING_SAMPLE_RATE', 0.0))
+SEARCH_PROFILE_DIR = os.getenv('SEARCH_PROFILE_DIR', os.path.join(CACHE_DIR, 'profiles'))
+SEARCH_PROFILE_KEEP = int(os.getenv('SEARCH_PROFILE_KEEP', 200))
+INTERNAL_IPS = [ip.strip() for ip in os.getenv('INTERNAL_IPS', '127.0.0.1').split(',') if ip.strip()]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -120,6 +326,23 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')  # digunakan saat collectstatic
 
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'search': {'handlers': ['console'], 'level': os.getenv('SEARCH_LOG_LEVEL', 'INFO')},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 